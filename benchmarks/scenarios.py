@@ -0,0 +1,312 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+from threading import Condition, Thread
+import os
+import shutil
+import tempfile
+import time
+from timeit import default_timer
+
+import zmq
+
+from zmqrpc.ZmqCodec import codecs, compress_message, compressors, decode_message, decompress_message
+from zmqrpc.ZmqContext import destroy_shared_context, use_shared_context
+from zmqrpc.ZmqProxy import ZmqBrokerRep2ReqThread, ZmqBufferedProxyRep2ReqThread, ZmqProxyRep2PubThread, ZmqProxyRep2ReqThread, ZmqProxySub2PubThread, ZmqProxySub2ReqThread
+from zmqrpc.ZmqReceiver import ZmqReceiver
+from zmqrpc.ZmqRpcClient import ZmqRpcClient, serialize_function_call
+from zmqrpc.ZmqRpcServer import ZmqRpcServerThread
+from zmqrpc.ZmqSender import ZmqSender
+
+TRANSPORTS = ("tcp", "ipc", "inproc")
+PERCENTILES = (0.5, 0.9, 0.99)
+# Seconds to wait for the first message to arrive, and for the last one
+READY_TIME_OUT_IN_SEC = 10
+MESSAGE_TIME_OUT_IN_SEC = 30
+# Benchmark messages start with this prefix, followed by the time they were sent and padding up to their size
+MESSAGE_PREFIX = "zmqbench"
+WARM_UP_PREFIX = "zmqbench-warm-up"
+
+
+# Hands out unique addresses for a transport. The same address is used to bind and to connect.
+class Addresses(object):
+    def __init__(self, transport, port, directory):
+        if transport not in TRANSPORTS:
+            raise Exception("Unknown transport {0}. Use one of {1}.".format(transport, ", ".join(TRANSPORTS)))
+        self.transport = transport
+        self.port = port
+        self.directory = directory
+
+    def next(self):
+        self.port += 1
+        if self.transport == "tcp":
+            return "tcp://127.0.0.1:{0}".format(self.port)
+        if self.transport == "ipc":
+            return "ipc://{0}".format(os.path.join(self.directory, "{0}.ipc".format(self.port)))
+        return "inproc://zmqbench-{0}".format(self.port)
+
+
+# Returns a message of size characters that holds the time it was sent
+def create_message(prefix, size):
+    message = "{0} {1:.9f} ".format(prefix, default_timer())
+    return message + "x" * max(0, size - len(message))
+
+
+# A ZmqReceiver that measures the time from sending to receiving of benchmark messages and answers every message with OK
+class BenchmarkReceiver(ZmqReceiver):
+    def __init__(self, *args, **kwargs):
+        ZmqReceiver.__init__(self, *args, **kwargs)
+        self.condition = Condition()
+        self.warmed_up = False
+        self.latencies = []
+        self.last_receive_time = None
+
+    def handle_incoming_message(self, message):
+        now = default_timer()
+        # Plain messages are handed out as text, which is unicode on Python 2
+        if isinstance(message, type(u"")) and message.startswith(MESSAGE_PREFIX):
+            prefix, sent, _ = message.split(" ", 2)
+            with self.condition:
+                if prefix == WARM_UP_PREFIX:
+                    self.warmed_up = True
+                else:
+                    self.latencies.append(now - float(sent))
+                    self.last_receive_time = now
+                self.condition.notify_all()
+        return self.create_response_message(200, "OK", None)
+
+    # Waits until count messages are received. Returns False when that did not happen in time.
+    def wait_for_messages(self, count, time_out_in_sec=MESSAGE_TIME_OUT_IN_SEC):
+        return self.wait_until(lambda: len(self.latencies) >= count, time_out_in_sec)
+
+    def wait_for_warm_up(self, time_out_in_sec):
+        return self.wait_until(lambda: self.warmed_up, time_out_in_sec)
+
+    # Waits until the predicate holds, like Condition.wait_for, which Python 2 does not have
+    def wait_until(self, predicate, time_out_in_sec):
+        wait_until = default_timer() + time_out_in_sec
+        with self.condition:
+            while not predicate():
+                remaining = wait_until - default_timer()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
+
+
+# Runs a receiver on a thread, the same as the receiver threads of zmqrpc
+class BenchmarkReceiverThread(Thread):
+    def __init__(self, *args, **kwargs):
+        Thread.__init__(self)
+        self.receiver = BenchmarkReceiver(*args, **kwargs)
+
+    def run(self):
+        self.receiver.run()
+
+    def stop(self):
+        self.receiver.stop()
+
+
+# Returns the result of a benchmark from the latencies of the messages that arrived
+def create_result(messages, latencies, elapsed_in_sec):
+    latencies = sorted(latencies)
+    result = {"messages": messages, "received": len(latencies), "elapsed_in_sec": elapsed_in_sec,
+              "throughput_per_sec": len(latencies) / elapsed_in_sec if elapsed_in_sec > 0 else None, "latency_in_sec": None}
+    if latencies:
+        result["latency_in_sec"] = dict(("p{0:g}".format(q * 100), latencies[min(len(latencies) - 1, int(q * len(latencies)))]) for q in PERCENTILES)
+        result["latency_in_sec"].update(mean=sum(latencies) / len(latencies), max=latencies[-1])
+    return result
+
+
+# Sends messages one at a time with send, which returns when the response is there, and measures their round trip times
+def measure_round_trips(send, size, messages):
+    for _ in range(10):
+        send(create_message(WARM_UP_PREFIX, size))
+    latencies = []
+    start_time = default_timer()
+    for _ in range(messages):
+        sent = default_timer()
+        send(create_message(MESSAGE_PREFIX, size))
+        latencies.append(default_timer() - sent)
+    return create_result(messages, latencies, default_timer() - start_time)
+
+
+# Sends messages with send and measures the time until they reach the receiver. At most window messages are on their
+# way at the same time, so no socket drops messages when it reaches its high water mark.
+def measure_one_way(send, receiver, size, messages, window):
+    wait_until = time.time() + READY_TIME_OUT_IN_SEC
+    while not receiver.warmed_up:
+        if time.time() > wait_until:
+            raise Exception("No messages arrived within {0} seconds".format(READY_TIME_OUT_IN_SEC))
+        send(create_message(WARM_UP_PREFIX, size))
+        receiver.wait_for_warm_up(0.1)
+    start_time = default_timer()
+    for sent in range(messages):
+        if sent >= window and not receiver.wait_for_messages(sent - window + 1):
+            break
+        send(create_message(MESSAGE_PREFIX, size))
+    receiver.wait_for_messages(messages)
+    with receiver.condition:
+        latencies = list(receiver.latencies)
+        end_time = receiver.last_receive_time or default_timer()
+    return create_result(messages, latencies, end_time - start_time)
+
+
+def echo(message):
+    return message
+
+
+def benchmark_req_rep(addresses, components, size, messages, window):
+    address = addresses.next()
+    components.start(BenchmarkReceiverThread(zmq_rep_bind_address=address))
+    sender = components.add(ZmqSender(zmq_req_endpoints=[address], time_out_waiting_for_ready_in_sec=READY_TIME_OUT_IN_SEC))
+    return measure_round_trips(sender.send, size, messages)
+
+
+def benchmark_pub_sub(addresses, components, size, messages, window):
+    address = addresses.next()
+    receiver_thread = components.start(BenchmarkReceiverThread(zmq_sub_connect_addresses=[address]))
+    sender = components.add(ZmqSender(zmq_pub_endpoint=address, time_out_waiting_for_ready_in_sec=READY_TIME_OUT_IN_SEC))
+    return measure_one_way(sender.send, receiver_thread.receiver, size, messages, window)
+
+
+def benchmark_rpc_invoke(addresses, components, size, messages, window):
+    address = addresses.next()
+    components.start(ZmqRpcServerThread(zmq_rep_bind_address=address, rpc_functions={"echo": echo}))
+    client = components.add(ZmqRpcClient(zmq_req_endpoints=[address], time_out_waiting_for_ready_in_sec=READY_TIME_OUT_IN_SEC))
+    return measure_round_trips(lambda message: client.invoke("echo", {"message": message}, MESSAGE_TIME_OUT_IN_SEC), size, messages)
+
+
+# Returns a benchmark of a proxy from REQ to REP, measuring round trips through the proxy
+def rep2req_benchmark(create_proxy):
+    def benchmark(addresses, components, size, messages, window):
+        proxy_address, receiver_address = addresses.next(), addresses.next()
+        components.start(BenchmarkReceiverThread(zmq_rep_bind_address=receiver_address))
+        components.start(create_proxy(proxy_address, receiver_address, addresses))
+        sender = components.add(ZmqSender(zmq_req_endpoints=[proxy_address], time_out_waiting_for_ready_in_sec=READY_TIME_OUT_IN_SEC))
+        return measure_round_trips(sender.send, size, messages)
+    return benchmark
+
+
+# Returns a benchmark of a proxy from a REQ or PUB socket to a REP or SUB socket, measuring the time until messages
+# reach the receiver behind the proxy
+def one_way_benchmark(create_proxy, sender_socket, receiver_socket):
+    def benchmark(addresses, components, size, messages, window):
+        proxy_address, receiver_address = addresses.next(), addresses.next()
+        if receiver_socket == "rep":
+            receiver_thread = components.start(BenchmarkReceiverThread(zmq_rep_bind_address=receiver_address))
+        else:
+            receiver_thread = components.start(BenchmarkReceiverThread(zmq_sub_connect_addresses=[receiver_address]))
+        components.start(create_proxy(proxy_address, receiver_address, addresses))
+        if sender_socket == "req":
+            sender = components.add(ZmqSender(zmq_req_endpoints=[proxy_address], time_out_waiting_for_ready_in_sec=READY_TIME_OUT_IN_SEC))
+        else:
+            sender = components.add(ZmqSender(zmq_pub_endpoint=proxy_address, time_out_waiting_for_ready_in_sec=READY_TIME_OUT_IN_SEC))
+        return measure_one_way(sender.send, receiver_thread.receiver, size, messages, window)
+    return benchmark
+
+
+def create_buffered_proxy(proxy_address, receiver_address, addresses):
+    buffer_address = addresses.next()
+    return ZmqBufferedProxyRep2ReqThread(zmq_rep_bind_address=proxy_address, zmq_req_connect_addresses=[receiver_address], buffered_pub_address=buffer_address, buffered_sub_address=buffer_address)
+
+
+def create_journaled_proxy(proxy_address, receiver_address, addresses):
+    return ZmqBufferedProxyRep2ReqThread(zmq_rep_bind_address=proxy_address, zmq_req_connect_addresses=[receiver_address], journal_directory=tempfile.mkdtemp(dir=addresses.directory))
+
+
+# Returns a benchmark of encoding and decoding a function call with a codec. It does not use sockets.
+def codec_benchmark(codec_name):
+    def benchmark(addresses, components, size, messages, window):
+        codec = codecs[codec_name]
+        parameters = {"message": "x" * size}
+        latencies = []
+        start_time = default_timer()
+        for _ in range(messages):
+            started = default_timer()
+            decode_message(serialize_function_call("echo", parameters, codec))
+            latencies.append(default_timer() - started)
+        return create_result(messages, latencies, default_timer() - start_time)
+    return benchmark
+
+
+# Returns a benchmark of compressing and decompressing a json function call. It does not use sockets.
+def compression_benchmark(compression):
+    def benchmark(addresses, components, size, messages, window):
+        message = serialize_function_call("echo", {"message": " ".join(str(i) for i in range(size))[:size]}, codecs["json"])
+        latencies = []
+        start_time = default_timer()
+        for _ in range(messages):
+            started = default_timer()
+            decompress_message(compress_message(message, compression, 0))
+            latencies.append(default_timer() - started)
+        return create_result(messages, latencies, default_timer() - start_time)
+    return benchmark
+
+
+# Maps the name of every benchmark to its function. Benchmarks of sockets are run over every transport.
+SOCKET_SCENARIOS = {
+    "req_rep": benchmark_req_rep,
+    "pub_sub": benchmark_pub_sub,
+    "rpc_invoke": benchmark_rpc_invoke,
+    "proxy_rep2req": rep2req_benchmark(lambda proxy_address, receiver_address, addresses: ZmqProxyRep2ReqThread(zmq_rep_bind_address=proxy_address, zmq_req_connect_addresses=[receiver_address])),
+    "forwarder_rep2req": rep2req_benchmark(lambda proxy_address, receiver_address, addresses: ZmqProxyRep2ReqThread(zmq_rep_bind_address=proxy_address, zmq_req_connect_addresses=[receiver_address], forward_in_libzmq=True)),
+    "broker_rep2req": rep2req_benchmark(lambda proxy_address, receiver_address, addresses: ZmqBrokerRep2ReqThread(zmq_rep_bind_address=proxy_address, zmq_req_connect_addresses=[receiver_address])),
+    "proxy_rep2pub": one_way_benchmark(lambda proxy_address, receiver_address, addresses: ZmqProxyRep2PubThread(zmq_rep_bind_address=proxy_address, zmq_pub_bind_address=receiver_address), "req", "sub"),
+    "proxy_sub2req": one_way_benchmark(lambda proxy_address, receiver_address, addresses: ZmqProxySub2ReqThread(zmq_sub_connect_addresses=[proxy_address], zmq_req_connect_addresses=[receiver_address]), "pub", "rep"),
+    "proxy_sub2pub": one_way_benchmark(lambda proxy_address, receiver_address, addresses: ZmqProxySub2PubThread(zmq_sub_connect_addresses=[proxy_address], zmq_pub_bind_address=receiver_address), "pub", "sub"),
+    "forwarder_sub2pub": one_way_benchmark(lambda proxy_address, receiver_address, addresses: ZmqProxySub2PubThread(zmq_sub_connect_addresses=[proxy_address], zmq_pub_bind_address=receiver_address, forward_in_libzmq=True), "pub", "sub"),
+    "buffered_rep2req": one_way_benchmark(create_buffered_proxy, "req", "rep"),
+    "journaled_rep2req": one_way_benchmark(create_journaled_proxy, "req", "rep"),
+}
+SERIALIZATION_SCENARIOS = dict([("codec_" + name, codec_benchmark(name)) for name, codec in codecs.items() if codec.is_available()] +
+                               [("compression_" + name, compression_benchmark(name)) for name, compressor in compressors.items() if compressor.is_available()])
+SCENARIOS = dict(SOCKET_SCENARIOS, **SERIALIZATION_SCENARIOS)
+
+
+# Keeps the senders, receivers and proxies of a benchmark. Receivers and proxies are stopped in the order they were
+# started, before the senders are destroyed, so connecting sockets disconnect before the sockets they connect to go.
+class Components(object):
+    def __init__(self):
+        self.components = []
+
+    def add(self, component):
+        self.components.append(component)
+        return component
+
+    # Starts a receiver or proxy thread
+    def start(self, thread):
+        self.add(thread)
+        thread.start()
+        return thread
+
+    def stop(self):
+        for component in self.components:
+            if isinstance(component, Thread):
+                component.stop()
+                component.join()
+        for component in self.components:
+            if not isinstance(component, Thread):
+                component.destroy()
+
+
+# Runs a benchmark with messages of size bytes over the transport and returns its result. The transport of serialization
+# benchmarks is None. Addresses use ports after port for tcp. inproc benchmarks run on a shared context.
+def run_scenario(name, transport, size, messages, window=100, port=56000):
+    if transport == "ipc" and not zmq.has("ipc"):
+        raise Exception("The ipc transport is not available on this platform")
+    directory = tempfile.mkdtemp(prefix="zmqbench-")
+    components = Components()
+    if transport == "inproc":
+        use_shared_context()
+    try:
+        addresses = Addresses(transport, port, directory) if transport is not None else None
+        return SCENARIOS[name](addresses, components, size, messages, window)
+    finally:
+        components.stop()
+        # Not all proxies close the sockets of their sender, so the context is not terminated
+        if transport == "inproc":
+            destroy_shared_context(term=False)
+        shutil.rmtree(directory, True)
@@ -0,0 +1,136 @@
+'''
+Created on Oct 18, 2026
+
+@note: This utility measures the throughput and latency of zmqrpc sockets, proxies and serialization and writes
+       the results as json. It compares results with a baseline and reports regressions.
+       Run it from the root of the repository: python -m benchmarks.zmqbench --output results.json
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+import zmq
+
+from .scenarios import SCENARIOS, SERIALIZATION_SCENARIOS, TRANSPORTS, run_scenario
+
+DEFAULT_SIZES = (64, 1024, 65536)
+# Ports reserved for every run of a benchmark over tcp
+PORTS_PER_SCENARIO = 10
+# The latency percentiles that are compared with the baseline. The tail is compared with a tolerance of its own,
+# since it is much noisier.
+COMPARED_PERCENTILES = ("p50", "p99")
+TAIL_PERCENTILES = ("p99",)
+
+
+# Returns the key of the result of a benchmark. Serialization benchmarks do not use a transport.
+def result_key(name, transport, size):
+    if name in SERIALIZATION_SCENARIOS:
+        return "{0}/{1}".format(name, size)
+    return "{0}/{1}/{2}".format(name, transport, size)
+
+
+# Runs the benchmarks and returns a dict with the environment and the result of every benchmark by result_key.
+# Every benchmark runs repeats times, and the run with the median throughput is kept.
+def run_benchmarks(names, transports, sizes, messages, window=100, port=56000, repeats=3):
+    results = {}
+    for name in names:
+        for transport in ([None] if name in SERIALIZATION_SCENARIOS else transports):
+            for size in sizes:
+                key = result_key(name, transport, size)
+                runs = []
+                try:
+                    for _ in range(repeats):
+                        port += PORTS_PER_SCENARIO
+                        runs.append(run_scenario(name, transport, size, messages, window, port))
+                except Exception as e:
+                    results[key] = {"error": str(e)}
+                else:
+                    runs.sort(key=lambda run: run["throughput_per_sec"] or 0)
+                    results[key] = runs[len(runs) // 2]
+                print_result(key, results[key])
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(),
+            "pyzmq": zmq.pyzmq_version(), "libzmq": zmq.zmq_version(), "messages": messages, "window": window, "repeats": repeats, "results": results}
+
+
+def print_result(key, result):
+    if "error" in result:
+        print("{0:<40} error: {1}".format(key, result["error"]))
+        return
+    latency = result["latency_in_sec"] or {}
+    print("{0:<40} {1:>12.0f} msg/s  p50 {2:>9.1f} us  p99 {3:>9.1f} us  {4}/{5} received".format(
+        key, result["throughput_per_sec"] or 0, latency.get("p50", 0) * 1e6, latency.get("p99", 0) * 1e6, result["received"], result["messages"]))
+
+
+# Returns a list of (key, metric, baseline value, value) for every result that is worse than its baseline by more than
+# the tolerance, a fraction: a lower throughput, a higher latency percentile, fewer messages received or an error.
+# The tail latency may be worse by tail_tolerance. Benchmarks that are not in both are skipped.
+def find_regressions(baseline, results, tolerance=0.1, tail_tolerance=0.5):
+    regressions = []
+    for key, result in sorted(results["results"].items()):
+        baseline_result = baseline["results"].get(key)
+        if baseline_result is None or "error" in baseline_result:
+            continue
+        if "error" in result:
+            regressions.append((key, "error", None, result["error"]))
+            continue
+        if result["received"] < result["messages"] and result["received"] < baseline_result["received"]:
+            regressions.append((key, "received", baseline_result["received"], result["received"]))
+        if result["throughput_per_sec"] is not None and baseline_result["throughput_per_sec"] is not None and result["throughput_per_sec"] < baseline_result["throughput_per_sec"] * (1 - tolerance):
+            regressions.append((key, "throughput_per_sec", baseline_result["throughput_per_sec"], result["throughput_per_sec"]))
+        for percentile in COMPARED_PERCENTILES:
+            if result["latency_in_sec"] is None or baseline_result["latency_in_sec"] is None:
+                break
+            if result["latency_in_sec"][percentile] > baseline_result["latency_in_sec"][percentile] * (1 + (tail_tolerance if percentile in TAIL_PERCENTILES else tolerance)):
+                regressions.append((key, "latency_in_sec." + percentile, baseline_result["latency_in_sec"][percentile], result["latency_in_sec"][percentile]))
+    return regressions
+
+
+# Prints the regressions and returns the exit code: 1 when there are regressions
+def report_regressions(regressions):
+    if not regressions:
+        print("No regressions")
+        return 0
+    print("{0} regressions:".format(len(regressions)))
+    for key, metric, baseline_value, value in regressions:
+        print("  {0:<40} {1:<22} {2} -> {3}".format(key, metric, baseline_value, value))
+    return 1
+
+
+def load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures throughput and latency of zmqrpc sockets, proxies and serialization.')
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS), help='The benchmarks to run (default all)')
+    parser.add_argument('--transport', nargs='+', choices=TRANSPORTS, default=list(TRANSPORTS), help='The transports to run socket benchmarks over')
+    parser.add_argument('--size', nargs='+', type=int, default=list(DEFAULT_SIZES), help='The message sizes in bytes')
+    parser.add_argument('--messages', type=int, default=2000, help='Number of messages per benchmark')
+    parser.add_argument('--window', type=int, default=100, help='Number of one way messages on their way at the same time')
+    parser.add_argument('--repeats', type=int, default=3, help='Times to run every benchmark. The run with the median throughput is kept.')
+    parser.add_argument('--port', type=int, default=56000, help='First port of the tcp benchmarks')
+    parser.add_argument('--output', required=False, help='Write the results as json to this file')
+    parser.add_argument('--baseline', required=False, help='Compare the results with the results in this json file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULTS'), help='Only compare two json files with results')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Fraction the throughput and median latency may be worse than the baseline')
+    parser.add_argument('--tail_tolerance', type=float, default=0.5, help='Fraction the 99th percentile latency may be worse than the baseline')
+
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(report_regressions(find_regressions(load_results(args.compare[0]), load_results(args.compare[1]), args.tolerance, args.tail_tolerance)))
+
+    transports = [transport for transport in args.transport if transport != "ipc" or zmq.has("ipc")]
+    results = run_benchmarks(args.scenario or sorted(SCENARIOS), transports, args.size, args.messages, args.window, args.port, args.repeats)
+    if args.output:
+        with open(args.output, "w") as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+    if args.baseline:
+        sys.exit(report_regressions(find_regressions(load_results(args.baseline), results, args.tolerance, args.tail_tolerance)))
@@ -23,8 +23,8 @@ if __name__ == '__main__':
 
     server.start()
 
-    # Wait a bit since sockets may not have been connected immediately
-    time.sleep(2)
+    # Wait until the sockets are connected since that does not happen immediately
+    client.wait_ready(time_out_in_sec=2)
 
     client.invoke(
         function_name="test_method",
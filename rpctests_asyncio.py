@@ -0,0 +1,64 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+
+'''
+import asyncio
+import time
+import logging
+import unittest
+
+from zmqrpc.AsyncZmqRpcClient import AsyncZmqRpcClient
+from zmqrpc.AsyncZmqRpcServer import AsyncZmqRpcServer
+
+logger = logging.getLogger('zmqrpc')
+logger.setLevel(logging.DEBUG)
+
+
+def invoke_test(param1, param2):
+    return "{0}:{1}".format(param1, param2)
+
+async def invoke_async_slow_test(param1, delay_in_sec):
+    await asyncio.sleep(delay_in_sec)
+    return param1
+
+
+# Tests for the asyncio variants, which need Python 3.7 or later
+class TestZmqAsyncioPackage(unittest.TestCase):
+
+    def test_01_rpc_asyncio_client_and_server(self):
+        # Coroutine functions on an asyncio server overlap on one event loop
+        print("Test if the asyncio client and server handle many concurrent invocations")
+
+        async def run_test():
+            server = AsyncZmqRpcServer(zmq_router_bind_address="tcp://*:55103", rpc_functions={"invoke_async_slow_test": invoke_async_slow_test, "invoke_test": invoke_test}, username="username", password="password")
+            server_task = asyncio.ensure_future(server.run())
+            client = AsyncZmqRpcClient(zmq_dealer_endpoints=["tcp://localhost:55103"], username="username", password="password")
+            try:
+                response = await client.invoke(function_name="invoke_test", function_parameters={"param1": "value1", "param2": "value2"}, time_out_waiting_for_response_in_sec=3)
+                start_time = time.time()
+                responses = await asyncio.gather(*[client.invoke(function_name="invoke_async_slow_test", function_parameters={"param1": i, "delay_in_sec": 0.5}, time_out_waiting_for_response_in_sec=3) for i in range(100)])
+                duration = time.time() - start_time
+                try:
+                    await client.invoke(function_name="invoke_test_does_not_exist", time_out_waiting_for_response_in_sec=3)
+                    error = None
+                except Exception as e:
+                    error = str(e)
+            finally:
+                client.destroy()
+                server.stop()
+                await server_task
+            return response, responses, duration, error
+
+        response, responses, duration, error = asyncio.run(run_test())
+
+        self.assertEqual(response, "value1:value2")
+        self.assertEqual(responses, list(range(100)))
+        self.assertLess(duration, 2)
+        self.assertEqual(error, "Function 'invoke_test_does_not_exist' is not implemented on server. Check rpc_functions on server if it contains the function name")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s  %(message)s')
+    unittest.main()
@@ -11,6 +11,6 @@ setup(
     url='https://github.com/jverhoeven/pyzmqrpc',
     download_url='https://github.com/jverhoeven/pyzmqrpc/tarball/2.0.0',
     keywords=['zeromq', 'rpc', 'pyzmq'],
-    install_requires=["pyzmq>=15.0.0", "future>=0.15.0"],
+    install_requires=["pyzmq>=15.0.0", "future>=0.15.0", 'futures>=3.0.0; python_version < "3.0"'],
     classifiers=[]
 )
@@ -10,7 +10,7 @@ import argparse
 import signal
 import sys
 import logging
-from zmqrpc.ZmqProxy import ZmqProxyRep2Pub, ZmqProxySub2Req, ZmqProxyRep2Req, ZmqProxySub2Pub
+from zmqrpc.ZmqProxy import ZmqProxyRep2Pub, ZmqProxySub2Req, ZmqProxyRep2Req, ZmqProxySub2Pub, ZmqForwarderSub2Pub, ZmqForwarderRep2Req, ZmqBrokerRep2Req
 
 
 if __name__ == '__main__':
@@ -23,6 +23,14 @@ if __name__ == '__main__':
     parser.add_argument('--password_incoming', required=False, help='In case a password is needed for the incoming connection (sub, rep)')
     parser.add_argument('--username_outgoing', required=False, help='In case a username is needed for the outgoing connection (req, pub)')
     parser.add_argument('--password_outgoing', required=False, help='In case a password is needed for the outgoing connection (req, pub)')
+    parser.add_argument('--forward', action='store_true', help='Forward messages inside libzmq without decoding them (SUB->PUB and REP->REQ only)')
+    parser.add_argument('--broker', action='store_true', help='Handle many REP->REQ calls at the same time, each with its own time out')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for the response to a call (with --broker only)')
+    parser.add_argument('--window', type=int, default=1, help='Number of SUB->REQ messages in flight at the same time')
+    parser.add_argument('--ordered', action='store_true', help='Complete SUB->REQ messages in the order they came in (with --window only)')
+    parser.add_argument('--retries', type=int, default=0, help='Times to send a failed SUB->REQ message again')
+    parser.add_argument('--compression', required=False, help='Compress outgoing SUB->REQ and REP->REQ messages with zlib, lz4 or zstd for servers that list the compressor')
+    parser.add_argument('--capture', required=False, help='PUB endpoint that publishes a copy of all forwarded messages (with --forward only)')
 
     args = parser.parse_args()
 
@@ -45,15 +53,24 @@ if __name__ == '__main__':
         signal.signal(signal.SIGINT, signal_handler)
 
         if args.sub is not None and args.req is not None:
-            server = ZmqProxySub2Req(zmq_sub_connect_addresses=args.sub, zmq_req_connect_addresses=args.req, username_sub=args.username_incoming, password_sub=args.password_incoming, username_req=args.username_outgoing, password_req=args.password_outgoing)
+            server = ZmqProxySub2Req(zmq_sub_connect_addresses=args.sub, zmq_req_connect_addresses=args.req, username_sub=args.username_incoming, password_sub=args.password_incoming, username_req=args.username_outgoing, password_req=args.password_outgoing, window_size=args.window, ordered=args.ordered, max_retries=args.retries, compression=args.compression)
             server.run()
         elif args.rep is not None and args.pub is not None:
             server = ZmqProxyRep2Pub(zmq_rep_bind_address=args.rep, zmq_pub_bind_address=args.pub, username_rep=args.username_incoming, password_rep=args.password_incoming, username_pub=args.username_outgoing, password_pub=args.password_outgoing)
             server.run()
+        elif args.sub is not None and args.pub is not None and args.forward:
+            server = ZmqForwarderSub2Pub(zmq_sub_connect_addresses=args.sub, zmq_pub_bind_address=args.pub, capture_address=args.capture, username_sub=args.username_incoming, password_sub=args.password_incoming, username_pub=args.username_outgoing, password_pub=args.password_outgoing)
+            server.run()
         elif args.sub is not None and args.pub is not None:
             server = ZmqProxySub2Pub(zmq_sub_connect_addresses=args.sub, zmq_pub_bind_address=args.pub, username_sub=args.username_incoming, password_sub=args.password_incoming, username_pub=args.username_outgoing, password_pub=args.password_outgoing)
             server.run()
+        elif args.rep is not None and args.req is not None and args.forward:
+            server = ZmqForwarderRep2Req(zmq_rep_bind_address=args.rep, zmq_req_connect_addresses=args.req, capture_address=args.capture, username_rep=args.username_incoming, password_rep=args.password_incoming, username_req=args.username_outgoing, password_req=args.password_outgoing)
+            server.run()
+        elif args.rep is not None and args.req is not None and args.broker:
+            server = ZmqBrokerRep2Req(zmq_rep_bind_address=args.rep, zmq_req_connect_addresses=args.req, username_rep=args.username_incoming, password_rep=args.password_incoming, username_req=args.username_outgoing, password_req=args.password_outgoing, time_out_waiting_for_response_in_sec=args.timeout)
+            server.run()
         elif args.rep is not None and args.req is not None:
-            server = ZmqProxyRep2Req(zmq_rep_bind_address=args.rep, zmq_req_connect_addresses=args.req, username_rep=args.username_incoming, password_rep=args.password_incoming, username_req=args.username_outgoing, password_req=args.password_outgoing)
+            server = ZmqProxyRep2Req(zmq_rep_bind_address=args.rep, zmq_req_connect_addresses=args.req, username_rep=args.username_incoming, password_rep=args.password_incoming, username_req=args.username_outgoing, password_req=args.password_outgoing, compression=args.compression)
             server.run()
     logger.info("Stopped zmqproxy...")
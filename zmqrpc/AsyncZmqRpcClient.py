@@ -0,0 +1,148 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+import asyncio
+import itertools
+import logging
+import struct
+
+import zmq
+import zmq.asyncio
+
+from .ZmqCodec import DEFAULT_COMPRESSION_THRESHOLD, compress_message, encode_topic, frames_to_message, get_advertised_compressors, get_codec, get_compressor, message_to_frames, parse_advertised_compressors
+from .ZmqContext import get_asyncio_context
+from .ZmqRpcClient import parse_batch_response, serialize_function_call, serialize_function_calls
+from .ZmqSender import parse_response_message
+
+logger = logging.getLogger("zmqrpc")
+
+
+# The AsyncZmqRpcClient is the asyncio counterpart of the ZmqRpcClient, built on zmq.asyncio.
+# invoke is a coroutine. All invocations share one DEALER socket: each request is tagged with a
+# correlation id and a single reader task hands responses to the waiting coroutines, so thousands of
+# invocations can be in flight from one event loop. The DEALER socket talks to REP and ROUTER servers.
+# A PUB endpoint may be given instead, in which case no response is returned.
+# The codec, compression and use_topics work the same as for the ZmqRpcClient. Calls are only compressed over a DEALER
+# socket with a single endpoint, once its server listed the compressor. Unlike the ZmqRpcClient the client does not
+# notice a reconnect, so it keeps compressing when the server is replaced by an older version.
+# Python 3 only.
+class AsyncZmqRpcClient(object):
+    def __init__(self, zmq_dealer_endpoints=None, zmq_pub_endpoint=None, username=None, password=None, codec=None, compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD, use_topics=False):
+        self.context = get_asyncio_context()
+        self.codec = get_codec(codec or "json")
+        self.compression = get_compressor(compression).name if compression is not None else None
+        self.compression_threshold = compression_threshold
+        self.use_topics = use_topics
+        self.username = username
+        self.password = password
+        self.zmq_dealer_endpoints = zmq_dealer_endpoints
+        self.zmq_pub_endpoint = zmq_pub_endpoint
+        self.dealer_socket = None
+        self.pub_socket = None
+        self.reader_task = None
+        self.pending_responses = {}
+        self.correlation_ids = itertools.count(1)
+        # Compressors listed by the server, and the requests whose responses tell them
+        self.peer_compressors = None
+        self.learning_requests = set()
+        if zmq_dealer_endpoints:
+            self.dealer_socket = self.context.socket(zmq.DEALER)
+            self.dealer_socket.setsockopt(zmq.LINGER, 0)
+            if username and password:
+                self.dealer_socket.setsockopt_string(zmq.PLAIN_USERNAME, username)
+                self.dealer_socket.setsockopt_string(zmq.PLAIN_PASSWORD, password)
+            for endpoint in zmq_dealer_endpoints:
+                logger.debug("Connect DEALER socket to %s", endpoint)
+                self.dealer_socket.connect(endpoint)
+        if zmq_pub_endpoint:
+            self.pub_socket = self.context.socket(zmq.PUB)
+            self.pub_socket.setsockopt(zmq.LINGER, 0)
+            self.pub_socket.setsockopt(zmq.SNDHWM, 100000)
+            logger.debug("Bind PUB socket to %s", zmq_pub_endpoint)
+            self.pub_socket.bind(zmq_pub_endpoint)
+
+    async def read_responses(self):
+        while True:
+            frames = await self.dealer_socket.recv_multipart()
+            if len(frames) < 3 or frames[1] != b"":
+                logger.warning("Discarding incorrectly enveloped response on DEALER socket")
+                continue
+            response_future = self.pending_responses.pop(frames[0], None)
+            if response_future is None or response_future.done():
+                logger.debug("Discarding response for unknown or timed out request")
+                continue
+            response_message = frames_to_message(frames[2:])
+            if frames[0] in self.learning_requests:
+                self.learning_requests.discard(frames[0])
+                self.peer_compressors = parse_advertised_compressors(response_message)
+            try:
+                response_future.set_result(parse_response_message(response_message))
+            except Exception as e:
+                response_future.set_exception(e)
+
+    async def send(self, message, time_out_waiting_for_response_in_sec=60, topic=None):
+        if self.pub_socket is not None:
+            topic_frames = [encode_topic(topic)] if topic is not None else []
+            await self.pub_socket.send_multipart(topic_frames + message_to_frames(message), copy=False)
+        if self.dealer_socket is None:
+            return None
+
+        if self.reader_task is None:
+            self.reader_task = asyncio.ensure_future(self.read_responses())
+        correlation_id = struct.pack("!Q", next(self.correlation_ids))
+        response_future = asyncio.get_event_loop().create_future()
+        self.pending_responses[correlation_id] = response_future
+        message = self.compress_for_server(message, correlation_id)
+        await self.dealer_socket.send_multipart([correlation_id, b""] + message_to_frames(message), copy=False)
+        try:
+            return await asyncio.wait_for(response_future, time_out_waiting_for_response_in_sec)
+        except asyncio.TimeoutError:
+            raise Exception("No response received on ZMQ Request to end point {0} in {1} seconds. Discarding message.".format(self.zmq_dealer_endpoints, time_out_waiting_for_response_in_sec))
+        finally:
+            self.pending_responses.pop(correlation_id, None)
+            self.learning_requests.discard(correlation_id)
+
+    # Compresses a message when the server listed the compression. Otherwise the request is marked to learn the
+    # compressors from its response, when the server lists them in it.
+    def compress_for_server(self, message, correlation_id):
+        if self.compression is None or len(self.zmq_dealer_endpoints) != 1:
+            return message
+        if self.peer_compressors is not None:
+            if self.compression in self.peer_compressors:
+                return compress_message(message, self.compression, self.compression_threshold)
+        elif get_advertised_compressors(message) is not None:
+            self.learning_requests.add(correlation_id)
+        return message
+
+    # Invokes a function on a remote ZeroMQ process. Returns the result of the function when DEALER endpoints are used.
+    async def invoke(self, function_name, function_parameters=None, time_out_waiting_for_response_in_sec=600):
+        message = serialize_function_call(function_name, function_parameters, self.codec)
+        return await self.send(message, time_out_waiting_for_response_in_sec, function_name if self.use_topics else None)
+
+    # Invokes a list of (function_name, function_parameters) tuples in one round trip, see ZmqRpcClient.invoke_many
+    async def invoke_many(self, calls, time_out_waiting_for_response_in_sec=600):
+        message = serialize_function_calls(calls, self.codec)
+        call_results = await self.send(message, time_out_waiting_for_response_in_sec)
+        if call_results is None:
+            return None
+        return parse_batch_response(call_results)
+
+    async def send_heartbeat(self):
+        await self.send("zmq_sub_heartbeat")
+
+    def destroy(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        for response_future in self.pending_responses.values():
+            if not response_future.done():
+                response_future.set_exception(Exception("Client destroyed before a response was received."))
+        self.pending_responses = {}
+        if self.dealer_socket is not None:
+            self.dealer_socket.close()
+            self.dealer_socket = None
+        if self.pub_socket is not None:
+            self.pub_socket.close()
+            self.pub_socket = None
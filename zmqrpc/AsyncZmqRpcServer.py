@@ -0,0 +1,191 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+import asyncio
+import inspect
+import logging
+
+import zmq
+import zmq.asyncio
+from zmq.auth.asyncio import AsyncioAuthenticator
+
+from .ZmqCodec import DEFAULT_ACCEPTED_CODECS, create_subscriptions, get_advertised_compressors, frames_to_message, message_to_frames, split_topic
+from .ZmqContext import get_asyncio_context, get_authenticator, get_shared_context, release_authenticator
+from .ZmqReceiver import create_response_message
+from .ZmqRpcServer import ZmqRpcServer, call_rpc_function, compress_response, create_call_result, decode_function_call, get_response_compression, is_batch, parse_call
+
+logger = logging.getLogger("zmqrpc")
+
+
+# The AsyncZmqRpcServer is the asyncio counterpart of the ZmqRpcServer, built on zmq.asyncio.
+# rpc_functions may hold both plain functions and 'async def' functions; the latter are awaited.
+# Every request on the ROUTER socket and every message on the SUB sockets is dispatched as its own
+# task, so awaiting functions overlap on one event loop. A REP socket handles one request at a time.
+# Run it with 'await server.run()' and stop it with server.stop().
+# The codecs, compression and zmq_sub_topics work the same as for the ZmqRpcServer.
+# Python 3 only.
+class AsyncZmqRpcServer(object):
+    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, rpc_functions=None, username=None, password=None, zmq_router_bind_address=None, codecs=None, zmq_sub_topics=None):
+        self.context = get_asyncio_context()
+        if zmq_sub_topics is None:
+            zmq_sub_topics = list(rpc_functions or {})
+        self.sub_subscriptions = create_subscriptions(zmq_sub_topics, ZmqRpcServer.legacy_sub_prefixes)
+        self.rpc_functions = rpc_functions
+        self.accepted_codecs = codecs if codecs is not None else DEFAULT_ACCEPTED_CODECS
+        self.zmq_rep_bind_address = zmq_rep_bind_address
+        self.zmq_router_bind_address = zmq_router_bind_address
+        self.zmq_sub_connect_addresses = zmq_sub_connect_addresses
+        self.username = username
+        self.password = password
+        self.auth = None
+        self.last_received_message = None
+        self.is_running = False
+        self.sockets = []
+        self.server_tasks = []
+        self.tasks = set()
+
+    def create_socket(self, socket_type, address, bind):
+        zmq_socket = self.context.socket(socket_type)
+        zmq_socket.setsockopt(zmq.LINGER, 0)
+        if bind:
+            if self.auth is not None:
+                zmq_socket.plain_server = True
+            zmq_socket.bind(address)
+        else:
+            for subscription in self.sub_subscriptions:
+                zmq_socket.setsockopt(zmq.SUBSCRIBE, subscription)
+            # Heartbeat timeouts are not supported here, only the address is used
+            zmq_socket.connect(address if isinstance(address, str) else address[0])
+        self.sockets.append(zmq_socket)
+        return zmq_socket
+
+    # Returns a tuple of status_code, status_message and response_message
+    async def invoke_function(self, function_name, parameters):
+        try:
+            response_message = call_rpc_function(self.rpc_functions[function_name], parameters)
+            if inspect.isawaitable(response_message):
+                response_message = await response_message
+            return 200, "OK", response_message
+        except Exception as e:
+            status_message = "Exception raised when calling function {0}. Exception: {1} ".format(function_name, e)
+            logger.warning(status_message)
+            logger.exception(e)
+            return 463, status_message, None
+
+    # Invokes all calls of a batch in order, the same as the ZmqRpcServer does
+    async def handle_batch(self, calls, codec, compressors=None):
+        results = []
+        for call in calls:
+            status_code, status_message, function_name, parameters = parse_call(call, self.rpc_functions)
+            if status_code == 200:
+                results.append(await self.invoke_function(function_name, parameters))
+            else:
+                results.append((status_code, status_message, None))
+        return create_response_message(200, "OK", [create_call_result(*result) for result in results], codec, compressors)
+
+    async def handle_incoming_message(self, message):
+        if message == "zmq_sub_heartbeat":
+            return None
+        return compress_response(await self.handle_call(message), get_response_compression(message))
+
+    async def handle_call(self, message):
+        compressors = get_advertised_compressors(message)
+        status_code, status_message, incoming_message, codec = decode_function_call(message, self.accepted_codecs)
+        if status_code == 200 and is_batch(incoming_message):
+            return await self.handle_batch(incoming_message["batch"], codec, compressors)
+        if status_code == 200:
+            status_code, status_message, function_name, parameters = parse_call(incoming_message, self.rpc_functions)
+        if status_code != 200:
+            return create_response_message(status_code, status_message, None, codec, compressors)
+
+        status_code, status_message, response_message = await self.invoke_function(function_name, parameters)
+        return create_response_message(status_code, status_message, response_message, codec, compressors)
+
+    async def handle_routed_message(self, router_socket, envelope, message):
+        try:
+            response_message = await self.handle_incoming_message(message)
+            if response_message is not None:
+                await router_socket.send_multipart(envelope + message_to_frames(response_message), copy=False)
+        except Exception as e:
+            logger.error(e)
+
+    async def handle_sub_message(self, message):
+        try:
+            await self.handle_incoming_message(message)
+        except Exception as e:
+            logger.error(e)
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def serve_rep(self, rep_socket):
+        while True:
+            incoming_message = frames_to_message(await rep_socket.recv_multipart())
+            self.last_received_message = incoming_message
+            try:
+                response_message = await self.handle_incoming_message(incoming_message)
+            except Exception as e:
+                logger.error(e)
+                response_message = create_response_message(400, "Error", None)
+            await rep_socket.send_multipart(message_to_frames(response_message), copy=False)
+
+    async def serve_router(self, router_socket):
+        while True:
+            frames = await router_socket.recv_multipart()
+            if b'' not in frames:
+                logger.warning("Discarding message without envelope delimiter on ROUTER socket")
+                continue
+            delimiter_index = frames.index(b'')
+            incoming_message = frames_to_message(frames[delimiter_index + 1:])
+            self.last_received_message = incoming_message
+            self.spawn(self.handle_routed_message(router_socket, frames[:delimiter_index + 1], incoming_message))
+
+    async def serve_sub(self, sub_socket):
+        while True:
+            _, frames = split_topic(await sub_socket.recv_multipart())
+            incoming_message = frames_to_message(frames)
+            if incoming_message != "zmq_sub_heartbeat":
+                self.last_received_message = incoming_message
+            self.spawn(self.handle_sub_message(incoming_message))
+
+    async def run(self):
+        self.is_running = True
+        if self.username is not None and self.password is not None:
+            if get_shared_context() is not None:
+                # The shared context is served by the thread based shared authenticator
+                self.auth = get_authenticator(get_shared_context(), self.username, self.password)
+            else:
+                self.auth = AsyncioAuthenticator(self.context)
+                self.auth.start()
+                self.auth.configure_plain(domain='*', passwords={self.username: self.password})
+
+        servers = []
+        if self.zmq_rep_bind_address:
+            servers.append(self.serve_rep(self.create_socket(zmq.REP, self.zmq_rep_bind_address, True)))
+        if self.zmq_router_bind_address:
+            servers.append(self.serve_router(self.create_socket(zmq.ROUTER, self.zmq_router_bind_address, True)))
+        for address in self.zmq_sub_connect_addresses or []:
+            servers.append(self.serve_sub(self.create_socket(zmq.SUB, address, False)))
+        self.server_tasks = [asyncio.ensure_future(server) for server in servers]
+        try:
+            await asyncio.gather(*self.server_tasks)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            for zmq_socket in self.sockets:
+                zmq_socket.close()
+            self.sockets = []
+            release_authenticator(self.auth)
+            self.auth = None
+            self.is_running = False
+
+    # Stops the server at once. Requests still being handled are cancelled.
+    def stop(self):
+        for task in self.server_tasks:
+            task.cancel()
@@ -0,0 +1,563 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+import io
+import json
+import logging
+import pickle
+import struct
+import zlib
+
+import zmq
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("zmqrpc")
+
+# Messages encoded with any codec other than json start with this tag: a zero byte, the codec name and
+# another zero byte. Json messages are sent as plain text without a tag, as they always have been, so
+# peers running an older version keep understanding them.
+CODEC_TAG_MARKER = b'\x00'
+
+# Codecs a ZmqRpcServer accepts when none are given. Pickle is left out on purpose: unpickling a message
+# can execute arbitrary code, so only enable it between peers that trust each other.
+DEFAULT_ACCEPTED_CODECS = ("json", "msgpack")
+
+# Compressed messages are tagged like codecs, with this prefix before the name of the compressor. The compressed
+# data is the message as it would have been sent otherwise, tag and all. Older peers see an unknown codec.
+COMPRESSION_TAG_PREFIX = b'z-'
+
+# Servers list the compressors they support under this key in their responses to uncompressed calls of at least
+# COMPRESSION_ADVERTISEMENT_THRESHOLD characters, the calls worth compressing. Senders only compress messages to peers
+# that listed the compressor, so peers of older versions, which list none, never get a compressed message.
+COMPRESSORS_KEY = "compressors"
+COMPRESSION_ADVERTISEMENT_THRESHOLD = 256
+
+# A message published on a topic is preceded by a frame with this marker, the topic and a zero byte. The zero byte
+# ends the topic, so a subscription to a topic does not match longer topics starting with it.
+TOPIC_MARKER = b'\x01'
+
+# Receivers that subscribe to topics subscribe to the heartbeat as well, and publishers count them by it
+HEARTBEAT_SUBSCRIPTION = b'zmq_sub_heartbeat'
+
+# A flow controlled publisher numbers its messages with a sequence after the zero byte of the topic frame, and
+# messages without a topic get an empty topic. Flow controlled subscribers subscribe to this marker followed by their
+# id and their own subscriptions to announce themselves. Publishers only count the messages that match the subscriptions
+# of a subscriber. Credit is a subscription to the second marker followed by the id of the subscriber and the sequence
+# of what it handled, which it unsubscribes again at once: XPUB sockets of libzmq 4.3.2 crash on any other upstream
+# message.
+CREDIT_MARKER = b'\x02'
+CREDIT_ACK_MARKER = b'\x03'
+SEQUENCE = struct.Struct("!Q")
+SUBSCRIBER_ID_SIZE = 8
+SUBSCRIPTION_LENGTH = struct.Struct("!H")
+
+# Messages smaller than this are not worth compressing
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+# Key of the json object that takes the place of a buffer sent in a separate frame
+BUFFER_KEY = "__zmqrpc_buffer__"
+
+# msgpack extension type that takes the place of a buffer sent in a separate frame
+MSGPACK_BUFFER_EXT_TYPE = 42
+
+# Received frames smaller than this are copied, larger ones are used in place. Same as the pyzmq default.
+ZERO_COPY_THRESHOLD = 65536
+
+
+# Returns the buffer to send for a value that should travel in its own frame, or None
+def as_out_of_band_buffer(value):
+    if isinstance(value, memoryview):
+        return value
+    if numpy is not None and isinstance(value, numpy.ndarray) and not value.dtype.hasobject:
+        return numpy.ascontiguousarray(value)
+    return None
+
+
+# Rebuilds a value sent in its own frame. The result points into the received frame, nothing is copied.
+def from_out_of_band_buffer(frame, dtype=None, shape=None):
+    buffer = frame.buffer if isinstance(frame, zmq.Frame) else memoryview(frame)
+    if dtype is None:
+        return buffer
+    if numpy is None:
+        logger.warning("Received an array but numpy is not installed. Returning the raw buffer instead.")
+        return buffer
+    return numpy.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def describe_buffer(buffer, index):
+    if numpy is not None and isinstance(buffer, numpy.ndarray):
+        return {BUFFER_KEY: index, "dtype": buffer.dtype.str, "shape": list(buffer.shape)}
+    return {BUFFER_KEY: index}
+
+
+# A codec turns a call or response structure into bytes and back. Subclass it and register an
+# instance with register_codec to add a codec. Both peers must have it registered under the same name.
+# Large binary values (memoryviews, numpy arrays and, depending on the codec, bytes) may be appended to
+# buffers instead of being encoded. They are sent as separate frames without being copied and handed
+# back to decode as the received frames.
+class ZmqCodec(object):
+    name = None
+
+    def is_available(self):
+        return True
+
+    def encode(self, message, buffers):
+        raise NotImplementedError()
+
+    def decode(self, data, buffers):
+        raise NotImplementedError()
+
+
+# Json cannot carry binary data, so all bytes, memoryviews and numpy arrays travel in separate frames.
+class JsonCodec(ZmqCodec):
+    name = "json"
+
+    def encode(self, message, buffers):
+        return json.dumps(message, default=lambda value: self.encode_buffer(value, buffers)).encode('utf-8')
+
+    def encode_buffer(self, value, buffers):
+        buffer = as_out_of_band_buffer(value)
+        if buffer is None and isinstance(value, (bytes, bytearray)):
+            buffer = value
+        if buffer is None:
+            raise TypeError("Object of type {0} is not JSON serializable".format(type(value).__name__))
+        buffers.append(buffer)
+        return describe_buffer(buffer, len(buffers))
+
+    def decode(self, data, buffers):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        if not buffers:
+            return json.loads(data)
+
+        def decode_buffer(value):
+            if BUFFER_KEY in value:
+                return from_out_of_band_buffer(buffers[value[BUFFER_KEY] - 1], value.get("dtype"), value.get("shape"))
+            return value
+
+        return json.loads(data, object_hook=decode_buffer)
+
+
+# Needs the msgpack package. Bytes and memoryviews are carried inline by msgpack, numpy arrays travel in
+# separate frames.
+class MsgpackCodec(ZmqCodec):
+    name = "msgpack"
+
+    def is_available(self):
+        return msgpack is not None
+
+    def encode(self, message, buffers):
+        return msgpack.packb(message, use_bin_type=True, default=lambda value: self.encode_buffer(value, buffers))
+
+    def encode_buffer(self, value, buffers):
+        buffer = as_out_of_band_buffer(value)
+        if buffer is None:
+            raise TypeError("Object of type {0} is not msgpack serializable".format(type(value).__name__))
+        buffers.append(buffer)
+        return msgpack.ExtType(MSGPACK_BUFFER_EXT_TYPE, msgpack.packb(describe_buffer(buffer, len(buffers))))
+
+    def decode(self, data, buffers):
+        def decode_buffer(code, ext_data):
+            if code != MSGPACK_BUFFER_EXT_TYPE:
+                return msgpack.ExtType(code, ext_data)
+            value = msgpack.unpackb(ext_data, raw=False)
+            return from_out_of_band_buffer(buffers[value[BUFFER_KEY] - 1], value.get("dtype"), value.get("shape"))
+
+        return msgpack.unpackb(data, raw=False, ext_hook=decode_buffer)
+
+
+if pickle.HIGHEST_PROTOCOL >= 5:
+    # Pickles memoryviews out-of-band as well, they cannot be pickled otherwise
+    class BufferPickler(pickle.Pickler):
+        def reducer_override(self, obj):
+            if isinstance(obj, memoryview):
+                return memoryview, (pickle.PickleBuffer(obj),)
+            return NotImplemented
+else:
+    BufferPickler = None
+
+
+# Uses pickle protocol 5 out-of-band buffers where available (Python 3.8), so memoryviews and numpy arrays
+# travel in separate frames. Bytes are carried inline.
+class PickleCodec(ZmqCodec):
+    name = "pickle"
+
+    def encode(self, message, buffers):
+        if BufferPickler is None:
+            return pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        data = io.BytesIO()
+        BufferPickler(data, protocol=5, buffer_callback=lambda buffer: buffers.append(buffer.raw())).dump(message)
+        return data.getvalue()
+
+    def decode(self, data, buffers):
+        if buffers:
+            return pickle.loads(data, buffers=[from_out_of_band_buffer(buffer) for buffer in buffers])
+        return pickle.loads(data)
+
+
+codecs = {}
+
+
+def register_codec(codec):
+    codecs[codec.name] = codec
+
+
+def get_codec(name):
+    if isinstance(name, ZmqCodec):
+        return name
+    if name not in codecs:
+        raise Exception("Unknown codec '{0}'. Register it with register_codec first.".format(name))
+    codec = codecs[name]
+    if not codec.is_available():
+        raise Exception("Codec '{0}' is not available. Is the package it needs installed?".format(name))
+    return codec
+
+
+register_codec(JsonCodec())
+register_codec(MsgpackCodec())
+register_codec(PickleCodec())
+
+
+# A ZmqCompressor compresses the first frame of a message. Buffers in further frames are left alone.
+class ZmqCompressor(object):
+    name = None
+
+    def is_available(self):
+        return True
+
+    def compress(self, data):
+        raise NotImplementedError()
+
+    def decompress(self, data):
+        raise NotImplementedError()
+
+
+class ZlibCompressor(ZmqCompressor):
+    name = "zlib"
+
+    def compress(self, data):
+        return zlib.compress(data, 6)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+# Needs the lz4 package. Compresses less than zlib but is much faster.
+class Lz4Compressor(ZmqCompressor):
+    name = "lz4"
+
+    def is_available(self):
+        return lz4 is not None
+
+    def compress(self, data):
+        return lz4.frame.compress(data)
+
+    def decompress(self, data):
+        return lz4.frame.decompress(data)
+
+
+# Needs the zstandard package. Compresses about as well as zlib and is faster.
+class ZstdCompressor(ZmqCompressor):
+    name = "zstd"
+
+    def is_available(self):
+        return zstandard is not None
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=3).compress(data)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=2 ** 31)
+
+
+compressors = {}
+
+
+def register_compressor(compressor):
+    compressors[compressor.name] = compressor
+
+
+def get_compressor(name):
+    if isinstance(name, ZmqCompressor):
+        return name
+    if name not in compressors:
+        raise Exception("Unknown compressor '{0}'. Register it with register_compressor first.".format(name))
+    compressor = compressors[name]
+    if not compressor.is_available():
+        raise Exception("Compressor '{0}' is not available. Is the package it needs installed?".format(name))
+    return compressor
+
+
+register_compressor(ZlibCompressor())
+register_compressor(Lz4Compressor())
+register_compressor(ZstdCompressor())
+
+
+# Returns the name of the compressor a message was compressed with, or None when it is not compressed
+def get_message_compression(message):
+    if isinstance(message, list):
+        message = frame_bytes(message[0])
+    if not is_tagged(message) or message[1:1 + len(COMPRESSION_TAG_PREFIX)] != COMPRESSION_TAG_PREFIX:
+        return None
+    end_of_tag = message.find(CODEC_TAG_MARKER, 1)
+    if end_of_tag < 0:
+        raise Exception("Incorrectly tagged message. No end of compression tag found.")
+    return message[1 + len(COMPRESSION_TAG_PREFIX):end_of_tag].decode('utf-8')
+
+
+# Returns the size of the first frame of a message, the frame that is compressed. Text is measured in characters.
+def message_size(message):
+    if isinstance(message, list):
+        message = message[0]
+    return len(message)
+
+
+# Returns the names of the compressors this process can use, sorted
+def available_compressors():
+    return sorted(name for name, compressor in compressors.items() if compressor.is_available())
+
+
+# Returns the compressors to list in the response to a message: those available when the message is an uncompressed
+# call worth compressing, otherwise None
+def get_advertised_compressors(message):
+    try:
+        if get_message_compression(message) is not None or message_size(message) < COMPRESSION_ADVERTISEMENT_THRESHOLD:
+            return None
+    except Exception:
+        return None
+    return available_compressors()
+
+
+# Returns the compressors listed in a response, an empty list when there are none
+def parse_advertised_compressors(response_message):
+    try:
+        response_message_dict, _ = decode_message(response_message)
+    except Exception:
+        return []
+    listed = response_message_dict.get(COMPRESSORS_KEY) if isinstance(response_message_dict, dict) else None
+    if not isinstance(listed, list):
+        return []
+    return [name for name in listed if name in compressors and compressors[name].is_available()]
+
+
+# Compresses the first frame of a message with the given compressor when it is at least threshold bytes and
+# compressing makes it smaller. Messages that are compressed already are returned as they are.
+def compress_message(message, compression, threshold=DEFAULT_COMPRESSION_THRESHOLD):
+    if compression is None or get_message_compression(message) is not None:
+        return message
+    compressor = get_compressor(compression)
+    frames = message_to_frames(message)
+    data = frame_bytes(frames[0])
+    if len(data) < threshold:
+        return message
+    compressed = CODEC_TAG_MARKER + COMPRESSION_TAG_PREFIX + compressor.name.encode('utf-8') + CODEC_TAG_MARKER + compressor.compress(data)
+    if len(compressed) >= len(data):
+        return message
+    if len(frames) > 1:
+        return [compressed] + frames[1:]
+    return compressed
+
+
+# Returns the message as it was before it was compressed
+def decompress_message(message):
+    compression = get_message_compression(message)
+    if compression is None:
+        return message
+    compressor = get_compressor(compression)
+    frames = message_to_frames(message)
+    data = frame_bytes(frames[0])
+    decompressed = decode_frame(compressor.decompress(data[len(compression) + len(COMPRESSION_TAG_PREFIX) + 2:]))
+    if len(frames) > 1:
+        return [encode_frame(decompressed)] + frames[1:]
+    return decompressed
+
+
+def encode_topic(topic, sequence=None):
+    return TOPIC_MARKER + topic.encode('utf-8') + b'\x00' + (SEQUENCE.pack(sequence) if sequence is not None else b'')
+
+
+# Returns a tuple of the topic of received frames (None without a topic), their sequence (None when not flow
+# controlled) and the frames of the message itself
+def split_envelope(frames):
+    if len(frames) > 1 and frame_bytes(frames[0])[:1] == TOPIC_MARKER:
+        envelope = frame_bytes(frames[0])
+        end_of_topic = envelope.index(b'\x00', 1)
+        sequence = SEQUENCE.unpack(envelope[end_of_topic + 1:])[0] if len(envelope) > end_of_topic + 1 else None
+        return envelope[1:end_of_topic].decode('utf-8') or None, sequence, frames[1:]
+    return None, None, frames
+
+
+# Returns a tuple of the topic of received frames, or None, and the frames of the message itself
+def split_topic(frames):
+    topic, _, frames = split_envelope(frames)
+    return topic, frames
+
+
+# Returns the subscriptions of a SUB socket: everything when topics is None, otherwise the given topics, the empty
+# topic of flow controlled messages without a topic, the heartbeat, and messages without a topic that start with
+# one of legacy_prefixes.
+def create_subscriptions(topics, legacy_prefixes=()):
+    if topics is None:
+        return [b'']
+    return [encode_topic(topic) for topic in topics] + [encode_topic(''), HEARTBEAT_SUBSCRIPTION] + list(legacy_prefixes)
+
+
+# The subscription that announces a flow controlled subscriber and its subscriptions to the publisher
+def encode_credit_subscription(subscriber_id, subscriptions=()):
+    return CREDIT_MARKER + subscriber_id + b''.join([SUBSCRIPTION_LENGTH.pack(len(subscription)) + subscription for subscription in subscriptions])
+
+
+# Returns a tuple of the subscriber id and the subscriptions of an announcement without its leading (un)subscribe byte.
+# Subscribers of older versions do not list their subscriptions, so they are taken to subscribe to everything.
+def decode_credit_subscription(announcement):
+    subscriber_id = announcement[1:1 + SUBSCRIBER_ID_SIZE]
+    offset = 1 + SUBSCRIBER_ID_SIZE
+    subscriptions = []
+    while offset < len(announcement):
+        length = SUBSCRIPTION_LENGTH.unpack(announcement[offset:offset + SUBSCRIPTION_LENGTH.size])[0]
+        offset += SUBSCRIPTION_LENGTH.size
+        subscriptions.append(announcement[offset:offset + length])
+        offset += length
+    return subscriber_id, subscriptions or [b'']
+
+
+# The subscription that acknowledges all messages up to sequence
+def encode_credit(subscriber_id, sequence):
+    return CREDIT_ACK_MARKER + subscriber_id + SEQUENCE.pack(sequence)
+
+
+# Returns the message as text for json and as tagged bytes for all other codecs. When the message holds
+# buffers that travel separately, a list of frames is returned: the encoded message followed by the buffers.
+def encode_message(message, codec=None):
+    codec = get_codec(codec or "json")
+    buffers = []
+    data = codec.encode(message, buffers)
+    if codec.name != "json":
+        data = CODEC_TAG_MARKER + codec.name.encode('utf-8') + CODEC_TAG_MARKER + data
+    elif not buffers:
+        return data.decode('utf-8')
+    if buffers:
+        return [data] + buffers
+    return data
+
+
+def is_tagged(message):
+    return isinstance(message, bytes) and message[:1] == CODEC_TAG_MARKER
+
+
+# Returns the name of the codec a message was encoded with
+def get_message_codec_name(message):
+    message = decompress_message(message)
+    if isinstance(message, list):
+        message = frame_bytes(message[0])
+    if not is_tagged(message):
+        return "json"
+    end_of_tag = message.find(CODEC_TAG_MARKER, 1)
+    if end_of_tag < 0:
+        raise Exception("Incorrectly tagged message. No end of codec tag found.")
+    return message[1:end_of_tag].decode('utf-8')
+
+
+# Returns a tuple of the decoded message and the codec it was encoded with. Compressed messages are decompressed.
+def decode_message(message):
+    message = decompress_message(message)
+    buffers = []
+    if isinstance(message, list):
+        buffers = message[1:]
+        message = frame_bytes(message[0])
+    codec_name = get_message_codec_name(message)
+    codec = get_codec(codec_name)
+    if codec_name == "json":
+        return codec.decode(message, buffers), codec
+    return codec.decode(message[len(codec_name) + 2:], buffers), codec
+
+
+def frame_bytes(frame):
+    if isinstance(frame, zmq.Frame):
+        return frame.bytes
+    return frame
+
+
+# Turns a frame received from a socket into a message. Untagged frames are text and decoded as such,
+# so receivers keep handing strings to handle_incoming_message for plain json and text messages.
+def decode_frame(frame):
+    if frame[:1] == CODEC_TAG_MARKER:
+        return frame
+    return frame.decode('utf-8')
+
+
+# Turns a message into bytes to send it over a socket
+def encode_frame(message):
+    if isinstance(message, bytes):
+        return message
+    return message.encode('utf-8')
+
+
+# Messages are text or bytes for a single frame and a list of frames for multipart messages
+def message_to_frames(message):
+    if isinstance(message, list):
+        return message
+    return [encode_frame(message)]
+
+
+def frames_to_message(frames):
+    if len(frames) == 1:
+        return decode_frame(frame_bytes(frames[0]))
+    return frames
+
+
+# Returns the number of bytes of the given frames
+def frames_size(frames):
+    return sum(len(frame) if isinstance(frame, (bytes, zmq.Frame)) else memoryview(frame).nbytes for frame in frames)
+
+
+# Sends a message, optionally preceded by envelope frames. Buffers are sent without copying them.
+# Returns the number of bytes of the message, not counting the envelope.
+def send_message(zmq_socket, message, envelope=None):
+    frames = message_to_frames(message)
+    size = frames_size(frames)
+    if envelope:
+        frames = envelope + frames
+    if len(frames) == 1:
+        zmq_socket.send(frames[0])
+    else:
+        zmq_socket.send_multipart(frames, copy=False)
+    return size
+
+
+# Receives all frames of a message. Further frames of at least ZERO_COPY_THRESHOLD bytes are not copied
+# but kept as zmq.Frame, so large buffers can be used where they were received.
+def recv_frames(zmq_socket, flags=0):
+    frames = [zmq_socket.recv(flags)]
+    more = zmq_socket.getsockopt(zmq.RCVMORE)
+    while more:
+        frame = zmq_socket.recv(copy=False)
+        more = frame.more
+        frames.append(frame if len(frame) >= ZERO_COPY_THRESHOLD else frame.bytes)
+    return frames
+
+
+def recv_message(zmq_socket, flags=0):
+    return frames_to_message(recv_frames(zmq_socket, flags))
+
@@ -0,0 +1,110 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+from threading import Lock
+import logging
+
+import zmq
+from zmq.auth.thread import ThreadAuthenticator
+
+logger = logging.getLogger("zmqrpc")
+
+# By default every sender and receiver creates its own zmq.Context, each with its own I/O thread and, for receivers
+# with a username/password, its own authenticator thread. After use_shared_context all zmqrpc classes created
+# afterwards use one process wide context instead. This also lets them talk to each other over inproc:// addresses,
+# which only work between sockets of the same context.
+shared_context = None
+shared_authenticator = None
+shared_authenticator_users = 0
+shared_passwords = {}
+registry_lock = Lock()
+
+
+# Creates the shared context with the given number of I/O threads, or returns it when it already exists
+def use_shared_context(io_threads=1):
+    global shared_context
+    with registry_lock:
+        if shared_context is None:
+            shared_context = zmq.Context(io_threads=io_threads)
+            logger.debug("Created shared context with %s I/O threads", io_threads)
+        elif shared_context.getsockopt(zmq.IO_THREADS) != io_threads:
+            logger.warning("Shared context already exists with %s I/O threads. Ignoring io_threads=%s.", shared_context.getsockopt(zmq.IO_THREADS), io_threads)
+        return shared_context
+
+
+# Returns the shared context, or None when use_shared_context has not been called
+def get_shared_context():
+    return shared_context
+
+
+# Returns the context a new sender or receiver should use
+def get_context():
+    if shared_context is not None:
+        return shared_context
+    return zmq.Context()
+
+
+# Returns a zmq.asyncio context for the asyncio classes. On the shared context it shadows the shared context,
+# so asyncio and thread based sockets can be connected over inproc.
+def get_asyncio_context():
+    import zmq.asyncio
+    if shared_context is not None:
+        return zmq.asyncio.Context.shadow(shared_context.underlying)
+    return zmq.asyncio.Context()
+
+
+# Stops using the shared context. Classes created afterwards get their own context again. When term is set the
+# context is terminated, which blocks until all sockets on it are closed, so destroy or stop everything using it first.
+def destroy_shared_context(term=True):
+    global shared_context, shared_authenticator, shared_authenticator_users
+    with registry_lock:
+        context = shared_context
+        shared_context = None
+        if shared_authenticator is not None:
+            shared_authenticator.stop()
+        shared_authenticator = None
+        shared_authenticator_users = 0
+        shared_passwords.clear()
+    if context is not None and term:
+        context.term()
+
+
+# Returns a started authenticator for PLAIN authentication on the given context that accepts username/password.
+# Only one authenticator can serve a context, so all receivers on the shared context share one, which accepts the
+# usernames and passwords of all of them. Hand it back with release_authenticator when done.
+def get_authenticator(context, username, password):
+    global shared_authenticator, shared_authenticator_users
+    if context is not shared_context:
+        auth = ThreadAuthenticator(context)
+        auth.start()
+        auth.configure_plain(domain='*', passwords={username: password})
+        return auth
+    with registry_lock:
+        if shared_authenticator is None:
+            shared_authenticator = ThreadAuthenticator(context)
+            shared_authenticator.start()
+        shared_authenticator_users += 1
+        if shared_passwords.get(username, password) != password:
+            logger.warning("User %s already has another password on the shared context. Replacing it.", username)
+        shared_passwords[username] = password
+        shared_authenticator.configure_plain(domain='*', passwords=dict(shared_passwords))
+        return shared_authenticator
+
+
+# Stops the authenticator, or the shared authenticator once the last receiver using it hands it back
+def release_authenticator(auth):
+    global shared_authenticator, shared_authenticator_users
+    if auth is None:
+        return
+    with registry_lock:
+        if auth is not shared_authenticator:
+            auth.stop()
+            return
+        shared_authenticator_users -= 1
+        if shared_authenticator_users <= 0:
+            shared_authenticator.stop()
+            shared_authenticator = None
+            shared_authenticator_users = 0
+            shared_passwords.clear()
@@ -0,0 +1,243 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+from threading import Condition
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from .ZmqCodec import frame_bytes, frames_to_message, message_to_frames
+
+logger = logging.getLogger("zmqrpc")
+
+# Every record starts with the length and crc32 of its payload. A length of 0 marks the end of the records in a
+# segment, since segments are created filled with zeros.
+RECORD_HEADER = struct.Struct("!II")
+FRAME_HEADER = struct.Struct("!I")
+# The ack file holds the segment number and offset of the first record that is not acknowledged
+ACK_POSITION = struct.Struct("!QQ")
+SEGMENT_SUFFIX = ".journal"
+ACK_FILE_NAME = "ack"
+# Bytes of a segment checked at a time for what is left of a torn record
+CLEAR_CHECK_SIZE = 1024 * 1024
+
+
+class JournalFullError(Exception):
+    pass
+
+
+# An opened segment file of the journal
+class JournalSegment(object):
+    def __init__(self, path, number, size_in_bytes=None):
+        self.path = path
+        self.number = number
+        if size_in_bytes is not None:
+            with open(path, "wb") as segment_file:
+                segment_file.truncate(size_in_bytes)
+        self.file = open(path, "r+b")
+        self.size_in_bytes = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), self.size_in_bytes)
+
+    # Returns the payload of the record at offset and the offset of the next record, or None at the end of the records
+    def read_record(self, offset):
+        if offset + RECORD_HEADER.size > self.size_in_bytes:
+            return None
+        length, crc = RECORD_HEADER.unpack_from(self.map, offset)
+        if length == 0 or offset + RECORD_HEADER.size + length > self.size_in_bytes:
+            return None
+        payload = self.map[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            return None
+        return payload, offset + RECORD_HEADER.size + length
+
+    # Returns True when the segment holds only zeros from offset on, so no part of a record was written there
+    def is_clear(self, offset):
+        for start in range(offset, self.size_in_bytes, CLEAR_CHECK_SIZE):
+            if self.map[start:min(start + CLEAR_CHECK_SIZE, self.size_in_bytes)].strip(b'\x00'):
+                return False
+        return True
+
+    # Writes the payload before the header, so a torn write is never mistaken for a record
+    def write_record(self, offset, payload):
+        end = offset + RECORD_HEADER.size + len(payload)
+        self.map[offset + RECORD_HEADER.size:end] = payload
+        RECORD_HEADER.pack_into(self.map, offset, len(payload), zlib.crc32(payload) & 0xffffffff)
+        return end
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+# A ZmqJournal is an append-only queue of messages on disk, used to buffer messages while the receiving end is
+# unavailable. Messages are appended to memory-mapped segment files of segment_size_in_bytes. A new segment is
+# started when a message does not fit anymore. peek returns the oldest message that is not acknowledged yet and
+# ack acknowledges it, after which a segment of acknowledged messages is removed. Messages that are not
+# acknowledged are replayed when the journal is opened again, for example after a restart.
+# When the segments would take more than max_size_in_bytes, append raises a JournalFullError instead of dropping
+# messages. Writes survive a crash of the process; use flush_on_append to survive a crash of the machine as well,
+# at the expense of a disk flush for every message. The journal is thread safe.
+class ZmqJournal(object):
+    def __init__(self, directory, segment_size_in_bytes=16 * 1024 * 1024, max_size_in_bytes=1024 * 1024 * 1024, flush_on_append=False):
+        self.directory = directory
+        self.segment_size_in_bytes = segment_size_in_bytes
+        self.max_size_in_bytes = max_size_in_bytes
+        self.flush_on_append = flush_on_append
+        self.condition = Condition()
+        self.segments = []
+        self.read_offset = 0
+        self.write_offset = 0
+        self.pending = 0
+        self.peeked_offset = None
+        self.closed = False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        ack_path = os.path.join(directory, ACK_FILE_NAME)
+        self.ack_file = open(ack_path, "r+b" if os.path.exists(ack_path) else "w+b")
+        self.replay()
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, "{0:016d}{1}".format(number, SEGMENT_SUFFIX))
+
+    # Opens the segments left by a previous run and counts the messages that were not acknowledged
+    def replay(self):
+        numbers = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        self.ack_file.seek(0)
+        ack_position = self.ack_file.read(ACK_POSITION.size)
+        ack_number, ack_offset = ACK_POSITION.unpack(ack_position) if len(ack_position) == ACK_POSITION.size else (0, 0)
+        for number in numbers:
+            if number < ack_number:
+                os.remove(self.segment_path(number))
+            elif os.path.getsize(self.segment_path(number)) == 0:
+                # A crash between creating and sizing a segment leaves an empty file without records
+                logger.warning("Removing empty journal segment %s", self.segment_path(number))
+                os.remove(self.segment_path(number))
+            else:
+                self.segments.append(JournalSegment(self.segment_path(number), number))
+        if not self.segments:
+            self.segments.append(JournalSegment(self.segment_path(ack_number), ack_number, self.segment_size_in_bytes))
+        self.read_offset = ack_offset if self.segments[0].number == ack_number else 0
+        for segment in self.segments:
+            offset = self.read_offset if segment is self.segments[0] else 0
+            record = segment.read_record(offset)
+            while record is not None:
+                self.pending += 1
+                offset = record[1]
+                record = segment.read_record(offset)
+            self.write_offset = offset
+        # The records before write_offset passed their crc check. Clear what is left of a record that was torn by a crash,
+        # a payload without its header or a header that does not match its payload, so it cannot be read as a record later on.
+        last_segment = self.segments[-1]
+        if not last_segment.is_clear(self.write_offset):
+            logger.warning("Clearing a torn record at offset %s of journal segment %s", self.write_offset, last_segment.path)
+            last_segment.map[self.write_offset:] = b'\x00' * (last_segment.size_in_bytes - self.write_offset)
+        if self.pending:
+            logger.info("Replaying %s messages from journal in %s", self.pending, self.directory)
+        self.store_ack_position()
+
+    def store_ack_position(self):
+        self.ack_file.seek(0)
+        self.ack_file.write(ACK_POSITION.pack(self.segments[0].number, self.read_offset))
+        self.ack_file.flush()
+
+    def size_in_bytes(self):
+        with self.condition:
+            return sum(segment.size_in_bytes for segment in self.segments)
+
+    def __len__(self):
+        with self.condition:
+            return self.pending
+
+    # Appends a message: text, bytes or a list of frames
+    def append(self, message):
+        frames = [frame_bytes(frame) for frame in message_to_frames(message)]
+        payload = FRAME_HEADER.pack(len(frames)) + b"".join(FRAME_HEADER.pack(len(frame)) + frame for frame in frames)
+        record_size = RECORD_HEADER.size + len(payload)
+        with self.condition:
+            if self.closed:
+                raise Exception("Journal in {0} is closed.".format(self.directory))
+            segment = self.segments[-1]
+            if self.write_offset + record_size > segment.size_in_bytes:
+                size_in_bytes = max(self.segment_size_in_bytes, record_size)
+                if sum(segment.size_in_bytes for segment in self.segments) + size_in_bytes > self.max_size_in_bytes:
+                    raise JournalFullError("Journal in {0} is full. Cannot store another {1} bytes within {2} bytes.".format(self.directory, size_in_bytes, self.max_size_in_bytes))
+                segment = JournalSegment(self.segment_path(segment.number + 1), segment.number + 1, size_in_bytes)
+                self.segments.append(segment)
+                self.write_offset = 0
+            self.write_offset = segment.write_record(self.write_offset, payload)
+            if self.flush_on_append:
+                segment.flush()
+            self.pending += 1
+            self.condition.notify_all()
+
+    # Returns the oldest message that is not acknowledged, waiting at most time_out_in_sec (None waits forever)
+    # for one. Returns None when there is no message in time or the journal is closed.
+    def peek(self, time_out_in_sec=None):
+        wait_until = None if time_out_in_sec is None else time.time() + time_out_in_sec
+        with self.condition:
+            while not self.closed:
+                record = self.segments[0].read_record(self.read_offset)
+                if record is not None:
+                    self.peeked_offset = record[1]
+                    return frames_to_message(self.decode_payload(record[0]))
+                if len(self.segments) > 1:
+                    # The first segment has been read completely
+                    self.segments.pop(0).remove()
+                    self.read_offset = 0
+                    self.store_ack_position()
+                    continue
+                remaining = None if wait_until is None else wait_until - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return None
+
+    @staticmethod
+    def decode_payload(payload):
+        count = FRAME_HEADER.unpack_from(payload, 0)[0]
+        offset = FRAME_HEADER.size
+        frames = []
+        for _ in range(count):
+            length = FRAME_HEADER.unpack_from(payload, offset)[0]
+            offset += FRAME_HEADER.size
+            frames.append(payload[offset:offset + length])
+            offset += length
+        return frames
+
+    # Acknowledges the message returned by the last peek, so it is not returned again
+    def ack(self):
+        with self.condition:
+            if self.peeked_offset is None:
+                raise Exception("Nothing to acknowledge. Call peek first.")
+            self.read_offset = self.peeked_offset
+            self.peeked_offset = None
+            self.pending -= 1
+            self.store_ack_position()
+
+    # Wakes up threads waiting in peek, for example to have them check whether they should stop
+    def wake_up(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            for segment in self.segments:
+                segment.flush()
+                segment.close()
+            self.ack_file.close()
+            self.condition.notify_all()
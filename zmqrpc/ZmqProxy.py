@@ -7,34 +7,192 @@ Created on Apr 8, 2014
 '''
 from __future__ import print_function
 from builtins import super
+from collections import OrderedDict
+from concurrent.futures import Future
+import itertools
 import logging
-from threading import Thread
+import struct
+import time
+from threading import Event, Lock, Thread
 
+import zmq
+
+from .ZmqCodec import DEFAULT_COMPRESSION_THRESHOLD, compress_message, get_advertised_compressors, get_message_codec_name
+from .ZmqContext import get_authenticator, get_context, release_authenticator
+from .ZmqJournal import ZmqJournal
 from .ZmqReceiver import ZmqReceiver
+from .ZmqRpcServer import get_response_compression
 from .ZmqSender import ZmqSender
 
 logger = logging.getLogger("zmqrpc")
 
+# Order of the counters libzmq replies with to the STATISTICS command of a steerable proxy
+STATISTICS_NAMES = ("frontend_messages_received", "frontend_bytes_received", "frontend_messages_sent", "frontend_bytes_sent",
+                    "backend_messages_received", "backend_bytes_received", "backend_messages_sent", "backend_bytes_sent")
+
+
+# A ZmqSender that passes responses on as they were received, without decoding them
+class ZmqPassThroughSender(ZmqSender):
+    def handle_response(self, response_message):
+        return response_message
+
+
+# Base class of the proxies that forward over the DEALER socket of their sender. The DEALER socket is polled on
+# the receiver thread together with the sockets of the receiver, which resolves the futures of the forwarded
+# messages as their responses come in or their time out passes. The sender is destroyed when the receiver stops.
+class ZmqDealerProxy(ZmqReceiver):
+    def __init__(self, *args, **kwargs):
+        ZmqReceiver.__init__(self, *args, **kwargs)
+        self.sender = None
+        self.dealer_socket = None
+
+    # The DEALER socket of the sender changes when it is recreated after an error
+    def register_dealer_socket(self):
+        if self.sender.dealer_socket is self.dealer_socket:
+            return
+        if self.dealer_socket is not None:
+            self.poller.unregister(self.dealer_socket)
+        self.dealer_socket = self.sender.dealer_socket
+        if self.dealer_socket is not None:
+            self.poller.register(self.dealer_socket, zmq.POLLIN)
+
+    def run(self):
+        try:
+            ZmqReceiver.run(self)
+        finally:
+            self.sender.destroy()
+
+    # Resolves the requests that got a response or timed out
+    def handle_poll_cycle(self, socks):
+        if self.dealer_socket is not None and socks.get(self.dealer_socket) == zmq.POLLIN:
+            self.sender.receive_dealer_responses()
+        self.sender.expire_pending_responses()
+
+    # Returns the seconds until the first request times out, or None without requests in flight
+    def time_until_first_deadline(self):
+        deadlines = [response_future.deadline for response_future in list(self.sender.pending_responses.values())]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.time())
+
+    # Wakes up in time for the first request that times out
+    def poll_timeout(self):
+        timeout = ZmqReceiver.poll_timeout(self)
+        until_deadline = self.time_until_first_deadline()
+        if until_deadline is None:
+            return timeout
+        until_deadline = int(until_deadline * 1000) + 1
+        return until_deadline if timeout is None else min(timeout, until_deadline)
+
 
 # This class implements a simple message forwarding from a PUB/SUB connection to a
 # REQ/REP connection.
-class ZmqProxySub2Req(ZmqReceiver):
+# With a window_size above 1 up to window_size messages are in flight at the same time over a DEALER socket,
+# instead of one at a time over a REQ socket. This keeps the throughput up over links with a long round trip time.
+# When the window is full, reading from the SUB sockets waits until a message completes.
+# A message that fails or is not answered within time_out_waiting_for_response_in_sec is sent again up to
+# max_retries times. Completed messages are passed to handle_forward_result; with ordered set in the order they
+# came in, so a slow message holds up the window, otherwise in the order they complete. forward_stats counts them.
+# With a compression messages of at least compression_threshold bytes are compressed before they are forwarded, to
+# servers that support it, see ZmqSender.
+class ZmqProxySub2Req(ZmqDealerProxy):
     # Note, at the moment username/password only protects the REQ-REP socket connection
-    def __init__(self, zmq_sub_connect_addresses, zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=600, username_sub=None, password_sub=None, username_req=None, password_req=None):
-        ZmqReceiver.__init__(self, zmq_sub_connect_addresses=zmq_sub_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username=username_sub, password=password_sub)
-        self.sender = ZmqSender(zmq_req_endpoints=zmq_req_connect_addresses, username=username_req, password=password_req)
+    def __init__(self, zmq_sub_connect_addresses, zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=600, username_sub=None, password_sub=None, username_req=None, password_req=None, window_size=1, ordered=False, max_retries=0, time_out_waiting_for_response_in_sec=60, compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
+        ZmqDealerProxy.__init__(self, zmq_sub_connect_addresses=zmq_sub_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username=username_sub, password=password_sub)
+        if window_size > 1:
+            self.sender = ZmqSender(zmq_dealer_endpoints=zmq_req_connect_addresses, username=username_req, password=password_req, compression=compression, compression_threshold=compression_threshold)
+        else:
+            self.sender = ZmqSender(zmq_req_endpoints=zmq_req_connect_addresses, username=username_req, password=password_req, compression=compression, compression_threshold=compression_threshold)
+        self.window_size = window_size
+        self.ordered = ordered
+        self.max_retries = max_retries
+        self.time_out_waiting_for_response_in_sec = time_out_waiting_for_response_in_sec
+        # Maps the sequence number of every message in the window to the message, its future and its retries
+        self.window = OrderedDict()
+        self.sequence_numbers = itertools.count()
+        self.forwarded = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.register_dealer_socket()
 
     def handle_incoming_message(self, message):
         # We don't care for the response, since we cannot pass it back via the pub socket or we got none from a pub socket
+        self.forwarded += 1
+        if self.window_size <= 1:
+            for retries in range(self.max_retries + 1):
+                try:
+                    response_message = self.sender.send(message, time_out_waiting_for_response_in_sec=self.time_out_waiting_for_response_in_sec)
+                except Exception as e:
+                    logger.error(e)
+                    if retries < self.max_retries:
+                        self.retries += 1
+                        continue
+                    self.failed += 1
+                    self.handle_forward_result(message, None, e)
+                else:
+                    self.succeeded += 1
+                    self.handle_forward_result(message, response_message, None)
+                return None
+        while len(self.window) >= self.window_size:
+            until_deadline = self.time_until_first_deadline()
+            self.sender.receive_dealer_responses(1 if until_deadline is None else min(until_deadline, 1))
+            self.sender.expire_pending_responses()
+            self.process_window()
+        self.forward(next(self.sequence_numbers), message, 0)
+        return None
+
+    def forward(self, sequence_number, message, retries):
         try:
-            self.sender.send(message, time_out_waiting_for_response_in_sec=60)
+            response_future = self.sender.send_async(message, self.time_out_waiting_for_response_in_sec)
         except Exception as e:
-            logger.error(e)
-        return None
+            response_future = Future()
+            response_future.set_exception(e)
+        finally:
+            self.register_dealer_socket()
+        # Replacing the entry of a retried message keeps its place in the window
+        self.window[sequence_number] = (message, response_future, retries)
+
+    # Sends failed messages again and hands completed messages to handle_forward_result
+    def process_window(self):
+        for sequence_number, (message, response_future, retries) in list(self.window.items()):
+            if not response_future.done():
+                if self.ordered:
+                    return
+                continue
+            exception = response_future.exception()
+            if exception is not None and retries < self.max_retries:
+                logger.warning("Forwarding message failed. Retrying. Exception: %s", exception)
+                self.retries += 1
+                self.forward(sequence_number, message, retries + 1)
+                if self.ordered:
+                    return
+                continue
+            del self.window[sequence_number]
+            if exception is None:
+                self.succeeded += 1
+                self.handle_forward_result(message, response_future.result(), None)
+            else:
+                logger.error(exception)
+                self.failed += 1
+                self.handle_forward_result(message, None, exception)
+
+    def handle_poll_cycle(self, socks):
+        ZmqDealerProxy.handle_poll_cycle(self, socks)
+        self.process_window()
+
+    # Called on the receiver thread for every forwarded message with the response, or the exception when it
+    # failed after all retries. Override to act on the responses.
+    def handle_forward_result(self, message, response_message, exception):
+        pass
+
+    def forward_stats(self):
+        return {"forwarded": self.forwarded, "succeeded": self.succeeded, "failed": self.failed, "retries": self.retries, "in_flight": len(self.window)}
 
 
 # This class implements a simple message forwarding from a PUB/SUB connection to another
 # PUB/SUB connection. Could be used to aggregate messages into one end-point.
+# Messages are published again on the topic they came in on, so subscribers behind the proxy still filter on topics.
 class ZmqProxySub2Pub(ZmqReceiver):
     # Note, at the moment username/password only protects the REQ-REP socket connection
     def __init__(self, zmq_sub_connect_addresses, zmq_pub_bind_address, recreate_sockets_on_timeout_of_sec=600, username_sub=None, password_sub=None, username_pub=None, password_pub=None):
@@ -44,7 +202,7 @@ class ZmqProxySub2Pub(ZmqReceiver):
     def handle_incoming_message(self, message):
         # We don't care for the response, since we cannot pass it back via the pub socket or we got none from a pub socket
         try:
-            self.sender.send(message, time_out_waiting_for_response_in_sec=60)
+            self.sender.send(message, time_out_waiting_for_response_in_sec=60, topic=self.incoming_topic)
         except Exception as e:
             logger.error(e)
         return None
@@ -69,19 +227,250 @@ class ZmqProxyRep2Pub(ZmqReceiver):
 
 # This class implements a simple message forwarding from a REQ/REP connection to another
 # REQ/REP connection.
+# With a compression calls of at least compression_threshold bytes are compressed before they are forwarded, to servers
+# that support it, see ZmqSender. Responses to compressed calls are compressed, with the compression of the call, and
+# with a compression responses to uncompressed calls list the compressors clients may use, like a ZmqRpcServer does.
 class ZmqProxyRep2Req(ZmqReceiver):
     # Note, at the moment username/password only protects the REQ-REP socket connection
-    def __init__(self, zmq_rep_bind_address, zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None, username_req=None, password_req=None):
+    def __init__(self, zmq_rep_bind_address, zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None, username_req=None, password_req=None, compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
         ZmqReceiver.__init__(self, zmq_rep_bind_address=zmq_rep_bind_address, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username=username_rep, password=password_rep)
-        self.sender = ZmqSender(zmq_req_endpoints=zmq_req_connect_addresses, username=username_req, password=password_req)
+        self.sender = ZmqSender(zmq_req_endpoints=zmq_req_connect_addresses, username=username_req, password=password_req, compression=compression, compression_threshold=compression_threshold)
 
     def handle_incoming_message(self, message):
-        # Pass on the response from the forwarding socket.
+        # Pass on the response from the forwarding socket, in the codec the request came in with.
+        try:
+            codec = get_message_codec_name(message)
+        except Exception:
+            codec = None
+        response_compression = get_response_compression(message)
+        compressors = get_advertised_compressors(message) if self.sender.compression is not None else None
         try:
             response_message = self.sender.send(message, time_out_waiting_for_response_in_sec=60)
-            return self.create_response_message(status_code=200, status_message="OK", response_message=response_message)
+            response = self.create_response_message(status_code=200, status_message="OK", response_message=response_message, codec=codec, compressors=compressors)
         except Exception as e:
-            return self.create_response_message(status_code=400, status_message="Error", response_message=e)
+            response = self.create_response_message(status_code=400, status_message="Error", response_message=e, codec=codec, compressors=compressors)
+        return compress_message(response, response_compression)
+
+
+# This class implements a broker between REQ/REP connections that handles many requests at the same time. A ROUTER
+# socket binds to the REP address and a DEALER socket connects to all REQ addresses, spreading the requests over them.
+# Responses are routed back to the right client by envelope, unchanged. A request that is not answered within
+# time_out_waiting_for_response_in_sec is answered with an error, without holding up the other requests.
+class ZmqBrokerRep2Req(ZmqDealerProxy):
+    # Note, at the moment username/password only protects the REQ-REP socket connection
+    def __init__(self, zmq_rep_bind_address, zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None, username_req=None, password_req=None, time_out_waiting_for_response_in_sec=60):
+        # Requests are handled on the receiver thread, since they only need to be sent on
+        ZmqDealerProxy.__init__(self, zmq_router_bind_address=zmq_rep_bind_address, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username=username_rep, password=password_rep, worker_threads=0)
+        self.sender = ZmqPassThroughSender(zmq_dealer_endpoints=zmq_req_connect_addresses, username=username_req, password=password_req)
+        self.time_out_waiting_for_response_in_sec = time_out_waiting_for_response_in_sec
+        self.register_dealer_socket()
+
+    def handle_incoming_message(self, message):
+        try:
+            codec = get_message_codec_name(message)
+        except Exception:
+            codec = None
+        response_future = Future()
+
+        def on_done(future):
+            try:
+                response_future.set_result(future.result())
+            except Exception as e:
+                response_future.set_result(self.create_response_message(status_code=400, status_message="Error. {0}".format(e), response_message=None, codec=codec))
+
+        try:
+            self.sender.send_async(message, self.time_out_waiting_for_response_in_sec).add_done_callback(on_done)
+        except Exception as e:
+            return self.create_response_message(status_code=400, status_message="Error. {0}".format(e), response_message=None, codec=codec)
+        finally:
+            self.register_dealer_socket()
+        return response_future
+
+
+# This class implements message forwarding from a REQ/REP connection to a ZmqJournal on disk. A call is answered
+# with OK once it is stored in the journal, or with an error when the journal is full.
+class ZmqProxyRep2Journal(ZmqReceiver):
+    def __init__(self, zmq_rep_bind_address, journal, recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None):
+        ZmqReceiver.__init__(self, zmq_rep_bind_address=zmq_rep_bind_address, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username=username_rep, password=password_rep)
+        self.journal = journal
+
+    def handle_incoming_message(self, message):
+        try:
+            self.journal.append(message)
+            return self.create_response_message(200, "OK", None)
+        except Exception as e:
+            return self.create_response_message(status_code=400, status_message="Error", response_message=str(e))
+
+
+# This class implements message forwarding from a ZmqJournal to a REQ/REP connection. A message is acknowledged
+# in the journal only after a response was received, so it is sent again when the REQ connection fails, also
+# after a restart. Any response counts, since the server handled the message. Messages are sent in order.
+class ZmqProxyJournal2Req(object):
+    def __init__(self, journal, zmq_req_connect_addresses, username_req=None, password_req=None, time_out_waiting_for_response_in_sec=60, retry_interval_in_sec=1):
+        self.journal = journal
+        self.sender = ZmqPassThroughSender(zmq_req_endpoints=zmq_req_connect_addresses, username=username_req, password=password_req, time_out_waiting_for_ready_in_sec=0)
+        self.time_out_waiting_for_response_in_sec = time_out_waiting_for_response_in_sec
+        self.retry_interval_in_sec = retry_interval_in_sec
+        self.last_received_message = None
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            message = self.journal.peek(time_out_in_sec=1)
+            if message is None or self.stopped.is_set():
+                continue
+            self.last_received_message = message
+            try:
+                self.sender.send(message, time_out_waiting_for_response_in_sec=self.time_out_waiting_for_response_in_sec)
+            except Exception as e:
+                logger.warning("Cannot forward message from journal. Trying again in %s seconds. Exception: %s", self.retry_interval_in_sec, e)
+                self.stopped.wait(self.retry_interval_in_sec)
+                continue
+            self.journal.ack()
+        self.sender.destroy()
+
+    def stop(self):
+        self.stopped.set()
+        self.journal.wake_up()
+
+
+# Forwards frames between a frontend and a backend socket inside libzmq with zmq.proxy_steerable, so Python never touches
+# the messages. Addresses of sockets that are bound are given as a string, addresses to connect to as a list.
+# A username/password on a bound socket makes it a PLAIN server, on a connecting socket it is used to log in.
+# When a capture_address is given, a PUB socket is bound there that publishes a copy of every frame passing through.
+# The run loop can be paused, resumed and terminated from any thread. Pausing ends the libzmq proxy loop, while the sockets
+# stay open and queue messages, and resuming starts it again. The PAUSE command of libzmq itself is not used, since it
+# does not work reliably across libzmq versions.
+class ZmqSteerableProxy(object):
+    def __init__(self, frontend_type, frontend_address, backend_type, backend_address, capture_address=None, username_frontend=None, password_frontend=None, username_backend=None, password_backend=None):
+        self.context = get_context()
+        self.frontend_type = frontend_type
+        self.frontend_address = frontend_address
+        self.backend_type = backend_type
+        self.backend_address = backend_address
+        self.capture_address = capture_address
+        self.credentials = {frontend_type: (username_frontend, password_frontend), backend_type: (username_backend, password_backend)}
+        # Frames are not inspected, so no message is known
+        self.last_received_message = None
+        self.auth = None
+        self.control_address = "inproc://zmqrpc-proxy-control-{0}".format(id(self))
+        self.command_socket = None
+        self.command_lock = Lock()
+        self.resumed = Event()
+        self.resumed.set()
+        self.terminated = False
+
+    def create_socket(self, socket_type, address):
+        zmq_socket = self.context.socket(socket_type)
+        zmq_socket.setsockopt(zmq.LINGER, 0)
+        username, password = self.credentials.get(socket_type, (None, None))
+        if isinstance(address, str):
+            if username is not None and password is not None:
+                if self.auth is None:
+                    self.auth = get_authenticator(self.context, username, password)
+                zmq_socket.plain_server = True
+            logger.debug("Bind socket of type %s to %s", socket_type, address)
+            zmq_socket.bind(address)
+        else:
+            if username is not None and password is not None:
+                try:
+                    zmq_socket.setsockopt_string(zmq.PLAIN_USERNAME, username)
+                    zmq_socket.setsockopt_string(zmq.PLAIN_PASSWORD, password)
+                except TypeError:
+                    # In case of python 2.
+                    zmq_socket.setsockopt(zmq.PLAIN_USERNAME, username)
+                    zmq_socket.setsockopt(zmq.PLAIN_PASSWORD, password)
+            for endpoint in address:
+                logger.debug("Connect socket of type %s to %s", socket_type, endpoint)
+                zmq_socket.connect(endpoint)
+        return zmq_socket
+
+    # Blocks until terminated
+    def run(self):
+        sockets = []
+        try:
+            frontend = self.create_socket(self.frontend_type, self.frontend_address)
+            sockets.append(frontend)
+            backend = self.create_socket(self.backend_type, self.backend_address)
+            sockets.append(backend)
+            capture = None
+            if self.capture_address:
+                capture = self.create_socket(zmq.PUB, self.capture_address)
+                sockets.append(capture)
+            control = self.context.socket(zmq.PAIR)
+            control.setsockopt(zmq.LINGER, 0)
+            control.bind(self.control_address)
+            sockets.append(control)
+            while not self.terminated:
+                self.resumed.wait()
+                if not self.terminated:
+                    # Returns when a TERMINATE command is received, which is also sent to pause
+                    zmq.proxy_steerable(frontend, backend, capture, control)
+        finally:
+            for zmq_socket in sockets:
+                zmq_socket.close()
+            release_authenticator(self.auth)
+            self.auth = None
+            with self.command_lock:
+                if self.command_socket is not None:
+                    self.command_socket.close()
+                    self.command_socket = None
+            logger.debug("Steerable proxy terminated")
+
+    # Sends a command to the proxy. Returns the reply when wait_for_reply_in_sec is given, or None if there was none in time.
+    def send_command(self, command, wait_for_reply_in_sec=None):
+        with self.command_lock:
+            if self.command_socket is None:
+                self.command_socket = self.context.socket(zmq.PAIR)
+                self.command_socket.setsockopt(zmq.LINGER, 0)
+                self.command_socket.connect(self.control_address)
+            # Since libzmq 4.3.5 every command is answered. Discard those replies so they do not pile up.
+            while self.command_socket.poll(0, zmq.POLLIN):
+                self.command_socket.recv_multipart()
+            self.command_socket.send(command)
+            if wait_for_reply_in_sec is None:
+                return None
+            if not self.command_socket.poll(int(wait_for_reply_in_sec * 1000), zmq.POLLIN):
+                return None
+            return self.command_socket.recv_multipart()
+
+    # Stops forwarding; messages queue up in the sockets until resumed
+    def pause(self):
+        self.resumed.clear()
+        self.send_command(b"TERMINATE")
+
+    def resume(self):
+        self.resumed.set()
+
+    def terminate(self):
+        self.terminated = True
+        self.resumed.set()
+        self.send_command(b"TERMINATE")
+
+    def stop(self):
+        self.terminate()
+
+    # Returns a dict with the number of messages and bytes received and sent by the frontend and backend sockets since
+    # the proxy was started or last resumed, or None when libzmq did not answer in time (it needs libzmq 4.3)
+    def statistics(self, time_out_in_sec=1):
+        reply = self.send_command(b"STATISTICS", time_out_in_sec)
+        if reply is None or len(reply) != len(STATISTICS_NAMES):
+            return None
+        return dict(zip(STATISTICS_NAMES, [struct.unpack("=Q", frame)[0] for frame in reply]))
+
+
+# Forwards PUB/SUB messages without decoding them: an XSUB socket connects to the SUB addresses and an XPUB socket binds
+# to the PUB address. Subscriptions travel upstream, so publishers only send what is subscribed to.
+class ZmqForwarderSub2Pub(ZmqSteerableProxy):
+    def __init__(self, zmq_sub_connect_addresses, zmq_pub_bind_address, capture_address=None, username_sub=None, password_sub=None, username_pub=None, password_pub=None):
+        ZmqSteerableProxy.__init__(self, zmq.XSUB, zmq_sub_connect_addresses, zmq.XPUB, zmq_pub_bind_address, capture_address, username_sub, password_sub, username_pub, password_pub)
+
+
+# Forwards REQ/REP calls without decoding them: a ROUTER socket binds to the REP address and a DEALER socket connects to
+# the REQ addresses. Responses of the servers are passed back unchanged, and many calls can be in flight at the same time.
+class ZmqForwarderRep2Req(ZmqSteerableProxy):
+    def __init__(self, zmq_rep_bind_address, zmq_req_connect_addresses, capture_address=None, username_rep=None, password_rep=None, username_req=None, password_req=None):
+        ZmqSteerableProxy.__init__(self, zmq.ROUTER, zmq_rep_bind_address, zmq.DEALER, zmq_req_connect_addresses, capture_address, username_rep, password_rep, username_req, password_req)
 
 
 class ZmqProxyThread(Thread):
@@ -102,16 +491,36 @@ class ZmqProxyThread(Thread):
         if self.proxy:
             self.proxy.stop()
 
+    # Only proxies forwarding in libzmq can be paused, resumed and asked for statistics
+    def steerable_proxy(self):
+        if not isinstance(self.proxy, ZmqSteerableProxy):
+            raise Exception("{0} cannot be steered. Only proxies forwarding in libzmq (forward_in_libzmq=True) can be paused, resumed and asked for statistics.".format(type(self).__name__))
+        return self.proxy
+
+    def pause(self):
+        self.steerable_proxy().pause()
+
+    def resume(self):
+        self.steerable_proxy().resume()
+
+    def statistics(self):
+        return self.steerable_proxy().statistics()
+
 
 class ZmqProxySub2ReqThread(ZmqProxyThread):
-    def __init__(self, zmq_sub_connect_addresses=None, zmq_req_connect_addresses=None, recreate_sockets_on_timeout_of_sec=600, username_sub=None, password_sub=None, username_req=None, password_req=None):
+    def __init__(self, zmq_sub_connect_addresses=None, zmq_req_connect_addresses=None, recreate_sockets_on_timeout_of_sec=600, username_sub=None, password_sub=None, username_req=None, password_req=None, window_size=1, ordered=False, max_retries=0, time_out_waiting_for_response_in_sec=60, compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
         ZmqProxyThread.__init__(self)
-        self.proxy = ZmqProxySub2Req(zmq_sub_connect_addresses=zmq_sub_connect_addresses, zmq_req_connect_addresses=zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_sub=username_sub, password_sub=password_sub, username_req=username_req, password_req=password_req)
+        self.proxy = ZmqProxySub2Req(zmq_sub_connect_addresses=zmq_sub_connect_addresses, zmq_req_connect_addresses=zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_sub=username_sub, password_sub=password_sub, username_req=username_req, password_req=password_req, window_size=window_size, ordered=ordered, max_retries=max_retries, time_out_waiting_for_response_in_sec=time_out_waiting_for_response_in_sec, compression=compression, compression_threshold=compression_threshold)
 
 
+# With forward_in_libzmq set, messages are forwarded by a ZmqForwarderSub2Pub, which is much faster. Heartbeat timeouts
+# do not recreate sockets in that case.
 class ZmqProxySub2PubThread(ZmqProxyThread):
-    def __init__(self, zmq_sub_connect_addresses=None, zmq_pub_bind_address=None, recreate_sockets_on_timeout_of_sec=600, username_sub=None, password_sub=None, username_pub=None, password_pub=None):
+    def __init__(self, zmq_sub_connect_addresses=None, zmq_pub_bind_address=None, recreate_sockets_on_timeout_of_sec=600, username_sub=None, password_sub=None, username_pub=None, password_pub=None, forward_in_libzmq=False, capture_address=None):
         ZmqProxyThread.__init__(self)
+        if forward_in_libzmq:
+            self.proxy = ZmqForwarderSub2Pub(zmq_sub_connect_addresses=zmq_sub_connect_addresses, zmq_pub_bind_address=zmq_pub_bind_address, capture_address=capture_address, username_sub=username_sub, password_sub=password_sub, username_pub=username_pub, password_pub=password_pub)
+            return
         self.proxy = ZmqProxySub2Pub(zmq_sub_connect_addresses=zmq_sub_connect_addresses, zmq_pub_bind_address=zmq_pub_bind_address, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_sub=username_sub, password_sub=password_sub, username_pub=username_pub, password_pub=password_pub)
 
 
@@ -121,17 +530,43 @@ class ZmqProxyRep2PubThread(ZmqProxyThread):
         self.proxy = ZmqProxyRep2Pub(zmq_rep_bind_address=zmq_rep_bind_address, zmq_pub_bind_address=zmq_pub_bind_address, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_rep=username_rep, password_rep=password_rep, username_pub=username_pub, password_pub=password_pub)
 
 
+# With forward_in_libzmq set, calls are forwarded by a ZmqForwarderRep2Req, which is much faster.
+# Use a ZmqBrokerRep2ReqThread to keep many calls in flight with a time out per call.
 class ZmqProxyRep2ReqThread(ZmqProxyThread):
-    def __init__(self, zmq_rep_bind_address=None, zmq_req_connect_addresses=None, recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None, username_req=None, password_req=None):
+    def __init__(self, zmq_rep_bind_address=None, zmq_req_connect_addresses=None, recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None, username_req=None, password_req=None, forward_in_libzmq=False, capture_address=None, compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
+        ZmqProxyThread.__init__(self)
+        if forward_in_libzmq:
+            self.proxy = ZmqForwarderRep2Req(zmq_rep_bind_address=zmq_rep_bind_address, zmq_req_connect_addresses=zmq_req_connect_addresses, capture_address=capture_address, username_rep=username_rep, password_rep=password_rep, username_req=username_req, password_req=password_req)
+            return
+        self.proxy = ZmqProxyRep2Req(zmq_rep_bind_address=zmq_rep_bind_address, zmq_req_connect_addresses=zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_rep=username_rep, password_rep=password_rep, username_req=username_req, password_req=password_req, compression=compression, compression_threshold=compression_threshold)
+
+
+class ZmqProxyRep2JournalThread(ZmqProxyThread):
+    def __init__(self, zmq_rep_bind_address=None, journal=None, recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None):
+        ZmqProxyThread.__init__(self)
+        self.proxy = ZmqProxyRep2Journal(zmq_rep_bind_address=zmq_rep_bind_address, journal=journal, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_rep=username_rep, password_rep=password_rep)
+
+
+class ZmqProxyJournal2ReqThread(ZmqProxyThread):
+    def __init__(self, journal=None, zmq_req_connect_addresses=None, username_req=None, password_req=None, time_out_waiting_for_response_in_sec=60, retry_interval_in_sec=1):
         ZmqProxyThread.__init__(self)
-        self.proxy = ZmqProxyRep2Req(zmq_rep_bind_address=zmq_rep_bind_address, zmq_req_connect_addresses=zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_rep=username_rep, password_rep=password_rep, username_req=username_req, password_req=password_req)
+        self.proxy = ZmqProxyJournal2Req(journal=journal, zmq_req_connect_addresses=zmq_req_connect_addresses, username_req=username_req, password_req=password_req, time_out_waiting_for_response_in_sec=time_out_waiting_for_response_in_sec, retry_interval_in_sec=retry_interval_in_sec)
 
 
 # This proxy class uses a 'hidden' pub/sub socket to buffer any messages from REP to REQ socket
 # in case the REQ socket is offline.
+# With a journal_directory messages are buffered in a ZmqJournal on disk instead, which keeps them over restarts
+# and takes at most journal_max_size_in_bytes. Calls are answered with an error when the journal is full.
+# A message that is not answered within time_out_waiting_for_response_in_sec is sent again.
 class ZmqBufferedProxyRep2ReqThread(ZmqProxyThread):
-    def __init__(self, zmq_rep_bind_address=None, zmq_req_connect_addresses=None, buffered_pub_address="tcp://*:59878", buffered_sub_address="tcp://localhost:59878", recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None, username_req=None, password_req=None):
+    def __init__(self, zmq_rep_bind_address=None, zmq_req_connect_addresses=None, buffered_pub_address="tcp://*:59878", buffered_sub_address="tcp://localhost:59878", recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None, username_req=None, password_req=None, journal_directory=None, journal_segment_size_in_bytes=16 * 1024 * 1024, journal_max_size_in_bytes=1024 * 1024 * 1024, time_out_waiting_for_response_in_sec=60):
         ZmqProxyThread.__init__(self)
+        self.journal = None
+        if journal_directory is not None:
+            self.journal = ZmqJournal(journal_directory, segment_size_in_bytes=journal_segment_size_in_bytes, max_size_in_bytes=journal_max_size_in_bytes)
+            self.proxy1 = ZmqProxyRep2JournalThread(zmq_rep_bind_address=zmq_rep_bind_address, journal=self.journal, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_rep=username_rep, password_rep=password_rep)
+            self.proxy2 = ZmqProxyJournal2ReqThread(journal=self.journal, zmq_req_connect_addresses=zmq_req_connect_addresses, username_req=username_req, password_req=password_req, time_out_waiting_for_response_in_sec=time_out_waiting_for_response_in_sec)
+            return
         self.proxy1 = ZmqProxyRep2PubThread(zmq_rep_bind_address=zmq_rep_bind_address, zmq_pub_bind_address=buffered_pub_address, recreate_sockets_on_timeout_of_sec=100000, username_rep=username_rep, password_rep=password_rep)
         self.proxy2 = ZmqProxySub2ReqThread(zmq_sub_connect_addresses=[buffered_sub_address], zmq_req_connect_addresses=zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_req=username_req, password_req=password_req)
 
@@ -148,3 +583,11 @@ class ZmqBufferedProxyRep2ReqThread(ZmqProxyThread):
         self.proxy1.join()
         self.proxy2.join()
         super().join()
+        if self.journal is not None:
+            self.journal.close()
+
+
+class ZmqBrokerRep2ReqThread(ZmqProxyThread):
+    def __init__(self, zmq_rep_bind_address=None, zmq_req_connect_addresses=None, recreate_sockets_on_timeout_of_sec=600, username_rep=None, password_rep=None, username_req=None, password_req=None, time_out_waiting_for_response_in_sec=60):
+        ZmqProxyThread.__init__(self)
+        self.proxy = ZmqBrokerRep2Req(zmq_rep_bind_address=zmq_rep_bind_address, zmq_req_connect_addresses=zmq_req_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username_rep=username_rep, password_rep=password_rep, username_req=username_req, password_req=password_req, time_out_waiting_for_response_in_sec=time_out_waiting_for_response_in_sec)
@@ -6,31 +6,81 @@ Created on Apr 8, 2014
 @copyright: MIT license, see http://opensource.org/licenses/MIT
 '''
 from __future__ import print_function
+from collections import OrderedDict
 import logging
-from threading import Thread
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, Thread
 
-import json
 import time
 
 import zmq
 import zmq.auth
-from zmq.auth.thread import ThreadAuthenticator
+
+from .ZmqCodec import COMPRESSORS_KEY, SUBSCRIBER_ID_SIZE, create_subscriptions, encode_credit, encode_credit_subscription, encode_message, frames_to_message, recv_frames, recv_message, send_message, split_envelope
+from .ZmqContext import get_authenticator, get_context, release_authenticator
 
 logger = logging.getLogger("zmqrpc")
 
+
+# Returns the response as json text, or as tagged bytes when another codec is given. compressors, when given, are
+# listed in the response to tell the client which compressors it may use.
+def create_response_message(status_code, status_message, response_message, codec=None, compressors=None):
+    response = {"status_code": status_code, "status_message": status_message}
+    if response_message is not None:
+        response["response_message"] = response_message
+    if compressors:
+        response[COMPRESSORS_KEY] = compressors
+    return encode_message(response, codec)
+
+
+# Messages received from a conflating SUB socket at most per poll cycle, so a flood cannot starve the other sockets
+MAX_CONFLATED_RECEIVES = 10000
+
+# A flow controlled SUB socket returns credit after handling this many messages, and whenever it has caught up
+CREDIT_INTERVAL = 64
+
+
+# A SUB socket with an optional heartbeat timeout. The address may be a tuple of the address, the heartbeat timeout
+# and optionally the conflate setting, which overrides the conflate setting of the receiver for this socket.
+# When conflating, all queued messages are read at once into a table holding only the latest message per key. conflate
+# is either True, to key messages by their topic, or a function returning the key of a received message. Messages
+# are handed out in the order their keys first came in, each being the newest one of its key.
+# A flow controlled SUB socket is an XSUB socket that acknowledges the messages it handled to the publisher. With
+# conflation, messages replaced by a newer one count as handled.
 class SubSocket(object):
-    def __init__(self, ctx, poller, address, timeout_in_sec=None):
+    def __init__(self, ctx, poller, address, timeout_in_sec=None, subscriptions=None, conflate=None, flow_control=False):
         self.ctx = ctx
         self.poller = poller
         self.address = address
         self.timeout_in_sec = timeout_in_sec
+        self.subscriptions = subscriptions if subscriptions is not None else [b'']
+        # Topic of the last received message, or None when it was published without one
+        self.topic = None
+        self.conflate = address[2] if isinstance(address, tuple) and len(address) > 2 else conflate
+        # Latest (topic, message) per key when conflating, and the number of messages replaced by a newer one
+        self.latest_messages = OrderedDict()
+        self.conflated = 0
+        self.flow_control = flow_control
+        self.subscriber_id = os.urandom(SUBSCRIBER_ID_SIZE)
+        # Sequence of the last received message and the last one acknowledged to a flow controlled publisher
+        self.sequence = None
+        self.acknowledged_sequence = None
         self.zmq_socket = None
         self.create()
 
     def create(self):
         if not self.zmq_socket:
-            self.zmq_socket = self.ctx.socket(zmq.SUB)
-            self.zmq_socket.setsockopt(zmq.SUBSCRIBE, b'')
+            if self.flow_control:
+                self.zmq_socket = self.ctx.socket(zmq.XSUB)
+                # Announce this subscriber and what it receives before the others, so the publisher knows it once it
+                # counts the subscriber
+                for subscription in [encode_credit_subscription(self.subscriber_id, self.subscriptions)] + self.subscriptions:
+                    self.zmq_socket.send(b'\x01' + subscription)
+            else:
+                self.zmq_socket = self.ctx.socket(zmq.SUB)
+                for subscription in self.subscriptions:
+                    self.zmq_socket.setsockopt(zmq.SUBSCRIBE, subscription)
             self.zmq_socket.setsockopt(zmq.LINGER, 0)
             if isinstance(self.address, str):
                 self.zmq_socket.connect(self.address)
@@ -53,16 +103,28 @@ class SubSocket(object):
                 address = address.replace('*', '0.0.0.0')
             self.zmq_socket.disconnect(address)
             self.zmq_socket.close()
-            while not self.zmq_socket.closed:
-                time.sleep(1)
             self.zmq_socket = None
             logger.debug("Destroyed SUB socket bound to %s", self.address)
 
-    def recv_string(self, socks):
-        if self.zmq_socket is not None and (socks.get(self.zmq_socket) == zmq.POLLIN):
-            result = self.zmq_socket.recv_string()
+    # Returns the seconds left until the heartbeat timeout is exceeded, or None without a timeout
+    def time_until_timeout(self):
+        if self.timeout_in_sec is None:
+            return None
+        return max(0, self.last_received_bytes + self.timeout_in_sec - time.time())
+
+    # Returns text for plain messages and bytes for messages tagged with a codec
+    def recv_message(self, socks):
+        if self.zmq_socket is not None and self.conflate:
+            if socks.get(self.zmq_socket) == zmq.POLLIN:
+                self.recv_latest_messages()
+            if self.latest_messages:
+                self.topic, message = self.latest_messages.popitem(last=False)[1]
+                return message
+        elif self.zmq_socket is not None and (socks.get(self.zmq_socket) == zmq.POLLIN):
+            self.topic, sequence, frames = split_envelope(recv_frames(self.zmq_socket))
+            self.sequence = sequence if sequence is not None else self.sequence
             self.last_received_bytes = time.time()
-            return result
+            return frames_to_message(frames)
         if (self.timeout_in_sec is not None) and time.time() > self.last_received_bytes + self.timeout_in_sec:
             # Recreate sockets
             logger.warn("Heartbeat timeout exceeded. Recreating SUB socket to %s", self.address)
@@ -70,6 +132,42 @@ class SubSocket(object):
             self.create()
         return None
 
+    # Reads all queued messages into the table of latest messages. Heartbeats only keep the socket alive.
+    def recv_latest_messages(self):
+        for _ in range(MAX_CONFLATED_RECEIVES):
+            try:
+                topic, sequence, frames = split_envelope(recv_frames(self.zmq_socket, zmq.NOBLOCK))
+            except zmq.Again:
+                break
+            self.last_received_bytes = time.time()
+            self.sequence = sequence if sequence is not None else self.sequence
+            message = frames_to_message(frames)
+            if message == "zmq_sub_heartbeat":
+                continue
+            try:
+                key = topic if self.conflate is True else self.conflate(message)
+            except Exception as e:
+                logger.error("Discarding message on SUB socket to %s without conflation key: %s", self.address, e)
+                continue
+            if key in self.latest_messages:
+                self.conflated += 1
+            self.latest_messages[key] = (topic, message)
+
+    # Acknowledges the received messages to a flow controlled publisher once they are handled: every CREDIT_INTERVAL
+    # messages and when no more messages are queued. Called after the last received message has been handled.
+    def grant_credit(self):
+        if not self.flow_control or self.zmq_socket is None or self.sequence is None or self.latest_messages:
+            return
+        if self.sequence == self.acknowledged_sequence:
+            return
+        # A restarted publisher starts counting again, so only a difference in the right direction can wait
+        if self.acknowledged_sequence is not None and 0 < self.sequence - self.acknowledged_sequence < CREDIT_INTERVAL and self.zmq_socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+            return
+        credit = encode_credit(self.subscriber_id, self.sequence)
+        self.zmq_socket.send(b'\x01' + credit)
+        self.zmq_socket.send(b'\x00' + credit)
+        self.acknowledged_sequence = self.sequence
+
 class RepSocket(object):
     def __init__(self, ctx, poller, address, auth):
         self.ctx = ctx
@@ -99,97 +197,333 @@ class RepSocket(object):
                 address = address.replace('*', '0.0.0.0')
             self.zmq_socket.unbind(address)
             self.zmq_socket.close()
-            while not self.zmq_socket.closed:
-                time.sleep(1)
             self.zmq_socket = None
             logger.debug("Destroyed REP socket bound to %s", self.address)
 
-    def recv_string(self, socks):
+    # Returns text for plain messages and bytes for messages tagged with a codec
+    def recv_message(self, socks):
         if self.zmq_socket is not None and (socks.get(self.zmq_socket) == zmq.POLLIN):
-            result = self.zmq_socket.recv_string()
+            result = recv_message(self.zmq_socket)
             self.last_received_bytes = time.time()
             return result
         return None
 
     def send(self, message):
         if self.zmq_socket is not None and message is not None:
-            self.zmq_socket.send_string(message)
+            send_message(self.zmq_socket, message)
+
+
+class RouterSocket(object):
+    def __init__(self, ctx, poller, address, auth):
+        self.ctx = ctx
+        self.poller = poller
+        self.address = address
+        self.auth = auth
+        self.zmq_socket = None
+        self.create()
+
+    def create(self):
+        if not self.zmq_socket:
+            self.zmq_socket = self.ctx.socket(zmq.ROUTER)
+            self.zmq_socket.setsockopt(zmq.LINGER, 0)
+            if self.auth:
+                self.zmq_socket.plain_server = True
+            self.zmq_socket.bind(self.address)
+            self.poller.register(self.zmq_socket, zmq.POLLIN)
+            logger.debug("Created ROUTER socket bound to %s", self.address)
+
+    def destroy(self):
+        if self.zmq_socket:
+            self.poller.unregister(self.zmq_socket)
+            address = self.address
+            # Since some recent version of pyzmq it does not accept unbind
+            # of an address with '*'. Replace it with 0.0.0.0
+            if '*' in address:
+                address = address.replace('*', '0.0.0.0')
+            self.zmq_socket.unbind(address)
+            self.zmq_socket.close()
+            self.zmq_socket = None
+            logger.debug("Destroyed ROUTER socket bound to %s", self.address)
+
+    # Returns a tuple of the envelope (all frames up to and including the empty delimiter) and the message
+    def recv_multipart(self, socks):
+        if self.zmq_socket is not None and (socks.get(self.zmq_socket) == zmq.POLLIN):
+            frames = recv_frames(self.zmq_socket)
+            self.last_received_bytes = time.time()
+            if b'' not in frames:
+                logger.warning("Discarding message without envelope delimiter on ROUTER socket")
+                return None
+            delimiter_index = frames.index(b'')
+            return frames[:delimiter_index + 1], frames[delimiter_index + 1:]
+        return None
+
+    def send_multipart(self, frames):
+        if self.zmq_socket is not None:
+            self.zmq_socket.send_multipart(frames, copy=False)
 
 
 # A ZmqReceiver class will listen on a REP or SUB socket for messages and will invoke a 'HandleIncomingMessage'
 # method to process it. Subclasses should override that. A response must be implemented for REP sockets, but
 # is useless for SUB sockets.
+# Instead of a REP socket a ROUTER socket can be bound. Messages on the ROUTER socket are handled by a pool
+# of worker_threads threads, so a slow message does not hold up the others. handle_incoming_message must be
+# thread safe in that case. Responses are sent back to the right client as soon as they are ready.
+# With worker_threads=0 messages on the ROUTER socket are handled on the receiver thread itself, which suits
+# handle_incoming_message implementations that return a Future at once.
+# handle_incoming_message may also return a Future of the response, for example when the work is done in another
+# process. The receiver then keeps polling and sends the response over the REP or ROUTER socket once it is resolved.
+# The poller only wakes up for messages, heartbeat timeouts and commands. Commands (stop, recreate_sockets and
+# reconfigure) may be given from any thread. They are sent over an inproc control socket, so the receiver acts on them at once.
+# With conflate a receiver that falls behind on its SUB sockets only handles the latest message per key, see SubSocket.
+# With flow_control the SUB sockets return credit to publishers with a flow_control_window, see ZmqSender.
 class ZmqReceiver(object):
-    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, recreate_sockets_on_timeout_of_sec=600, username=None, password=None):
-        self.context = zmq.Context()
+    # Messages without a topic that start with one of these prefixes are received when subscribing to topics
+    legacy_sub_prefixes = ()
+
+    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, recreate_sockets_on_timeout_of_sec=600, username=None, password=None, zmq_router_bind_address=None, worker_threads=4, zmq_sub_topics=None, conflate=None, flow_control=False):
+        self.context = get_context()
         self.auth = None
         self.last_received_message = None
         self.is_running = False
         self.thread = None
         self.zmq_rep_bind_address = zmq_rep_bind_address
         self.zmq_sub_connect_addresses = zmq_sub_connect_addresses
+        self.sub_subscriptions = create_subscriptions(zmq_sub_topics, self.legacy_sub_prefixes)
+        self.conflate = conflate
+        self.flow_control = flow_control
+        # Topic of the SUB message being handled by handle_incoming_message
+        self.incoming_topic = None
         self.poller = zmq.Poller()
         self.sub_sockets = []
         self.rep_socket = None
+        self.zmq_router_bind_address = zmq_router_bind_address
+        self.router_socket = None
+        self.executor = None
+        # Messages on the ROUTER socket waiting for a worker thread
+        self.queued_messages = 0
+        self.queue_lock = Lock()
+        # All executors are shut down before the sockets are destroyed when the receiver stops
+        self.executors = []
+        # Responses computed outside the receiver thread are pushed to this inproc socket, which wakes up the poller
+        self.response_address = "inproc://zmqrpc-responses-{0}".format(id(self))
+        self.response_push_lock = Lock()
+        # Commands from other threads are pushed to this inproc socket, which wakes up the poller as well
+        self.control_address = "inproc://zmqrpc-control-{0}".format(id(self))
+        self.control_push_lock = Lock()
+        self.recreate_sockets_on_timeout_of_sec = recreate_sockets_on_timeout_of_sec
+        self.pending_sub_connect_addresses = None
         if username is not None and password is not None:
-            # Start an authenticator for this context.
+            # Start an authenticator for this context, handling PLAIN requests. On the shared context it is shared.
             # Does not work on PUB/SUB as far as I (probably because the more secure solutions
             # require two way communication as well)
-            self.auth = ThreadAuthenticator(self.context)
-            self.auth.start()
-            # Instruct authenticator to handle PLAIN requests
-            self.auth.configure_plain(domain='*', passwords={username: password})
+            self.auth = get_authenticator(self.context, username, password)
 
         if self.zmq_sub_connect_addresses:
             for address in self.zmq_sub_connect_addresses:
-                self.sub_sockets.append(SubSocket(self.context, self.poller, address, recreate_sockets_on_timeout_of_sec))
+                self.sub_sockets.append(SubSocket(self.context, self.poller, address, recreate_sockets_on_timeout_of_sec, self.sub_subscriptions, conflate, flow_control))
         if zmq_rep_bind_address:
             self.rep_socket = RepSocket(self.context, self.poller, zmq_rep_bind_address, self.auth)
+        if zmq_router_bind_address:
+            self.router_socket = RouterSocket(self.context, self.poller, zmq_router_bind_address, self.auth)
+            if worker_threads:
+                self.executor = ThreadPoolExecutor(max_workers=worker_threads)
+                self.executors.append(self.executor)
+        self.response_pull_socket = self.context.socket(zmq.PULL)
+        self.response_pull_socket.setsockopt(zmq.LINGER, 0)
+        self.response_pull_socket.bind(self.response_address)
+        self.poller.register(self.response_pull_socket, zmq.POLLIN)
+        self.response_push_socket = self.context.socket(zmq.PUSH)
+        self.response_push_socket.setsockopt(zmq.LINGER, 0)
+        self.response_push_socket.connect(self.response_address)
+        self.control_pull_socket = self.context.socket(zmq.PULL)
+        self.control_pull_socket.setsockopt(zmq.LINGER, 0)
+        self.control_pull_socket.bind(self.control_address)
+        self.poller.register(self.control_pull_socket, zmq.POLLIN)
+        self.control_push_socket = self.context.socket(zmq.PUSH)
+        self.control_push_socket.setsockopt(zmq.LINGER, 0)
+        self.control_push_socket.connect(self.control_address)
+
+    # Wakes up the receiver thread to execute the command
+    def send_command(self, command):
+        with self.control_push_lock:
+            if self.control_push_socket.closed:
+                logger.debug("Receiver stopped. Discarding command %s.", command)
+                return
+            self.control_push_socket.send(command)
 
-    # May take up to 60 seconds to actually stop since poller has timeout of 60 seconds
+    # Stops the receiver. The run loop exits as soon as it has handled the message it is busy with.
     def stop(self):
         self.is_running = False
         logger.info("Closing pub and sub sockets...")
-        if self.auth is not None:
-            self.auth.stop()
+        self.send_command(b"stop")
+        release_authenticator(self.auth)
+        self.auth = None
+
+    # Recreates all SUB sockets, for example after the network changed
+    def recreate_sockets(self):
+        self.send_command(b"recreate")
+
+    # Replaces the SUB sockets with sockets connecting to the given addresses
+    def reconfigure(self, zmq_sub_connect_addresses):
+        self.pending_sub_connect_addresses = list(zmq_sub_connect_addresses)
+        self.send_command(b"reconfigure")
+
+    # Executes a command given by another thread. Runs on the receiver thread, which owns the sockets.
+    def handle_command(self, command):
+        logger.debug("Got command %s", command)
+        if command == b"stop":
+            self.is_running = False
+        elif command == b"recreate":
+            for sub_socket in self.sub_sockets:
+                sub_socket.destroy()
+                sub_socket.create()
+        elif command == b"reconfigure" and self.pending_sub_connect_addresses is not None:
+            for sub_socket in self.sub_sockets:
+                sub_socket.destroy()
+            self.zmq_sub_connect_addresses = self.pending_sub_connect_addresses
+            self.pending_sub_connect_addresses = None
+            self.sub_sockets = [SubSocket(self.context, self.poller, address, self.recreate_sockets_on_timeout_of_sec, self.sub_subscriptions, self.conflate, self.flow_control) for address in self.zmq_sub_connect_addresses]
+        else:
+            logger.warning("Ignoring unknown command %s", command)
+
+    # Returns the poll timeout in milliseconds: until the first heartbeat timeout of a SUB socket, or None to wait
+    # until a message or command arrives. Conflated messages that are waiting are handled without waiting.
+    def poll_timeout(self):
+        if any(sub_socket.latest_messages for sub_socket in self.sub_sockets):
+            return 0
+        timeouts = [sub_socket.time_until_timeout() for sub_socket in self.sub_sockets]
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        if not timeouts:
+            return None
+        return int(min(timeouts) * 1000) + 1
 
     def run(self):
         self.is_running = True
 
         while self.is_running:
-            socks = dict(self.poller.poll(1000))
+            socks = dict(self.poller.poll(self.poll_timeout()))
             logger.debug("Poll cycle over. checking sockets")
+            if socks.get(self.control_pull_socket) == zmq.POLLIN:
+                self.handle_command(self.control_pull_socket.recv())
+                if not self.is_running:
+                    break
             if self.rep_socket:
-                incoming_message = self.rep_socket.recv_string(socks)
+                incoming_message = self.rep_socket.recv_message(socks)
                 if incoming_message is not None:
                     self.last_received_message = incoming_message
                     try:
                         logger.debug("Got info from REP socket")
                         response_message = self.handle_incoming_message(incoming_message)
-                        self.rep_socket.send(response_message)
+                        if isinstance(response_message, Future):
+                            # REP socket will not receive new messages until this response has been sent
+                            self.complete_response([b''], response_message)
+                        else:
+                            self.rep_socket.send(response_message)
                     except Exception as e:
                         logger.error(e)
+            if self.router_socket:
+                routed_message = self.router_socket.recv_multipart(socks)
+                if routed_message is not None:
+                    envelope, frames = routed_message
+                    incoming_message = frames_to_message(frames)
+                    self.last_received_message = incoming_message
+                    logger.debug("Got info from ROUTER socket")
+                    if self.executor is not None:
+                        with self.queue_lock:
+                            self.queued_messages += 1
+                        self.executor.submit(self.handle_queued_message, envelope, incoming_message)
+                    else:
+                        self.handle_routed_message(envelope, incoming_message)
+            if socks.get(self.response_pull_socket) == zmq.POLLIN:
+                frames = recv_frames(self.response_pull_socket)
+                # Responses with an empty envelope belong to the REP socket
+                if frames[0] == b'':
+                    self.rep_socket.send(frames_to_message(frames[1:]))
+                else:
+                    self.router_socket.send_multipart(frames)
             for sub_socket in self.sub_sockets:
-                incoming_message = sub_socket.recv_string(socks)
+                incoming_message = sub_socket.recv_message(socks)
                 if incoming_message is not None:
                     if incoming_message != "zmq_sub_heartbeat":
                         self.last_received_message = incoming_message
                     logger.debug("Got info from SUB socket")
+                    self.incoming_topic = sub_socket.topic
                     try:
                         self.handle_incoming_message(incoming_message)
                     except Exception as e:
                         logger.error(e)
+                    self.incoming_topic = None
+                sub_socket.grant_credit()
+            try:
+                self.handle_poll_cycle(socks)
+            except Exception as e:
+                logger.error(e)
 
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        self.poller.unregister(self.response_pull_socket)
+        self.poller.unregister(self.control_pull_socket)
+        with self.response_push_lock:
+            self.response_push_socket.close()
+        with self.control_push_lock:
+            self.control_push_socket.close()
+        self.response_pull_socket.close()
+        self.control_pull_socket.close()
+        if self.router_socket:
+            self.router_socket.destroy()
         if self.rep_socket:
             self.rep_socket.destroy()
         for sub_socket in self.sub_sockets:
             sub_socket.destroy()
 
-    def create_response_message(self, status_code, status_message, response_message):
-        if response_message is not None:
-            return json.dumps({"status_code": status_code, "status_message": status_message, "response_message": response_message})
-        else:
-            return json.dumps({"status_code": status_code, "status_message": status_message})
+    # Returns the number of messages the conflating SUB sockets replaced by newer ones, and the number waiting to be handled
+    def conflation_stats(self):
+        return {"conflated": sum(sub_socket.conflated for sub_socket in self.sub_sockets), "pending": sum(len(sub_socket.latest_messages) for sub_socket in self.sub_sockets)}
+
+    # Called on the receiver thread at the end of every poll cycle with the sockets that have messages. Subclasses
+    # can register sockets of their own with the poller and handle them here. Override poll_timeout as well
+    # when there is work to do at a given time.
+    def handle_poll_cycle(self, socks):
+        pass
+
+    def handle_queued_message(self, envelope, message):
+        with self.queue_lock:
+            self.queued_messages -= 1
+        self.handle_routed_message(envelope, message)
+
+    # Runs on a worker thread for every message received on the ROUTER socket
+    def handle_routed_message(self, envelope, message):
+        try:
+            self.complete_response(envelope, self.handle_incoming_message(message))
+        except Exception as e:
+            logger.error(e)
+
+    # Queues the response for the client identified by the envelope. The response may be a Future
+    # in which case it is sent as soon as the Future is resolved.
+    def complete_response(self, envelope, response_message):
+        if isinstance(response_message, Future):
+            response_message.add_done_callback(lambda future: self.complete_future_response(envelope, future))
+            return
+        if response_message is None:
+            return
+        with self.response_push_lock:
+            if self.response_push_socket.closed:
+                logger.warning("Receiver stopped. Discarding response.")
+                return
+            send_message(self.response_push_socket, response_message, envelope)
+
+    # Sends the response a Future resolved with. When the Future failed an error response is sent instead, so the
+    # client does not wait in vain and a REP socket can receive again.
+    def complete_future_response(self, envelope, future):
+        try:
+            response_message = future.result()
+        except Exception as e:
+            logger.error("Cannot create response. Exception: %s", e)
+            response_message = self.create_response_message(500, "Exception raised when creating the response. Exception: {0}".format(e), None)
+        self.complete_response(envelope, response_message)
+
+    def create_response_message(self, status_code, status_message, response_message, codec=None, compressors=None):
+        return create_response_message(status_code, status_message, response_message, codec, compressors)
 
     def handle_incoming_message(self, message):
         if message != "zmq_sub_heartbeat":
@@ -197,9 +531,9 @@ class ZmqReceiver(object):
 
 
 class ZmqReceiverThread(Thread):
-    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, recreate_sockets_on_timeout_of_sec=60, username=None, password=None):
+    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, recreate_sockets_on_timeout_of_sec=60, username=None, password=None, zmq_router_bind_address=None, worker_threads=4, zmq_sub_topics=None, conflate=None, flow_control=False):
         Thread.__init__(self)
-        self.receiver = ZmqReceiver(zmq_rep_bind_address=zmq_rep_bind_address, zmq_sub_connect_addresses=zmq_sub_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username=username, password=password)
+        self.receiver = ZmqReceiver(zmq_rep_bind_address=zmq_rep_bind_address, zmq_sub_connect_addresses=zmq_sub_connect_addresses, recreate_sockets_on_timeout_of_sec=recreate_sockets_on_timeout_of_sec, username=username, password=password, zmq_router_bind_address=zmq_router_bind_address, worker_threads=worker_threads, zmq_sub_topics=zmq_sub_topics, conflate=conflate, flow_control=flow_control)
 
     def last_received_message(self):
         return self.receiver.last_received_message
@@ -0,0 +1,99 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+from collections import OrderedDict
+from threading import Lock
+import json
+import logging
+import time
+
+logger = logging.getLogger("zmqrpc")
+
+
+# Returns the key of a call in the cache, or None if the parameters cannot be canonicalised (for example
+# because they hold bytes or numpy arrays). Such calls are not cached. Parameters are canonicalised as json
+# with sorted keys, so dicts with the same content give the same key regardless of their order.
+# The codec_name keeps results serialized with different codecs apart.
+def create_cache_key(function_name, function_parameters, codec_name=None):
+    try:
+        return function_name, json.dumps(function_parameters, sort_keys=True, separators=(',', ':')), codec_name
+    except (TypeError, ValueError):
+        return None
+
+
+# A ZmqRpcCache keeps results of a ZmqRpcClient for functions that are safe to cache: read-only functions whose
+# result only depends on their parameters. Only functions listed in cached_functions are cached. It maps a function
+# name to the time to live of its results in seconds, or None to keep them until they are evicted or invalidated.
+# At most max_entries results are kept; the least recently used result is evicted first.
+# Cached results are returned as they are, so do not modify them. The cache is thread safe.
+# The ZmqRpcServer uses it as well, to keep serialized responses of functions registered as cacheable.
+class ZmqRpcCache(object):
+    def __init__(self, cached_functions, max_entries=1024):
+        self.cached_functions = dict(cached_functions)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def is_cached_function(self, function_name):
+        return function_name in self.cached_functions
+
+    # Returns a tuple of found and the cached result
+    def get(self, function_name, function_parameters, codec_name=None):
+        key = create_cache_key(function_name, function_parameters, codec_name)
+        if key is None:
+            return False, None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            # Move the entry to the end, making it the most recently used
+            del self.entries[key]
+            self.entries[key] = entry
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, function_name, function_parameters, result, codec_name=None):
+        key = create_cache_key(function_name, function_parameters, codec_name)
+        if key is None:
+            return
+        time_to_live_in_sec = self.cached_functions.get(function_name)
+        expires_at = None if time_to_live_in_sec is None else time.time() + time_to_live_in_sec
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires_at, result)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Removes cached results. Without arguments everything is removed, with only a function_name all results
+    # of that function, and with function_parameters as well only the result of that call.
+    def invalidate(self, function_name=None, function_parameters=None, codec_name=None):
+        with self.lock:
+            if function_name is None:
+                self.entries.clear()
+            elif function_parameters is None:
+                for key in [key for key in self.entries if key[0] == function_name]:
+                    del self.entries[key]
+            else:
+                key = create_cache_key(function_name, function_parameters, codec_name)
+                if key is not None:
+                    self.entries.pop(key, None)
+
+    def hit_ratio(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return float(self.hits) / total if total else 0.0
+
+    # Returns the counters as a dict
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries)}
@@ -5,37 +5,131 @@ Created on Apr 8, 2014
 
 @copyright: MIT license, see http://opensource.org/licenses/MIT
 '''
-import json
 import logging
-from .ZmqSender import ZmqSender
+from .ZmqCodec import DEFAULT_COMPRESSION_THRESHOLD, encode_message, get_codec
+from .ZmqRpcInterceptor import run_interceptors
+from .ZmqSender import ZmqSender, parse_response_dict
 
 logger = logging.getLogger("zmqrpc")
 
 
+def serialize_function_call(function_name, function_parameters, codec=None):
+    codec = get_codec(codec or "json")
+    if function_parameters is not None:
+        message = {"function": function_name, "parameters": function_parameters}
+    else:
+        message = {"function": function_name}
+    try:
+        return encode_message(message, codec)
+    except Exception as e:
+        raise Exception("Cannot wrap parameters in {0} format. Exception: {1}".format(codec.name, e))
+
+
+# Serializes a list of (function_name, function_parameters) tuples into one batch message
+def serialize_function_calls(calls, codec=None):
+    codec = get_codec(codec or "json")
+    batch = []
+    for function_name, function_parameters in calls:
+        if function_parameters is not None:
+            batch.append({"function": function_name, "parameters": function_parameters})
+        else:
+            batch.append({"function": function_name})
+    try:
+        return encode_message({"batch": batch}, codec)
+    except Exception as e:
+        raise Exception("Cannot wrap parameters in {0} format. Exception: {1}".format(codec.name, e))
+
+
+# Turns the outcome of every call in a batch response into its result, or the Exception it raised
+def parse_batch_response(call_results):
+    results = []
+    for call_result in call_results:
+        try:
+            results.append(parse_response_dict(call_result))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
 # The ZmqRpcClient class implements a ZmqSender class but extends it with the ability
 # to invoke a method on a remote server. Method invocation is implemented by providing
 # a function name to invoke (function_name) and the function_parameters as a dict.
 # The constructor of the class requires the ZMQ endpoints to be provided as well as
 # (optionally) a username/password to 'secure' the connection.
+# When DEALER endpoints are given instead of REQ endpoints, invoke_async can be used to have
+# many invocations in flight at the same time.
+# The codec (by default "json") determines how calls are serialized, for example "msgpack" or "pickle".
+# The codec is tagged on the wire and the server responds with the same codec.
+# An optional ZmqRpcCache lets invoke return results of cacheable functions without a round trip.
+# With a compression ("zlib", or "lz4" and "zstd" when their packages are installed) calls of at least
+# compression_threshold bytes are compressed, batches included, once the server listed the compressor in a response.
+# The server then compresses its responses as well. Older servers list none, so they only get uncompressed calls.
+# See ZmqSender for the sockets over which calls are compressed.
+# With use_topics calls over the PUB socket are published on the topic of their function name, so they are only
+# sent to servers that host the function. Batches are published without a topic. Older servers subscribe to everything
+# and take the topic frame for a malformed call, so only enable use_topics once all servers are upgraded.
+# flow_control_window and flow_control_policy make the PUB socket flow controlled, see ZmqSender.
+# The interceptors, a list of ZmqRpcInterceptor, wrap every invocation and every serialized call, the first interceptor
+# outermost. Results served from the cache do not pass the interceptors.
 class ZmqRpcClient(ZmqSender):
-    def __init__(self, zmq_req_endpoints=None, zmq_pub_endpoint=None, username=None, password=None):
-        ZmqSender.__init__(self, zmq_req_endpoints, zmq_pub_endpoint, username, password)
+    def __init__(self, zmq_req_endpoints=None, zmq_pub_endpoint=None, username=None, password=None, zmq_dealer_endpoints=None, codec=None, cache=None, time_out_waiting_for_ready_in_sec=0.5, failures_before_ejection=3, ejection_time_in_sec=30, compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD, use_topics=False, flow_control_window=None, flow_control_policy="block", interceptors=None):
+        ZmqSender.__init__(self, zmq_req_endpoints, zmq_pub_endpoint, username, password, zmq_dealer_endpoints, time_out_waiting_for_ready_in_sec, failures_before_ejection, ejection_time_in_sec, flow_control_window, flow_control_policy, compression, compression_threshold)
+        self.codec = get_codec(codec or "json")
+        self.cache = cache
+        self.use_topics = use_topics
+        self.interceptors = list(interceptors or [])
 
     def serialize_function_call(self, function_name, function_parameters):
-        if function_parameters is not None:
-            message = {"function": function_name, "parameters": function_parameters}
-        else:
-            message = {"function": function_name}
-        try:
-            return json.dumps(message)
-        except Exception as e:
-            raise Exception("Cannot wrap parameters in json format. Exception: {0}".format(e))
+        return serialize_function_call(function_name, function_parameters, self.codec)
 
     # Invokes a function on a remote ZeroMQ process and returns the result of calling the function in case of a REQ socket. Parameters should be a dict.
     # time_out_waiting_for_response_in_sec indicates the time to wait for a response of the server. If none is received in the given time
     # the system does not try again and will discard the message, never knowing if it was received by the server or not.
+    # When the function is cached by the cache of the client, a cached result is returned without invoking the server.
     def invoke(self, function_name, function_parameters=None, time_out_waiting_for_response_in_sec=600):
+        use_cache = self.uses_cache(function_name)
+        if use_cache:
+            found, result = self.cache.get(function_name, function_parameters)
+            if found:
+                return result
+
+        def send_call(function_name, function_parameters):
+            # Try to serialize. If it fails, throw an error and exit.
+            message = self.serialize_function_call(function_name, function_parameters)
+            topic = function_name if self.use_topics else None
+            return run_interceptors(self.interceptors, "intercept_message", lambda message: self.send(message, time_out_waiting_for_response_in_sec, topic), message)
+
+        result = run_interceptors(self.interceptors, "intercept_call", send_call, function_name, function_parameters)
+        if use_cache:
+            self.cache.put(function_name, function_parameters, result)
+        return result
+
+    # Results can only be cached when the server responds, so not when only a PUB socket is used
+    def uses_cache(self, function_name):
+        if self.cache is None or not (self.zmq_req_endpoints or self.zmq_dealer_endpoints):
+            return False
+        return self.cache.is_cached_function(function_name)
+
+    # Removes cached results, see ZmqRpcCache.invalidate
+    def invalidate_cache(self, function_name=None, function_parameters=None):
+        if self.cache is not None:
+            self.cache.invalidate(function_name, function_parameters)
+
+    # Invokes a function on a remote ZeroMQ process over the DEALER socket without waiting for the result.
+    # Returns a ZmqResponseFuture; its result() returns the result of the function or raises its error.
+    def invoke_async(self, function_name, function_parameters=None, time_out_waiting_for_response_in_sec=600):
+        def send_call(function_name, function_parameters):
+            message = self.serialize_function_call(function_name, function_parameters)
+            return run_interceptors(self.interceptors, "intercept_message", lambda message: self.send_async(message, time_out_waiting_for_response_in_sec), message)
+
+        return run_interceptors(self.interceptors, "intercept_call", send_call, function_name, function_parameters)
 
-        # Try to serialize. If it fails, throw an error and exit.
-        message_json = self.serialize_function_call(function_name, function_parameters)
-        return self.send(message_json, time_out_waiting_for_response_in_sec)
+    # Invokes a list of (function_name, function_parameters) tuples on a remote ZeroMQ process in one message
+    # and one round trip. The server invokes them in order. Returns a list with, for every call in the same order,
+    # the result of the function or the Exception it raised. Over a PUB socket None is returned.
+    def invoke_many(self, calls, time_out_waiting_for_response_in_sec=600):
+        message = serialize_function_calls(calls, self.codec)
+        call_results = run_interceptors(self.interceptors, "intercept_message", lambda message: self.send(message, time_out_waiting_for_response_in_sec), message)
+        if call_results is None:
+            return None
+        return parse_batch_response(call_results)
@@ -0,0 +1,139 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+from concurrent.futures import Future
+from threading import Lock
+import cProfile
+import itertools
+import logging
+import os
+import random
+import re
+import time
+
+# tracemalloc is part of Python since 3.4
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+logger = logging.getLogger("zmqrpc")
+
+PROFILER_MODES = ("cprofile", "tracemalloc")
+# Number of frames kept of the stack of every allocation traced by tracemalloc
+TRACEMALLOC_FRAMES = 10
+
+
+# Base class of the interceptors of a ZmqRpcServer or ZmqRpcClient. Both hooks pass everything on unchanged; override
+# either of them. An interceptor may change the arguments before calling proceed, change what proceed returns, or
+# answer without calling proceed at all.
+# intercept_message wraps a serialized call. On the server proceed takes the incoming message and returns the encoded
+# response, on the client it takes the serialized call and returns the result of the function.
+# intercept_call wraps the dispatch of a decoded call. On the server proceed invokes the function and returns a tuple of
+# status_code, status_message and response_message, on the client it serializes and sends the call and returns the result.
+# proceed returns a Future for calls that run in the process pool of a server and for ZmqRpcClient.invoke_async.
+class ZmqRpcInterceptor(object):
+    def intercept_message(self, message, proceed):
+        return proceed(message)
+
+    def intercept_call(self, function_name, parameters, proceed):
+        return proceed(function_name, parameters)
+
+
+# Calls handler with args through the given hook of every interceptor, the first interceptor being the outermost
+def run_interceptors(interceptors, hook, handler, *args):
+    for interceptor in reversed(interceptors):
+        handler = bind_interceptor(getattr(interceptor, hook), handler)
+    return handler(*args)
+
+
+def bind_interceptor(intercept, proceed):
+    return lambda *args: intercept(*args, proceed=proceed)
+
+
+# ZmqRpcProfiler profiles calls with cProfile, or traces their memory allocations with tracemalloc, and writes a profile
+# per call to directory: a pstats file (.prof) or a tracemalloc snapshot (.tracemalloc), named after the time, the
+# function and the latency of the call. Load them with pstats.Stats(path) or tracemalloc.Snapshot.load(path).
+# A fraction sample_rate of the calls is profiled. With a latency_threshold_in_sec, a call that takes longer than that
+# without being profiled has the next call of the same function profiled, which is written when it is slow as well.
+# Both profilers are process wide, so one call is profiled at a time and calls that come in meanwhile are not profiled.
+# tracemalloc traces the allocations of all threads. After max_profiles profiles nothing is profiled anymore.
+# Calls that return a Future, like those in the process pool of a server, are not written. The tracemalloc mode needs
+# Python 3.4 or later.
+class ZmqRpcProfiler(ZmqRpcInterceptor):
+    def __init__(self, directory, sample_rate=0.01, latency_threshold_in_sec=None, mode="cprofile", max_profiles=100):
+        if mode not in PROFILER_MODES:
+            raise Exception("Unknown profiler mode {0}. Use one of {1}.".format(mode, ", ".join(PROFILER_MODES)))
+        if mode == "tracemalloc" and tracemalloc is None:
+            raise Exception("Profiler mode tracemalloc is not available. It needs Python 3.4 or later.")
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.latency_threshold_in_sec = latency_threshold_in_sec
+        self.mode = mode
+        self.max_profiles = max_profiles
+        # Held while a call is profiled
+        self.profiling_lock = Lock()
+        # Functions of which the next call is profiled, since their last call was slow
+        self.armed_functions = set()
+        self.profile_numbers = itertools.count(1)
+        self.profiles_written = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def is_slow(self, latency_in_sec):
+        return self.latency_threshold_in_sec is not None and latency_in_sec > self.latency_threshold_in_sec
+
+    def intercept_call(self, function_name, parameters, proceed):
+        sampled = random.random() < self.sample_rate
+        if (sampled or function_name in self.armed_functions) and self.profiles_written < self.max_profiles and self.profiling_lock.acquire(False):
+            try:
+                self.armed_functions.discard(function_name)
+                return self.profile_call(function_name, parameters, proceed, sampled)
+            finally:
+                self.profiling_lock.release()
+        start_time = time.time()
+        try:
+            return proceed(function_name, parameters)
+        finally:
+            if self.is_slow(time.time() - start_time):
+                self.armed_functions.add(function_name)
+
+    def profile_call(self, function_name, parameters, proceed, sampled):
+        started_tracing = False
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            started_tracing = True
+        start_time = time.time()
+        result = None
+        try:
+            result = proceed(function_name, parameters)
+            return result
+        finally:
+            latency_in_sec = time.time() - start_time
+            if self.mode == "cprofile":
+                profile.disable()
+            if not isinstance(result, Future) and (sampled or self.is_slow(latency_in_sec)):
+                self.write_profile(profile if self.mode == "cprofile" else tracemalloc.take_snapshot(), function_name, latency_in_sec)
+            if started_tracing:
+                tracemalloc.stop()
+
+    # Writes a cProfile.Profile or a tracemalloc.Snapshot
+    def write_profile(self, profile, function_name, latency_in_sec):
+        file_name = "{0}-{1}-{2}-{3}ms{4}".format(time.strftime("%Y%m%d-%H%M%S"), next(self.profile_numbers), re.sub(r"[^\w.-]", "_", str(function_name)),
+                                                 int(latency_in_sec * 1000), ".prof" if self.mode == "cprofile" else ".tracemalloc")
+        path = os.path.join(self.directory, file_name)
+        try:
+            if self.mode == "cprofile":
+                profile.dump_stats(path)
+            else:
+                profile.dump(path)
+        except Exception as e:
+            logger.error("Cannot write profile of function %s to %s. Exception: %s", function_name, path, e)
+            return
+        self.profiles_written += 1
+        logger.debug("Profile of function %s written to %s", function_name, path)
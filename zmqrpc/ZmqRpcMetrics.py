@@ -0,0 +1,267 @@
+'''
+Created on Oct 18, 2026
+
+@copyright: MIT license, see http://opensource.org/licenses/MIT
+'''
+from bisect import bisect_left
+from threading import Lock, Thread
+import logging
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger("zmqrpc")
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# A call goes through these stages: decoding (and checking) the call, executing the function and encoding the response
+STAGES = ("decode", "execute", "encode")
+# Label of calls that fail before the function is known and of calls to functions the server does not host. Names
+# sent by clients are not used as labels, so they cannot blow up the number of series.
+UNKNOWN_FUNCTION = "__unknown__"
+# Label of the decoding and encoding of batches. The calls in a batch are counted under their own function name.
+BATCH_FUNCTION = "__batch__"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Events recorded by the ZmqClientMetrics of a sender, per endpoint:
+# request: a message was sent over a REQ or DEALER socket
+# response: a response came in, the round trip time is measured from sending the request
+# timeout: no response came in within the time out of the request
+# failure: a message could not be sent or a response could not be received
+# publish: a message was published over the PUB socket
+# recreate: a socket was recreated after a time out or failure
+CLIENT_EVENTS = ("request", "response", "timeout", "failure", "publish", "recreate")
+# Percentiles of the round trip time in the snapshot of client metrics
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+# Counts observations in cumulative buckets, the same as a Prometheus histogram
+class LatencyHistogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    # Returns a list of (upper bound, cumulative count) tuples, ending with the total count for an upper bound of None
+    def cumulative_counts(self):
+        cumulative_counts = []
+        total = 0
+        for upper_bound, count in zip(list(self.buckets) + [None], self.counts):
+            total += count
+            cumulative_counts.append((upper_bound, total))
+        return cumulative_counts
+
+    # Estimates the value below which the fraction q of the observations fall by interpolating within the bucket it falls
+    # in. Observations beyond the last bucket are estimated at its upper bound. Returns None without observations.
+    def percentile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        lower_bound = 0.0
+        total = 0
+        for upper_bound, count in zip(self.buckets, self.counts):
+            if count and total + count >= rank:
+                return lower_bound + (upper_bound - lower_bound) * (rank - total) / count
+            total += count
+            lower_bound = upper_bound
+        return float(self.buckets[-1])
+
+    def snapshot(self):
+        return {"count": self.count, "sum": self.sum, "buckets": [[upper_bound, count] for upper_bound, count in self.cumulative_counts()]}
+
+
+# The metrics of one function: calls per status code and latency histograms per stage
+class FunctionMetrics(object):
+    def __init__(self):
+        self.status_codes = {}
+        self.latencies = dict((stage, LatencyHistogram()) for stage in STAGES)
+
+    def snapshot(self):
+        return {"calls": sum(self.status_codes.values()),
+                "status_codes": dict((str(status_code), count) for status_code, count in self.status_codes.items()),
+                "latency": dict((stage, histogram.snapshot()) for stage, histogram in self.latencies.items())}
+
+
+# Measures the stages of a single call. Create it with ZmqRpcMetrics.start_call.
+class CallMetrics(object):
+    def __init__(self, metrics, function_name):
+        self.metrics = metrics
+        self.function_name = function_name
+        self.durations = {}
+        self.stage_start_time = time.time()
+
+    # Ends the stage that started when the previous stage ended
+    def stage_done(self, stage):
+        now = time.time()
+        self.durations[stage] = now - self.stage_start_time
+        self.stage_start_time = now
+
+    def finish(self, status_code):
+        self.metrics.record_call(self.function_name, status_code, self.durations)
+
+
+# ZmqRpcMetrics keeps per function call counts by status code and latency histograms of the decode, execute and
+# encode stages of calls, and the number of calls in progress. The ZmqRpcServer keeps one in server.metrics.
+# snapshot() returns all of it as a dict, prometheus_text() in the Prometheus text format. The metrics are thread safe.
+class ZmqRpcMetrics(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.functions = {}
+        self.in_progress = 0
+
+    def start_call(self, function_name=UNKNOWN_FUNCTION):
+        with self.lock:
+            self.in_progress += 1
+        return CallMetrics(self, function_name)
+
+    def record_call(self, function_name, status_code, durations):
+        with self.lock:
+            self.in_progress -= 1
+            function_metrics = self.functions.get(function_name)
+            if function_metrics is None:
+                function_metrics = self.functions[function_name] = FunctionMetrics()
+            function_metrics.status_codes[status_code] = function_metrics.status_codes.get(status_code, 0) + 1
+            for stage, duration in durations.items():
+                function_metrics.latencies[stage].observe(duration)
+
+    # Returns the metrics as a dict that can be encoded with every codec. gauges may add values measured elsewhere.
+    def snapshot(self, gauges=None):
+        with self.lock:
+            snapshot = {"functions": dict((function_name, function_metrics.snapshot()) for function_name, function_metrics in self.functions.items()),
+                        "in_progress": self.in_progress}
+        snapshot.update(gauges or {})
+        return snapshot
+
+    # Returns the metrics in the Prometheus text exposition format. gauges adds a gauge for each name and value.
+    def prometheus_text(self, gauges=None):
+        with self.lock:
+            functions = sorted((function_name, dict(function_metrics.status_codes), [(stage, function_metrics.latencies[stage]) for stage in STAGES]) for function_name, function_metrics in self.functions.items())
+            lines = ["# HELP zmqrpc_calls_total Calls handled by the server per function and status code.", "# TYPE zmqrpc_calls_total counter"]
+            for function_name, status_codes, _ in functions:
+                for status_code, count in sorted(status_codes.items()):
+                    lines.append('zmqrpc_calls_total{{function="{0}",status_code="{1}"}} {2}'.format(escape_label(function_name), status_code, count))
+            lines += ["# HELP zmqrpc_call_stage_seconds Time spent decoding calls, executing functions and encoding responses.", "# TYPE zmqrpc_call_stage_seconds histogram"]
+            for function_name, _, latencies in functions:
+                for stage, histogram in latencies:
+                    labels = 'function="{0}",stage="{1}"'.format(escape_label(function_name), stage)
+                    for upper_bound, count in histogram.cumulative_counts():
+                        lines.append('zmqrpc_call_stage_seconds_bucket{{{0},le="{1}"}} {2}'.format(labels, "+Inf" if upper_bound is None else repr(float(upper_bound)), count))
+                    lines.append('zmqrpc_call_stage_seconds_sum{{{0}}} {1}'.format(labels, repr(histogram.sum)))
+                    lines.append('zmqrpc_call_stage_seconds_count{{{0}}} {1}'.format(labels, histogram.count))
+            gauges = dict(gauges or {}, in_progress=self.in_progress)
+        for name, value in sorted(gauges.items()):
+            lines += ["# TYPE zmqrpc_{0} gauge".format(name), "zmqrpc_{0} {1}".format(name, value)]
+        return "\n".join(lines) + "\n"
+
+
+# The counters of the events on one endpoint, the bytes sent and received and a histogram of round trip times
+class EndpointMetrics(object):
+    def __init__(self):
+        self.events = dict((event, 0) for event in CLIENT_EVENTS)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.round_trip = LatencyHistogram()
+
+    def record(self, event, latency_in_sec, size_in_bytes):
+        self.events[event] += 1
+        if event == "response":
+            self.round_trip.observe(latency_in_sec)
+            self.response_bytes += size_in_bytes
+        elif size_in_bytes is not None:
+            self.request_bytes += size_in_bytes
+
+    def snapshot(self):
+        round_trip = self.round_trip.snapshot()
+        for q in PERCENTILES:
+            round_trip["p{0:g}".format(q * 100)] = self.round_trip.percentile(q)
+        return dict(self.events, request_bytes=self.request_bytes, response_bytes=self.response_bytes, round_trip=round_trip)
+
+
+# ZmqClientMetrics counts the events of CLIENT_EVENTS of a sender per endpoint and in total, with the bytes of requests
+# and responses and a histogram of round trip times. The ZmqSender (and so the ZmqRpcClient) keeps one in sender.metrics.
+# snapshot() returns all of it as a dict, with the 50th, 90th and 99th percentile of the round trip times.
+# Observers added with add_observer are called with a dict for every event: the event, the endpoint, the latency_in_sec
+# (the round trip time of a response, the time waited for a timeout) and the size_in_bytes of a request or response.
+# Observers are called on the thread that sends or receives, so they should return quickly. The metrics are thread safe.
+class ZmqClientMetrics(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.endpoints = {}
+        self.total = EndpointMetrics()
+        self.observers = []
+
+    def add_observer(self, observer):
+        with self.lock:
+            self.observers = self.observers + [observer]
+
+    def remove_observer(self, observer):
+        with self.lock:
+            self.observers = [registered for registered in self.observers if registered is not observer]
+
+    def record(self, event, endpoint, latency_in_sec=None, size_in_bytes=None):
+        with self.lock:
+            endpoint_metrics = self.endpoints.get(endpoint)
+            if endpoint_metrics is None:
+                endpoint_metrics = self.endpoints[endpoint] = EndpointMetrics()
+            endpoint_metrics.record(event, latency_in_sec, size_in_bytes)
+            self.total.record(event, latency_in_sec, size_in_bytes)
+            observers = self.observers
+        for observer in observers:
+            try:
+                observer({"event": event, "endpoint": endpoint, "latency_in_sec": latency_in_sec, "size_in_bytes": size_in_bytes})
+            except Exception as e:
+                logger.error("Client metrics observer failed. Exception: %s", e)
+
+    def snapshot(self):
+        with self.lock:
+            return {"endpoints": dict((endpoint, endpoint_metrics.snapshot()) for endpoint, endpoint_metrics in self.endpoints.items()),
+                    "total": self.total.snapshot()}
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+# Serves the Prometheus text returned by get_text on every path of a local HTTP address, a (host, port) tuple.
+# start() serves on a daemon thread, stop() stops serving and closes the socket.
+class MetricsHttpServer(object):
+    def __init__(self, address, get_text):
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    body = get_text().encode("utf-8")
+                except Exception as e:
+                    logger.error(e)
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics request from %s: %s", self.address_string(), format % args)
+
+        self.http_server = HTTPServer(address, MetricsRequestHandler)
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.http_server.serve_forever, name="zmqrpc-metrics")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.http_server.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.http_server.server_close()
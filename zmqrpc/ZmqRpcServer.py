@@ -5,14 +5,195 @@ Created on Apr 8, 2014
 
 @copyright: MIT license, see http://opensource.org/licenses/MIT
 '''
-import json
-from threading import Thread
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock, Thread
 import logging
 
+from .ZmqCodec import CODEC_TAG_MARKER, DEFAULT_ACCEPTED_CODECS, compress_message, compressors, decode_message, decompress_message, get_advertised_compressors, get_message_codec_name, get_message_compression
 from .ZmqReceiver import ZmqReceiver
+from .ZmqRpcCache import ZmqRpcCache
+from .ZmqRpcInterceptor import run_interceptors
+from .ZmqRpcMetrics import BATCH_FUNCTION, UNKNOWN_FUNCTION, MetricsHttpServer, ZmqRpcMetrics
 
 logger = logging.getLogger("zmqrpc")
 
+# Reserved function that returns the metrics of the server. Called with {"format": "prometheus"} it returns
+# them as text in the Prometheus text format.
+STATS_FUNCTION = "__stats__"
+
+
+# Wraps a function in rpc_functions to add registration time options to it:
+# run_in_process_pool: invoke the function in the process pool of the server. Use this for CPU bound
+# functions. The function and its parameters and result must be picklable.
+# cacheable: the function is deterministic and without side effects, so the server may answer repeated calls
+# with the same parameters from its result cache. cache_ttl_in_sec limits how long a result is reused,
+# None reuses it until it is evicted.
+class RpcFunction(object):
+    def __init__(self, function, run_in_process_pool=False, cacheable=False, cache_ttl_in_sec=None):
+        self.function = function
+        self.run_in_process_pool = run_in_process_pool
+        self.cacheable = cacheable
+        self.cache_ttl_in_sec = cache_ttl_in_sec
+
+
+# Decodes an incoming message. Returns a tuple of status_code, status_message, the decoded message and the codec
+# the message was encoded with, which should be used for the response as well.
+def decode_function_call(message, accepted_codecs=DEFAULT_ACCEPTED_CODECS):
+    try:
+        message = decompress_message(message)
+    except Exception as e:
+        status_message = "Incorrectly marshalled function. Incoming message cannot be decompressed. Exception: {0}".format(e)
+        logger.warning(status_message)
+        return 400, status_message, None, None
+    try:
+        codec_name = get_message_codec_name(message)
+    except Exception:
+        codec_name = None
+    if codec_name is not None and codec_name not in accepted_codecs:
+        status_message = "Incorrectly marshalled function. Codec '{0}' is not accepted by server.".format(codec_name)
+        logger.warning(status_message)
+        return 400, status_message, None, None
+    try:
+        incoming_message, codec = decode_message(message)
+    except Exception as e:
+        if codec_name == "json":
+            status_message = "Incorrectly marshalled function. Incoming message is no proper json formatted string. Exception: {0}".format(e)
+        else:
+            status_message = "Incorrectly marshalled function. Incoming message cannot be decoded. Exception: {0}".format(e)
+        logger.warning(status_message)
+        return 400, status_message, None, None
+    return 200, "OK", incoming_message, codec
+
+
+# Checks a single decoded function call. Returns a tuple of status_code, status_message, function_name and parameters.
+# A status_code other than 200 means the function cannot be invoked.
+def parse_call(incoming_message, rpc_functions):
+    if not isinstance(incoming_message, dict) or "function" not in incoming_message:
+        status_message = "Incorrectly marshalled function. No function name provided."
+        logger.warning(status_message)
+        return 450, status_message, None, None
+    function_name = incoming_message["function"]
+    parameters = None
+    if "parameters" in incoming_message:
+        parameters = incoming_message["parameters"]
+    if function_name not in rpc_functions:
+        status_message = "Function '{0}' is not implemented on server. Check rpc_functions on server if it contains the function name".format(function_name)
+        logger.warning(status_message)
+        return 451, status_message, function_name, parameters
+    return 200, "OK", function_name, parameters
+
+
+def is_batch(incoming_message):
+    return isinstance(incoming_message, dict) and isinstance(incoming_message.get("batch"), list)
+
+
+def is_stats_call(incoming_message):
+    return isinstance(incoming_message, dict) and incoming_message.get("function") == STATS_FUNCTION
+
+
+# Unmarshalls a function call. Returns a tuple of status_code, status_message, function_name, parameters
+# and the codec the call was encoded with, which should be used for the response as well.
+# A status_code other than 200 means the function cannot be invoked.
+def parse_function_call(message, rpc_functions, accepted_codecs=DEFAULT_ACCEPTED_CODECS):
+    status_code, status_message, incoming_message, codec = decode_function_call(message, accepted_codecs)
+    if status_code != 200:
+        return status_code, status_message, None, None, codec
+    status_code, status_message, function_name, parameters = parse_call(incoming_message, rpc_functions)
+    return status_code, status_message, function_name, parameters, codec
+
+
+# Returns the dict describing the outcome of a single call in a batch response
+def create_call_result(status_code, status_message, response_message):
+    if response_message is not None:
+        return {"status_code": status_code, "status_message": status_message, "response_message": response_message}
+    return {"status_code": status_code, "status_message": status_message}
+
+
+# Returns the compression to use for the response to a message: the compression of the message itself, so peers
+# that do not compress never get a compressed response
+def get_response_compression(message):
+    try:
+        compression = get_message_compression(message)
+    except Exception:
+        return None
+    if compression not in compressors or not compressors[compression].is_available():
+        return None
+    return compression
+
+
+# Compresses a response or the response a Future resolves with
+def compress_response(response, compression):
+    if compression is None or response is None:
+        return response
+    if isinstance(response, Future):
+        return map_future(response, lambda response: compress_message(response, compression))
+    return compress_message(response, compression)
+
+
+# Returns a Future resolved with function(result) of the given Future
+def map_future(future, function):
+    mapped_future = Future()
+
+    def on_done(done_future):
+        try:
+            mapped_future.set_result(function(done_future.result()))
+        except Exception as e:
+            mapped_future.set_exception(e)
+
+    future.add_done_callback(on_done)
+    return mapped_future
+
+
+# Returns a Future resolved with the list of results once all Futures in values are resolved.
+# Values that are not a Future are taken as they are. When one of the Futures fails, the returned Future fails with it.
+def gather_futures(values):
+    gathered_future = Future()
+    results = list(values)
+    pending = [index for index, value in enumerate(results) if isinstance(value, Future)]
+    remaining = [len(pending)]
+    lock = Lock()
+
+    def on_done(index, future):
+        try:
+            results[index] = future.result()
+        except Exception as e:
+            with lock:
+                failed = remaining[0] > 0
+                remaining[0] = 0
+            if failed:
+                gathered_future.set_exception(e)
+            return
+        with lock:
+            remaining[0] -= 1
+            done = remaining[0] == 0
+        if done:
+            gathered_future.set_result(results)
+
+    if not pending:
+        gathered_future.set_result(results)
+    for index in pending:
+        results[index].add_done_callback(lambda future, index=index: on_done(index, future))
+    return gathered_future
+
+
+# Returns a dict mapping the names of the cacheable functions to the time to live of their results
+def get_cached_functions(rpc_functions):
+    cached_functions = {}
+    for function_name, rpc_function in (rpc_functions or {}).items():
+        if isinstance(rpc_function, RpcFunction) and rpc_function.cacheable:
+            cached_functions[function_name] = rpc_function.cache_ttl_in_sec
+    return cached_functions
+
+
+# Invokes a function with the given parameter dict. Module level so it can be sent to a process pool.
+def call_rpc_function(function, parameters):
+    if isinstance(function, RpcFunction):
+        function = function.function
+    if parameters is None:
+        return function()
+    return function(**parameters)
+
+
 # The ZmqRpcServer implements a ZmqReceiver and extends it with the ability to host one or more methods
 # that can be invoked by a ZmqRpcClient. In case a PUB/SUB connection is used, no reponse is provided.
 # In case a REQ/REQ connection is used a response must be provided in order for the system
@@ -20,58 +201,213 @@ logger = logging.getLogger("zmqrpc")
 # The ZmqRpcServer constructor takes a collection of either REP or SUB addresses for the ZMQ layer.
 # The rpc_functions are dict structures mapping a string value to a real method implementation.
 # A username/password may be used for REQ/REP pairs (does not seem to be working for PUB/SUB sockets
+# When a ROUTER address is given, functions are invoked on a pool of worker_threads threads so that
+# slow functions run concurrently. The rpc_functions must be thread safe in that case.
+# When process_pool_workers is given, functions wrapped in RpcFunction(..., run_in_process_pool=True) are invoked
+# in a pool of that many processes, or all functions if run_in_process_pool is set for the whole server.
+# The receiver keeps polling while the processes compute.
+# The codecs lists the names of the codecs the server accepts calls in (json and msgpack by default).
+# Responses are encoded with the codec of the call, and compressed when the call was compressed.
+# Responses of functions wrapped in RpcFunction(..., cacheable=True) are kept serialized in a result cache of at most
+# cache_max_entries responses and sent again for repeated calls with the same parameters, see result_cache.stats().
+# SUB sockets subscribe to the topics in zmq_sub_topics, by default the names of the rpc_functions, so calls that
+# clients publish with use_topics=True for functions of other servers are filtered out by the publisher.
+# Calls published without a topic are still received.
+# With flow_control the SUB sockets return credit to clients with a flow_control_window, see ZmqSender.
+# Every call is counted per function and status code in server.metrics, with histograms of the time spent decoding
+# the call, executing the function and encoding the response. Clients get them by invoking the reserved '__stats__'
+# function. When a metrics_http_address (host, port) is given, they are served in the Prometheus text format over HTTP as well.
+# The interceptors, a list of ZmqRpcInterceptor, wrap the handling of every incoming message and the invocation of every
+# function, the first interceptor outermost. They must be thread safe when a ROUTER address is used.
 class ZmqRpcServer(ZmqReceiver):
-    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, rpc_functions=None, recreate_sockets_on_timeout_of_sec=600, username=None, password=None):
-        ZmqReceiver.__init__(self, zmq_rep_bind_address, zmq_sub_connect_addresses, recreate_sockets_on_timeout_of_sec, username, password)
+    # Calls without a topic start with a json object or a codec tag
+    legacy_sub_prefixes = (b'{', CODEC_TAG_MARKER)
+
+    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, rpc_functions=None, recreate_sockets_on_timeout_of_sec=600, username=None, password=None, zmq_router_bind_address=None, worker_threads=4, process_pool_workers=None, run_in_process_pool=False, codecs=None, cache_max_entries=1024, zmq_sub_topics=None, flow_control=False, metrics_http_address=None, interceptors=None):
+        if zmq_sub_topics is None:
+            zmq_sub_topics = list(rpc_functions or {})
+        ZmqReceiver.__init__(self, zmq_rep_bind_address, zmq_sub_connect_addresses, recreate_sockets_on_timeout_of_sec, username, password, zmq_router_bind_address, worker_threads, zmq_sub_topics, flow_control=flow_control)
         self.rpc_functions = rpc_functions
+        self.interceptors = list(interceptors or [])
+        self.result_cache = ZmqRpcCache(get_cached_functions(rpc_functions), cache_max_entries)
+        self.metrics = ZmqRpcMetrics()
+        self.metrics_http_server = None
+        if metrics_http_address is not None:
+            self.metrics_http_server = MetricsHttpServer(metrics_http_address, self.prometheus_text)
+        self.accepted_codecs = codecs if codecs is not None else DEFAULT_ACCEPTED_CODECS
+        self.run_in_process_pool = run_in_process_pool
+        self.process_pool = None
+        if process_pool_workers:
+            self.process_pool = ProcessPoolExecutor(max_workers=process_pool_workers)
+            self.executors.append(self.process_pool)
 
-    def handle_incoming_message(self, message):
-        if message == "zmq_sub_heartbeat":
-            return None
+    def runs_in_process_pool(self, rpc_function):
+        if self.process_pool is None:
+            return False
+        return self.run_in_process_pool or (isinstance(rpc_function, RpcFunction) and rpc_function.run_in_process_pool)
 
-        status_code = 200
-        status_message = "OK"
-        response_message = None
+    # Returns a Future of the (status_code, status_message, response_message) tuple, which is resolved when the process pool is done
+    def invoke_in_process_pool(self, function_name, rpc_function, parameters):
+        result_future = Future()
+
+        def on_done(future):
+            try:
+                result_future.set_result((200, "OK", future.result()))
+            except Exception as e:
+                status_message = "Exception raised when calling function {0}. Exception: {1} ".format(function_name, e)
+                logger.warning(status_message)
+                result_future.set_result((463, status_message, None))
+
+        if isinstance(rpc_function, RpcFunction):
+            rpc_function = rpc_function.function
+        self.process_pool.submit(call_rpc_function, rpc_function, parameters).add_done_callback(on_done)
+        return result_future
+
+    def run(self):
+        if self.metrics_http_server is not None:
+            self.metrics_http_server.start()
         try:
-            incoming_message = json.loads(message)
+            ZmqReceiver.run(self)
+        finally:
+            if self.metrics_http_server is not None:
+                self.metrics_http_server.stop()
+
+    # Values measured by the receiver that are added to the metrics
+    def gauges(self):
+        return {"queued": self.queued_messages, "cache_entries": self.result_cache.stats()["entries"]}
+
+    # Returns the metrics of the server as a dict, see ZmqRpcMetrics
+    def stats(self):
+        return self.metrics.snapshot(self.gauges())
+
+    def prometheus_text(self):
+        return self.metrics.prometheus_text(self.gauges())
+
+    # Returns a tuple of status_code, status_message and response_message, or a Future of it
+    def invoke_function(self, function_name, parameters):
+        rpc_function = self.rpc_functions[function_name]
+        if self.runs_in_process_pool(rpc_function):
+            return self.invoke_in_process_pool(function_name, rpc_function, parameters)
+        try:
+            return 200, "OK", call_rpc_function(rpc_function, parameters)
         except Exception as e:
-            status_code = 400
-            status_message = "Incorrectly marshalled function. Incoming message is no proper json formatted string. Exception: {0}".format(e)
+            status_message = "Exception raised when calling function {0}. Exception: {1} ".format(function_name, e)
             logger.warning(status_message)
-        else:
-            if "function" not in incoming_message:
-                status_code = 450
-                status_message = "Incorrectly marshalled function. No function name provided."
-                logger.warning(status_message)
+            logger.exception(e)
+            return 463, status_message, None
+
+    # Invokes a function and records the time it took in the metrics of the call, which is finished when there is
+    # no response to encode
+    def execute_call(self, call_metrics, function_name, parameters, finish=False):
+        def executed(result):
+            call_metrics.stage_done("execute")
+            if finish:
+                call_metrics.finish(result[0])
+            return result
+
+        result = run_interceptors(self.interceptors, "intercept_call", self.invoke_function, function_name, parameters)
+        if isinstance(result, Future):
+            return map_future(result, executed)
+        return executed(result)
+
+    # Encodes the response to a call, listing the compressors when given, and records the call in the metrics
+    def create_call_response(self, call_metrics, status_code, status_message, response_message, codec, compressors=None):
+        try:
+            return self.create_response_message(status_code, status_message, response_message, codec, compressors)
+        finally:
+            call_metrics.stage_done("encode")
+            call_metrics.finish(status_code)
+
+    # Invokes all calls of a batch in order. The response holds the outcome of every call, in the same order.
+    # Every call is recorded in the metrics on its own; decoding and encoding the batch is recorded as a call of its own.
+    def handle_batch(self, calls, codec, batch_metrics, compressors=None):
+        results = []
+        for call in calls:
+            status_code, status_message, function_name, parameters = parse_call(call, self.rpc_functions)
+            if status_code == 200:
+                results.append(self.execute_call(self.metrics.start_call(function_name), function_name, parameters, finish=True))
             else:
-                function_name = incoming_message["function"]
-                parameters = None
-                if "parameters" in incoming_message:
-                    parameters = incoming_message["parameters"]
-                if function_name not in self.rpc_functions:
-                    status_code = 451
-                    status_message = "Function '{0}' is not implemented on server. Check rpc_functions on server if it contains the function name".format(function_name)
-                    logger.warning(status_message)
-                else:
-                    try:
-                        if parameters is None:
-                            response_message = self.rpc_functions[function_name]()
-                        else:
-                            response_message = self.rpc_functions[function_name](**parameters)
-                    except Exception as e:
-                        status_code = 463
-                        status_message = "Exception raised when calling function {0}. Exception: {1} ".format(function_name, e)
-                        logger.warning(status_message)
-                        logger.exception(e)
-
-        return self.create_response_message(status_code, status_message, response_message)
+                self.metrics.start_call().finish(status_code)
+                results.append((status_code, status_message, None))
+
+        def create_batch_response(results):
+            batch_metrics.stage_done("execute")
+            return self.create_call_response(batch_metrics, 200, "OK", [create_call_result(*result) for result in results], codec, compressors)
+
+        if any(isinstance(result, Future) for result in results):
+            return map_future(gather_futures(results), create_batch_response)
+        return create_batch_response(results)
+
+    def handle_incoming_message(self, message):
+        if message == "zmq_sub_heartbeat":
+            return None
+        return run_interceptors(self.interceptors, "intercept_message", self.handle_message, message)
+
+    def handle_message(self, message):
+        return compress_response(self.handle_call(message), get_response_compression(message))
+
+    # Uncompressed calls worth compressing are answered with the compressors the server supports, so the client
+    # knows it may compress its next calls
+    def handle_call(self, message):
+        call_metrics = self.metrics.start_call()
+        compressors = get_advertised_compressors(message)
+        status_code, status_message, incoming_message, codec = decode_function_call(message, self.accepted_codecs)
+        if status_code == 200 and is_batch(incoming_message):
+            call_metrics.function_name = BATCH_FUNCTION
+            call_metrics.stage_done("decode")
+            return self.handle_batch(incoming_message["batch"], codec, call_metrics, compressors)
+        if status_code == 200 and is_stats_call(incoming_message):
+            call_metrics.function_name = STATS_FUNCTION
+            call_metrics.stage_done("decode")
+            parameters = incoming_message.get("parameters") or {}
+            response_message = self.prometheus_text() if parameters.get("format") == "prometheus" else self.stats()
+            call_metrics.stage_done("execute")
+            return self.create_call_response(call_metrics, 200, "OK", response_message, codec, compressors)
+        if status_code == 200:
+            status_code, status_message, function_name, parameters = parse_call(incoming_message, self.rpc_functions)
+        if status_code == 200:
+            call_metrics.function_name = function_name
+        call_metrics.stage_done("decode")
+        if status_code != 200:
+            return self.create_call_response(call_metrics, status_code, status_message, None, codec, compressors)
+
+        if self.result_cache.is_cached_function(function_name):
+            return self.invoke_cached_function(function_name, parameters, codec, call_metrics, compressors)
+
+        result = self.execute_call(call_metrics, function_name, parameters)
+        if isinstance(result, Future):
+            return map_future(result, lambda result: self.create_call_response(call_metrics, result[0], result[1], result[2], codec, compressors))
+        return self.create_call_response(call_metrics, result[0], result[1], result[2], codec, compressors)
+
+    # Removes cached responses of a function, or of all functions when no function_name is given
+    def invalidate_cache(self, function_name=None):
+        self.result_cache.invalidate(function_name)
+
+    # Returns the cached response of a call, or invokes the function and caches its response when successful
+    def invoke_cached_function(self, function_name, parameters, codec, call_metrics, compressors=None):
+        found, response = self.result_cache.get(function_name, parameters, codec.name)
+        if found:
+            call_metrics.stage_done("execute")
+            call_metrics.finish(200)
+            return response
+
+        def create_cached_response(result):
+            response = self.create_call_response(call_metrics, result[0], result[1], result[2], codec, compressors)
+            if result[0] == 200:
+                self.result_cache.put(function_name, parameters, response, codec.name)
+            return response
+
+        result = self.execute_call(call_metrics, function_name, parameters)
+        if isinstance(result, Future):
+            return map_future(result, create_cached_response)
+        return create_cached_response(result)
 
 
 # The same as a ZmqRpcServer implementation but implemented in a Thread environment.
 class ZmqRpcServerThread(Thread):
-    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, rpc_functions=None, recreate_sockets_on_timeout_of_sec=60, username=None, password=None):
+    def __init__(self, zmq_rep_bind_address=None, zmq_sub_connect_addresses=None, rpc_functions=None, recreate_sockets_on_timeout_of_sec=60, username=None, password=None, zmq_router_bind_address=None, worker_threads=4, process_pool_workers=None, run_in_process_pool=False, codecs=None, cache_max_entries=1024, zmq_sub_topics=None, flow_control=False, metrics_http_address=None, interceptors=None):
         Thread.__init__(self)
-        self.server = ZmqRpcServer(zmq_rep_bind_address, zmq_sub_connect_addresses, rpc_functions, recreate_sockets_on_timeout_of_sec, username, password)
+        self.server = ZmqRpcServer(zmq_rep_bind_address, zmq_sub_connect_addresses, rpc_functions, recreate_sockets_on_timeout_of_sec, username, password, zmq_router_bind_address, worker_threads, process_pool_workers, run_in_process_pool, codecs, cache_max_entries, zmq_sub_topics, flow_control, metrics_http_address, interceptors)
 
     def last_received_message(self):
         return self.server.last_received_message
@@ -5,14 +5,298 @@ Created on Apr 8, 2014
 
 @copyright: MIT license, see http://opensource.org/licenses/MIT
 '''
-import json
+import itertools
 import logging
+import struct
 import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from threading import Condition, Lock, RLock
 
 import zmq
+from zmq.utils.monitor import recv_monitor_message
+
+from .ZmqCodec import CREDIT_ACK_MARKER, CREDIT_MARKER, DEFAULT_COMPRESSION_THRESHOLD, HEARTBEAT_SUBSCRIPTION, SEQUENCE, compress_message, decode_credit_subscription, decode_message, decompress_message, encode_topic, frames_size, frames_to_message, get_advertised_compressors, get_compressor, get_message_compression, parse_advertised_compressors, recv_frames, send_message
+from .ZmqContext import get_context
+from .ZmqRpcMetrics import ZmqClientMetrics
 
 logger = logging.getLogger("zmqrpc")
 
+# Event after which a connecting socket can exchange messages with a peer. The handshake event needs libzmq 4.3.
+READY_EVENT = getattr(zmq, "EVENT_HANDSHAKE_SUCCEEDED", zmq.EVENT_CONNECTED)
+
+FLOW_CONTROL_POLICIES = ("block", "fail", "shed")
+# Numbers the inproc sockets that wake the thread that receives on a DEALER socket
+DEALER_WAKEUP_IDS = itertools.count(1)
+# The weighted round robin over REQ endpoints counts latencies of at most this many times the fastest endpoint, so every
+# endpoint keeps a share of the requests. The latency of an endpoint that is not picked moves this fraction toward the
+# average of all endpoints on every request when it is slower than that, so an endpoint that was slow once recovers its share.
+MAX_LATENCY_SPREAD = 10
+LATENCY_DECAY = 0.2
+
+
+# Returns the response_message of a decoded response or raises an Exception with the status_message
+# in case the status_code is not 200.
+def parse_response_dict(response_message_dict):
+    if not isinstance(response_message_dict, dict) or "status_code" not in response_message_dict:
+        raise Exception("No status_code in response")
+    if response_message_dict["status_code"] == 200:
+        return response_message_dict.get("response_message")
+    if "status_message" in response_message_dict:
+        raise Exception(response_message_dict["status_message"])
+    raise Exception("Error occured with code {0}".format(response_message_dict["status_code"]))
+
+
+# Returns the response_message of a response or raises an Exception with the status_message
+# in case the status_code is not 200. The response may be json text or tagged with any registered codec.
+def parse_response_message(response_message):
+    try:
+        response_message_dict, _ = decode_message(response_message)
+    except Exception as e:
+        raise Exception("Marshalling error: Response cannot be decoded. Exception: {0}".format(e))
+    return parse_response_dict(response_message_dict)
+
+
+# Picks one of the ReqEndpoints by a smooth weighted round robin: every endpoint is weighted by the inverse of its
+# recent latency, so a sequential client spreads its requests over all endpoints and sends faster endpoints more of them.
+# Endpoints without a latency yet get the weight of the fastest endpoint, and no endpoint gets less than
+# 1/MAX_LATENCY_SPREAD of that weight. On a tie the first endpoint is picked.
+def choose_weighted_round_robin(req_endpoints):
+    latencies = [req_endpoint.latency_in_sec for req_endpoint in req_endpoints if req_endpoint.latency_in_sec]
+    fastest_latency_in_sec = min(latencies) if latencies else 1
+    weights = [1.0 / min(req_endpoint.latency_in_sec or fastest_latency_in_sec, fastest_latency_in_sec * MAX_LATENCY_SPREAD) for req_endpoint in req_endpoints]
+    for req_endpoint, weight in zip(req_endpoints, weights):
+        req_endpoint.current_weight += weight
+    chosen = max(req_endpoints, key=lambda req_endpoint: req_endpoint.current_weight)
+    chosen.current_weight -= sum(weights)
+    # The latency of an endpoint is only measured when it is picked, so slower ones that are not picked move toward the average
+    if latencies:
+        average_latency_in_sec = sum(latencies) / len(latencies)
+        for req_endpoint in req_endpoints:
+            if req_endpoint is not chosen and req_endpoint.latency_in_sec and req_endpoint.latency_in_sec > average_latency_in_sec:
+                req_endpoint.latency_in_sec += LATENCY_DECAY * (average_latency_in_sec - req_endpoint.latency_in_sec)
+    return chosen
+
+
+# A ZmqResponseFuture is returned for every message sent over a DEALER socket. It is resolved
+# as soon as the matching response (by correlation id) comes in, in whatever order responses
+# arrive. Calling result() drives the DEALER socket of the sender until the response is there
+# or the time out of the request has passed.
+class ZmqResponseFuture(Future):
+    def __init__(self, sender, correlation_id, time_out_waiting_for_response_in_sec):
+        Future.__init__(self)
+        self.sender = sender
+        self.correlation_id = correlation_id
+        self.time_out_waiting_for_response_in_sec = time_out_waiting_for_response_in_sec
+        self.start_time = time.time()
+        self.deadline = self.start_time + time_out_waiting_for_response_in_sec
+        # Whether the response tells which compressors the peer supports
+        self.learns_compressors = False
+
+    def result(self, timeout=None):
+        self.sender.wait_for_response(self, timeout)
+        return Future.result(self, timeout=0)
+
+    def exception(self, timeout=None):
+        self.sender.wait_for_response(self, timeout)
+        return Future.exception(self, timeout=0)
+
+
+# Keeps track of the endpoints a REQ or DEALER socket has completed a connection with, using a socket monitor.
+# Must be created before the socket connects. Inproc endpoints are connected as soon as they are bound and not monitored.
+# It keeps the compressors the peer of the socket listed as well, see get_peer_compressors.
+class ConnectionMonitor(object):
+    def __init__(self, zmq_socket, endpoints):
+        self.zmq_socket = zmq_socket
+        self.endpoints = [endpoint for endpoint in endpoints if not endpoint.startswith("inproc://")]
+        self.connected_endpoints = set()
+        self.connections = 0
+        self.peer_compressors = None
+        self.peer_connections = None
+        self.monitor_socket = None
+        if self.endpoints:
+            self.monitor_socket = zmq_socket.get_monitor_socket(READY_EVENT | zmq.EVENT_DISCONNECTED)
+
+    # Handles the events that arrive within the given time out
+    def poll(self, time_out_in_sec=0):
+        if self.monitor_socket is None:
+            return
+        if not self.monitor_socket.poll(int(time_out_in_sec * 1000), zmq.POLLIN):
+            return
+        while True:
+            try:
+                event = recv_monitor_message(self.monitor_socket, zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            endpoint = event["endpoint"].decode('utf-8')
+            if event["event"] == READY_EVENT:
+                self.connected_endpoints.add(endpoint)
+                self.connections += 1
+            elif event["event"] == zmq.EVENT_DISCONNECTED:
+                self.connected_endpoints.discard(endpoint)
+
+    # Ready when min_peers endpoints are connected, or all of them if min_peers is None
+    def is_ready(self, min_peers=None):
+        if min_peers is None:
+            min_peers = len(self.endpoints)
+        return len(self.connected_endpoints) >= min(min_peers, len(self.endpoints))
+
+    # Returns the compressors the peer listed since the socket last connected, or None when it did not tell yet.
+    # A peer that reconnects may have been replaced by one of another version, so it has to list them again.
+    def get_peer_compressors(self):
+        if self.peer_compressors is not None:
+            self.poll()
+            if self.connections != self.peer_connections:
+                self.peer_compressors = None
+        return self.peer_compressors
+
+    def set_peer_compressors(self, compressors):
+        self.peer_compressors = compressors
+        self.peer_connections = self.connections
+
+    def close(self):
+        if self.monitor_socket is not None:
+            self.zmq_socket.disable_monitor()
+            self.monitor_socket.close()
+            self.monitor_socket = None
+
+
+# A REQ socket to a single endpoint, used by a ZmqSender with several REQ endpoints. It keeps the statistics
+# to pick the least loaded endpoint for every request: the number of requests in flight or waiting for the
+# socket, the (exponentially weighted) latency of recent responses and the number of consecutive failures.
+# current_weight is the state of the weighted round robin between endpoints that are equally loaded.
+class ReqEndpoint(object):
+    def __init__(self, context, endpoint, username=None, password=None, metrics=None):
+        self.context = context
+        self.endpoint = endpoint
+        self.username = username
+        self.password = password
+        self.metrics = metrics or ZmqClientMetrics()
+        # A REQ socket handles one request at a time. Waiting for it with a time out works on Python 2 as well.
+        self.condition = Condition()
+        self.busy = False
+        self.socket = None
+        self.monitor = None
+        self.recreate_socket = False
+        self.in_flight = 0
+        self.latency_in_sec = None
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = None
+        self.probing = False
+        self.current_weight = 0
+        self.create_socket()
+
+    def create_socket(self):
+        self.socket = self.context.socket(zmq.REQ)
+        if self.username and self.password:
+            self.socket.plain_username = self.username
+            self.socket.plain_password = self.password
+        self.monitor = ConnectionMonitor(self.socket, [self.endpoint])
+        try:
+            logger.debug("Connect REQ socket to %s", self.endpoint)
+            self.socket.connect(self.endpoint)
+        except Exception as e:
+            raise Exception("Cannot connect REQ socket to {0}. Exception: {1}".format(self.endpoint, e))
+
+    def destroy_socket(self):
+        if self.socket is None:
+            return
+        try:
+            self.monitor.close()
+            self.socket.setsockopt(zmq.LINGER, 0)
+            logger.debug("Close REQ socket to %s", self.endpoint)
+            self.socket.close()
+        except Exception as e:
+            logger.error("Cannot close REQ socket to %s. Exception: %s", self.endpoint, e)
+        self.socket = None
+        self.monitor = None
+
+    # Waits until no other request uses the socket and claims it. Returns False when that did not happen in time.
+    def acquire(self, time_out_in_sec):
+        wait_until = time.time() + time_out_in_sec
+        with self.condition:
+            while self.busy:
+                remaining = wait_until - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            self.busy = True
+            return True
+
+    def release(self):
+        with self.condition:
+            self.busy = False
+            self.condition.notify()
+
+    # Sends the message and returns the raw response. After a time out only the socket of this endpoint is recreated.
+    # prepare_message, see ZmqSender.prepare_message, turns the message into what is sent to the peer of the socket.
+    def send(self, message, time_out_waiting_for_response_in_sec, prepare_message=None):
+        if not self.acquire(time_out_waiting_for_response_in_sec):
+            raise TimeoutError("REQ socket to {0} busy for {1} seconds. Discarding message.".format(self.endpoint, time_out_waiting_for_response_in_sec))
+        try:
+            if self.recreate_socket or self.socket is None:
+                self.destroy_socket()
+                self.create_socket()
+                if self.recreate_socket:
+                    self.metrics.record("recreate", self.endpoint)
+                self.recreate_socket = False
+            learns_compressors = False
+            if prepare_message is not None:
+                message, learns_compressors = prepare_message(message, self.monitor)
+            start_time = time.time()
+            try:
+                size_in_bytes = send_message(self.socket, message)
+            except Exception as e:
+                self.recreate_socket = True
+                self.metrics.record("failure", self.endpoint)
+                raise Exception("Cannot send message on REQ socket to {0}. Message can be considered lost. Exception: {1}".format(self.endpoint, e))
+            self.metrics.record("request", self.endpoint, size_in_bytes=size_in_bytes)
+            if self.socket.poll(int(time_out_waiting_for_response_in_sec * 1000), zmq.POLLIN):
+                try:
+                    frames = recv_frames(self.socket)
+                except Exception as e:
+                    self.recreate_socket = True
+                    self.metrics.record("failure", self.endpoint)
+                    raise Exception("Could not receive message from REQ socket to {0}. Exception: {1}".format(self.endpoint, e))
+                self.metrics.record("response", self.endpoint, time.time() - start_time, frames_size(frames))
+                response_message = frames_to_message(frames)
+                if learns_compressors:
+                    self.monitor.set_peer_compressors(parse_advertised_compressors(response_message))
+                return response_message
+            self.recreate_socket = True
+            self.metrics.record("timeout", self.endpoint, time.time() - start_time)
+            raise Exception("No response received on ZMQ Request to end point {0} in {1} seconds. Discarding message.".format(self.endpoint, time_out_waiting_for_response_in_sec))
+        finally:
+            self.release()
+
+    def stats(self):
+        return {"endpoint": self.endpoint, "in_flight": self.in_flight, "latency_in_sec": self.latency_in_sec,
+                "failures": self.failures, "ejections": self.ejections, "ejected": self.ejected_until is not None}
+
+
+# A flow controlled subscriber of a PUB socket. The PUB socket only sends it the messages that match its subscriptions,
+# so only those are in flight until it acknowledges them.
+class CreditSubscriber(object):
+    def __init__(self, subscriptions):
+        self.subscriptions = subscriptions
+        # Sequences of the messages sent to the subscriber that it did not acknowledge yet, in order
+        self.unacknowledged = deque()
+
+    def receives(self, envelope):
+        return any(envelope.startswith(subscription) for subscription in self.subscriptions)
+
+    def sent(self, envelope, sequence):
+        if self.receives(envelope):
+            self.unacknowledged.append(sequence)
+
+    def acknowledge(self, sequence):
+        while self.unacknowledged and self.unacknowledged[0] <= sequence:
+            self.unacknowledged.popleft()
+
+    def in_flight(self):
+        return len(self.unacknowledged)
+
 
 # ZmqSender implements a ZeroMQ REQ or PUB socket to send messages out via a
 # send function. The send function is equipped with a timeout and automatic
@@ -20,30 +304,99 @@ logger = logging.getLogger("zmqrpc")
 # given timeout.
 # The username/password can be used to provide 'simple' protection on the wire
 # (only PLAIN has been implemented, so be aware of sniffers).
+# Instead of REQ endpoints, DEALER endpoints may be given. Each message sent over the DEALER socket
+# is tagged with a correlation id, so many requests can be in flight at the same time. Use send_async
+# to get a ZmqResponseFuture per request. The DEALER socket talks to plain REP sockets as well.
+# The PUB socket is an XPUB socket in verbose mode, so it learns about every subscriber that connects.
+# wait_ready blocks until the peers are actually connected, which avoids losing the first messages to the
+# 'slow joiner' problem. The constructor waits at most time_out_waiting_for_ready_in_sec for it; 0 does not wait.
+# With several REQ endpoints every endpoint gets its own REQ socket. Each request goes to an endpoint with the least
+# requests in flight. Between those the requests are spread by a weighted round robin, in which an endpoint gets a share
+# inversely proportional to its recent latency, and at least a tenth of the share of the fastest. An endpoint that fails (times out)
+# failures_before_ejection times in a row is ejected for ejection_time_in_sec. After that a single request probes it:
+# on success it is used again, otherwise it is ejected again. When all endpoints are ejected, send fails at once.
+# A failed request is not retried on another endpoint, since it may have been handled already.
+# With a flow_control_window the PUB socket is flow controlled: messages are numbered, and receivers with flow_control
+# return credit for the messages they handled over the same connection. When a flow controlled receiver has
+# flow_control_window messages in flight, send blocks until it has credit again (at most the time out of send),
+# fails at once or sheds the message, depending on the flow_control_policy. Receivers announce their subscriptions,
+# so only the messages a receiver subscribed to count against its window. See flow_control_stats().
+# Requests, responses, round trip times, time outs, failures and recreated sockets are counted per endpoint in the
+# ZmqClientMetrics in self.metrics, see client_stats(). Add an observer to it to be called on every event.
+# With a compression ("zlib", or "lz4" and "zstd" when their packages are installed) messages of at least
+# compression_threshold bytes are compressed, but only for a peer that listed the compressor in a response since it
+# connected. Until then, and for peers of older versions, messages are sent uncompressed. So are messages over the PUB
+# socket and over a DEALER socket with several endpoints, since they go to peers that cannot be told apart. A message
+# that is compressed already is decompressed for a peer that did not list its compression.
 class ZmqSender(object):
-    def __init__(self, zmq_req_endpoints=None, zmq_pub_endpoint=None, username=None, password=None):
-        self.context = zmq.Context()
+    def __init__(self, zmq_req_endpoints=None, zmq_pub_endpoint=None, username=None, password=None, zmq_dealer_endpoints=None, time_out_waiting_for_ready_in_sec=0.5, failures_before_ejection=3, ejection_time_in_sec=30, flow_control_window=None, flow_control_policy="block", compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
+        self.context = get_context()
         self.username = username
         self.password = password
         self.poller = zmq.Poller()
         self.zmq_req_endpoints = zmq_req_endpoints
         self.zmq_pub_endpoint = zmq_pub_endpoint
+        self.metrics = ZmqClientMetrics()
+        self.compression = get_compressor(compression).name if compression is not None else None
+        self.compression_threshold = compression_threshold
         self.pub_socket = None
         self.req_socket = None
+        self.req_monitor = None
+        self.req_endpoints = []
+        self.failures_before_ejection = failures_before_ejection
+        self.ejection_time_in_sec = ejection_time_in_sec
+        # Guards the statistics of the REQ endpoints
+        self.balancing_lock = Lock()
+        self.subscribers = 0
+        if flow_control_policy not in FLOW_CONTROL_POLICIES:
+            raise Exception("Unknown flow control policy {0}. Use one of {1}.".format(flow_control_policy, ", ".join(FLOW_CONTROL_POLICIES)))
+        self.flow_control_window = flow_control_window
+        self.flow_control_policy = flow_control_policy
+        self.sequence = 0
+        # The CreditSubscriber of every flow controlled subscriber by its id, and the sequence of the last credit probe
+        self.credit_subscribers = {}
+        self.credit_probe_sequence = None
+        self.blocked = 0
+        self.failed = 0
+        self.shed = 0
         self.recreate_pub_socket = False
         self.recreate_req_socket = False
+        self.zmq_dealer_endpoints = zmq_dealer_endpoints
+        self.dealer_socket = None
+        self.dealer_monitor = None
+        self.recreate_dealer_socket = False
+        # Guards the DEALER socket and the pending responses since futures may be waited on from several threads.
+        # One waiting thread at a time receives on the socket, the others wait for the condition.
+        self.dealer_lock = RLock()
+        self.dealer_condition = Condition(self.dealer_lock)
+        self.dealer_receiving = False
+        self.dealer_polling = False
+        self.dealer_wakeup_sender = None
+        self.dealer_wakeup_receiver = None
+        self.dealer_poller = None
+        self.pending_responses = {}
+        self.correlation_ids = itertools.count(1)
         self.create_pub_socket()
         self.create_req_socket()
-        # 'Prevent' slow joiner problem
-        time.sleep(0.5)
+        self.create_dealer_socket()
+        # Prevent slow joiner problem
+        if time_out_waiting_for_ready_in_sec:
+            self.wait_ready(time_out_waiting_for_ready_in_sec)
 
     def destroy_req_socket(self):
+        for req_endpoint in self.req_endpoints:
+            req_endpoint.destroy_socket()
+        self.req_endpoints = []
         error_message = None
         if self.req_socket is not None:
             try:
                 self.poller.unregister(self.req_socket)
             except Exception as e:
                 error_message = "Cannot unregister REQ socket to poller. Exception: {0}".format(e)
+            try:
+                self.req_monitor.close()
+            except Exception as e:
+                error_message = "Cannot close monitor of REQ socket. Exception: {0}".format(e)
             try:
                 self.req_socket.setsockopt(zmq.LINGER, 0)
             except Exception as e:
@@ -60,6 +413,41 @@ class ZmqSender(object):
             except Exception as e:
                 error_message = "Cannot close REQ socket. Exception: {0}".format(e)
         self.req_socket = None
+        self.req_monitor = None
+        if error_message is not None:
+            logger.error(error_message)
+
+    def destroy_dealer_socket(self):
+        error_message = None
+        with self.dealer_lock:
+            # The socket cannot be closed while the receiving thread waits for it
+            self.wake_dealer_receiver()
+            while self.dealer_polling:
+                self.dealer_condition.wait()
+            if self.dealer_wakeup_sender is not None:
+                self.dealer_wakeup_sender.close(0)
+                self.dealer_wakeup_receiver.close(0)
+            self.dealer_wakeup_sender = None
+            self.dealer_wakeup_receiver = None
+            self.dealer_poller = None
+            if self.dealer_socket is not None:
+                try:
+                    self.dealer_monitor.close()
+                except Exception as e:
+                    error_message = "Cannot close monitor of DEALER socket. Exception: {0}".format(e)
+                try:
+                    self.dealer_socket.setsockopt(zmq.LINGER, 0)
+                except Exception as e:
+                    error_message = "Cannot set LINGER socket option. Exception: {0}".format(e)
+                try:
+                    logger.debug("Close DEALER socket to %s", self.zmq_dealer_endpoints)
+                    self.dealer_socket.close()
+                except Exception as e:
+                    error_message = "Cannot close DEALER socket. Exception: {0}".format(e)
+            self.dealer_socket = None
+            self.dealer_monitor = None
+            # Responses to requests on the old socket can never arrive anymore
+            self.fail_pending_responses("DEALER socket to {0} destroyed before a response was received.".format(self.zmq_dealer_endpoints))
         if error_message is not None:
             logger.error(error_message)
 
@@ -86,14 +474,17 @@ class ZmqSender(object):
             except Exception as e:
                 error_message = "Cannot close PUB socket. Exception: {0}".format(e)
         self.pub_socket = None
+        self.subscribers = 0
         if error_message is not None:
             logger.error(error_message)
 
     def create_req_socket(self):
-        if self.req_socket is not None:
+        if self.req_socket is not None or self.req_endpoints:
             raise "Want create new REQ socket, but old REQ Socket is not destroyed."
 
-        if self.zmq_req_endpoints:
+        if self.zmq_req_endpoints and len(self.zmq_req_endpoints) > 1:
+            self.req_endpoints = [ReqEndpoint(self.context, endpoint, self.username, self.password, self.metrics) for endpoint in self.zmq_req_endpoints]
+        elif self.zmq_req_endpoints:
             self.req_socket = self.context.socket(zmq.REQ)
             if self.username and self.password:
                 try:
@@ -103,6 +494,7 @@ class ZmqSender(object):
                     # In case of python 2.
                     self.req_socket.setsockopt(zmq.PLAIN_USERNAME, self.username)
                     self.req_socket.setsockopt(zmq.PLAIN_PASSWORD, self.password)
+            self.req_monitor = ConnectionMonitor(self.req_socket, self.zmq_req_endpoints)
             try:
                 for endpoint in self.zmq_req_endpoints:
                     logger.debug("Connect REQ socket to %s", endpoint)
@@ -114,12 +506,48 @@ class ZmqSender(object):
             except Exception as e:
                 raise Exception("Cannot register REQ socket to poller. Exception: {0}".format(e))
 
+    def create_dealer_socket(self):
+        if self.dealer_socket is not None:
+            raise Exception("Want create new DEALER socket, but old DEALER Socket is not destroyed.")
+
+        if self.zmq_dealer_endpoints:
+            self.dealer_socket = self.context.socket(zmq.DEALER)
+            if self.username and self.password:
+                try:
+                    self.dealer_socket.setsockopt_string(zmq.PLAIN_USERNAME, self.username)
+                    self.dealer_socket.setsockopt_string(zmq.PLAIN_PASSWORD, self.password)
+                except TypeError:
+                    # In case of python 2.
+                    self.dealer_socket.setsockopt(zmq.PLAIN_USERNAME, self.username)
+                    self.dealer_socket.setsockopt(zmq.PLAIN_PASSWORD, self.password)
+            self.dealer_monitor = ConnectionMonitor(self.dealer_socket, self.zmq_dealer_endpoints)
+            try:
+                for endpoint in self.zmq_dealer_endpoints:
+                    logger.debug("Connect DEALER socket to %s", endpoint)
+                    self.dealer_socket.connect(endpoint)
+            except Exception as e:
+                raise Exception("Cannot connect DEALER socket to {0}. Exception: {1}".format(self.zmq_dealer_endpoints, e))
+            # The receiving thread waits for the file descriptor of the DEALER socket, or for a sender to wake it
+            wakeup_endpoint = "inproc://zmqrpc-dealer-wakeup-{0}".format(next(DEALER_WAKEUP_IDS))
+            self.dealer_wakeup_receiver = self.context.socket(zmq.PAIR)
+            self.dealer_wakeup_receiver.bind(wakeup_endpoint)
+            self.dealer_wakeup_sender = self.context.socket(zmq.PAIR)
+            self.dealer_wakeup_sender.connect(wakeup_endpoint)
+            self.dealer_poller = zmq.Poller()
+            self.dealer_poller.register(self.dealer_socket.getsockopt(zmq.FD), zmq.POLLIN)
+            self.dealer_poller.register(self.dealer_wakeup_receiver, zmq.POLLIN)
+
     def create_pub_socket(self):
         if self.pub_socket is not None:
             raise "Want create new PUB socket, but old PUB Socket is not destroyed."
 
         if self.zmq_pub_endpoint:
-            self.pub_socket = self.context.socket(zmq.PUB)
+            self.pub_socket = self.context.socket(zmq.XPUB)
+            # Pass on every subscription, also duplicates, so each subscriber can be counted. With libzmq 4.2 and
+            # later every unsubscription of a disconnecting subscriber is passed on as well.
+            self.pub_socket.setsockopt(zmq.XPUB_VERBOSE, 1)
+            if hasattr(zmq, "XPUB_VERBOSER"):
+                self.pub_socket.setsockopt(zmq.XPUB_VERBOSER, 1)
             if self.username and self.password:
                 self.pub_socket.plain_username = self.username
                 self.pub_socket.plain_password = self.password
@@ -131,75 +559,446 @@ class ZmqSender(object):
             except Exception as e:
                 raise Exception("Cannot bind PUB socket to {0}. Exception: {1}".format(self.zmq_pub_endpoint, e))
 
-    def _send_over_pub_socket(self, message):
+    # Counts the subscriptions and unsubscriptions that arrive on the PUB socket within the given time out. A subscriber
+    # subscribes to everything or to the heartbeat next to its topics, so only those subscriptions are counted.
+    # Credit of flow controlled subscribers arrives on the PUB socket as well.
+    def receive_subscriptions(self, time_out_in_sec=0):
+        if self.pub_socket is None or not self.pub_socket.poll(int(time_out_in_sec * 1000), zmq.POLLIN):
+            return
+        while True:
+            try:
+                subscription = self.pub_socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            if subscription[1:2] in (CREDIT_MARKER, CREDIT_ACK_MARKER):
+                self.receive_credit(subscription)
+                continue
+            if subscription[1:] not in (b'', HEARTBEAT_SUBSCRIPTION):
+                continue
+            if subscription[:1] == b'\x01':
+                self.subscribers += 1
+            elif subscription[:1] == b'\x00':
+                self.subscribers = max(0, self.subscribers - 1)
+
+    # A flow controlled subscriber starts with a full window when it subscribes, and is forgotten when it disconnects.
+    # It only acknowledges the messages it receives, so other topics do not use up its credit.
+    # Credit is unsubscribed right after it is subscribed, so only the subscription counts.
+    def receive_credit(self, message):
+        if message[1:2] == CREDIT_ACK_MARKER:
+            credit_subscriber = self.credit_subscribers.get(message[2:-SEQUENCE.size])
+            if message[:1] == b'\x01' and credit_subscriber is not None:
+                credit_subscriber.acknowledge(SEQUENCE.unpack(message[-SEQUENCE.size:])[0])
+        elif message[:1] == b'\x01':
+            subscriber_id, subscriptions = decode_credit_subscription(message[1:])
+            self.credit_subscribers[subscriber_id] = CreditSubscriber(subscriptions)
+        elif message[:1] == b'\x00':
+            subscriber_id, _ = decode_credit_subscription(message[1:])
+            self.credit_subscribers.pop(subscriber_id, None)
+
+    # Returns the most messages a flow controlled subscriber has not acknowledged yet
+    def in_flight(self):
+        return max([credit_subscriber.in_flight() for credit_subscriber in self.credit_subscribers.values()] or [0])
+
+    def has_credit(self):
+        return self.in_flight() < self.flow_control_window
+
+    # Returns True when the message may be published. Without credit it waits for credit, raises or returns False to
+    # shed the message, depending on the flow control policy.
+    def wait_for_credit(self, time_out_in_sec):
+        if self.has_credit():
+            return True
+        self.send_credit_probe()
+        if self.flow_control_policy == "shed":
+            self.shed += 1
+            return False
+        if self.flow_control_policy == "block":
+            self.blocked += 1
+            wait_until = time.time() + time_out_in_sec
+            while not self.has_credit():
+                remaining = wait_until - time.time()
+                if remaining <= 0:
+                    break
+                self.receive_subscriptions(remaining)
+                self.send_credit_probe()
+            if self.has_credit():
+                return True
+        self.failed += 1
+        raise Exception("No credit to publish on {0}: {1} messages in flight. Discarding message.".format(self.zmq_pub_endpoint, self.in_flight()))
+
+    # Numbers the envelope of a flow controlled message and counts it as in flight for the subscribers that receive it
+    def number_message(self, topic):
+        self.sequence += 1
+        envelope = encode_topic(topic, self.sequence)
+        for credit_subscriber in self.credit_subscribers.values():
+            credit_subscriber.sent(envelope, self.sequence)
+        return envelope
+
+    # Sends a heartbeat after everything else as soon as credit runs out. A subscriber that has caught up acknowledges
+    # it, which returns credit that was not returned yet. The probe itself is not counted as in flight, and no new probe
+    # is sent while a subscriber has not acknowledged the messages before the last one.
+    def send_credit_probe(self):
+        if self.credit_probe_sequence is not None and any(credit_subscriber.unacknowledged and credit_subscriber.unacknowledged[0] < self.credit_probe_sequence for credit_subscriber in self.credit_subscribers.values()):
+            return
+        self.sequence += 1
+        self.credit_probe_sequence = self.sequence
+        send_message(self.pub_socket, "zmq_sub_heartbeat", [encode_topic('', self.sequence)])
+
+    # Returns the counters of the flow controlled PUB socket. in_flight is the queue depth of the slowest subscriber.
+    def flow_control_stats(self):
+        self.receive_subscriptions()
+        return {"subscribers": len(self.credit_subscribers), "sequence": self.sequence, "in_flight": self.in_flight(), "blocked": self.blocked, "failed": self.failed, "shed": self.shed}
+
+    # Waits until the peers are connected: at least min_peers subscribers (default 1) on the PUB socket, and
+    # min_peers endpoints (default all) of the REQ and DEALER sockets. Returns False when that did not happen in time.
+    def wait_ready(self, time_out_in_sec=10, min_peers=None):
+        monitors = [monitor for monitor in (self.req_monitor, self.dealer_monitor) if monitor is not None]
+        monitors += [req_endpoint.monitor for req_endpoint in self.req_endpoints]
+        poller = zmq.Poller()
+        if self.pub_socket is not None:
+            poller.register(self.pub_socket, zmq.POLLIN)
+        for monitor in monitors:
+            if monitor.monitor_socket is not None:
+                poller.register(monitor.monitor_socket, zmq.POLLIN)
+        wait_until = time.time() + time_out_in_sec
+        while True:
+            self.receive_subscriptions()
+            for monitor in monitors:
+                monitor.poll()
+            if self.is_ready(min_peers):
+                return True
+            remaining = wait_until - time.time()
+            if remaining <= 0:
+                logger.debug("Peers not connected within %s seconds", time_out_in_sec)
+                return False
+            poller.poll(int(remaining * 1000) + 1)
+
+    def is_ready(self, min_peers=None):
+        if self.pub_socket is not None and self.subscribers < (1 if min_peers is None else min_peers):
+            return False
+        for monitor in (self.req_monitor, self.dealer_monitor):
+            if monitor is not None and not monitor.is_ready(min_peers):
+                return False
+        if self.req_endpoints:
+            endpoints = sum(len(req_endpoint.monitor.endpoints) for req_endpoint in self.req_endpoints)
+            connected_endpoints = sum(len(req_endpoint.monitor.connected_endpoints) for req_endpoint in self.req_endpoints)
+            if connected_endpoints < min(endpoints if min_peers is None else min_peers, endpoints):
+                return False
+        return True
+
+    # Returns a tuple of the message to send to the peer of the given ConnectionMonitor, or to unknown peers without
+    # one, and whether the response tells which compressors the peer supports. The message is compressed when the peer
+    # listed the compression of the sender, and decompressed when it did not list the compression of the message.
+    # Servers list their compressors in the response to an uncompressed call worth compressing.
+    def prepare_message(self, message, monitor=None):
+        try:
+            compression = get_message_compression(message)
+        except Exception:
+            return message, False
+        if compression is None and self.compression is None:
+            return message, False
+        peer_compressors = monitor.get_peer_compressors() if monitor is not None else None
+        if compression is not None:
+            if compression in (peer_compressors or ()):
+                return message, False
+            message = decompress_message(message)
+        elif self.compression in (peer_compressors or ()):
+            return compress_message(message, self.compression, self.compression_threshold), False
+        learns_compressors = self.compression is not None and monitor is not None and peer_compressors is None and get_advertised_compressors(message) is not None
+        return message, learns_compressors
+
+    def _send_over_pub_socket(self, message, topic=None, time_out_in_sec=60):
         if self.pub_socket is not None:
+            message, _ = self.prepare_message(message)
+            # Keeps subscriptions from piling up on the socket
+            self.receive_subscriptions()
+            envelope = [encode_topic(topic)] if topic is not None else None
+            if self.flow_control_window is not None:
+                if not self.wait_for_credit(time_out_in_sec):
+                    return
+                envelope = [self.number_message(topic or '')]
             try:
-                self.pub_socket.send_string(message)
+                size_in_bytes = send_message(self.pub_socket, message, envelope)
             except Exception as e:
                 self.recreate_pub_socket = True
+                self.metrics.record("failure", self.zmq_pub_endpoint)
                 raise Exception("Cannot send message on PUB socket. Highly exceptional. Mark PUB socket for renewal. Consider this message lost. Exception: {0}".format(e))
+            self.metrics.record("publish", self.zmq_pub_endpoint, size_in_bytes=size_in_bytes)
 
-    def handle_response(self, response_message_json):
-        try:
-            response_message_dict = json.loads(response_message_json)
-        except:
-            raise Exception("Marshalling error: Response is not a json message")
-        else:
-            if "status_code" in response_message_dict:
-                if response_message_dict["status_code"] == 200 and "response_message" in response_message_dict:
-                    return response_message_dict["response_message"]
-                elif response_message_dict["status_code"] != 200 and "status_message" in response_message_dict:
-                    raise Exception(response_message_dict["status_message"])
-                elif response_message_dict["status_code"] != 200 and "status_message" not in response_message_dict:
-                    raise Exception("Error occured with code {0}".format(response_message_dict["status_code"]))
-            else:
-                raise Exception("No status_code in response")
+    def handle_response(self, response_message):
+        return parse_response_message(response_message)
 
     def _send_over_req_socket(self, message, time_out_waiting_for_response_in_sec=10):
         if self.req_socket is not None:
+            endpoint = ",".join(self.zmq_req_endpoints)
+            message, learns_compressors = self.prepare_message(message, self.req_monitor)
+            start_time = time.time()
             try:
-                self.req_socket.send_string(message)
+                size_in_bytes = send_message(self.req_socket, message)
             except Exception as e:
                 self.recreate_req_socket = True
+                self.metrics.record("failure", endpoint)
                 raise Exception("Cannot send message on REQ socket. This is very exceptional. Please check logs. Marking REQ socket to be recreated on next try. Message can be considered lost. Exception: {0}".format(e))
             else:
+                self.metrics.record("request", endpoint, size_in_bytes=size_in_bytes)
                 # Wait for given time to receive response.
-                start_time = time.time()
                 while start_time + time_out_waiting_for_response_in_sec > time.time():
                     # X seconds timeout before quiting on waiting for response
                     req_socks = dict(self.poller.poll(1000))
                     if req_socks.get(self.req_socket) == zmq.POLLIN:
                         try:
-                            response_message_json = self.req_socket.recv_string()
+                            frames = recv_frames(self.req_socket)
                         except Exception as e:
                             logger.error("Could not receive message from socket. Marking REQ socket to be recreated on next try. Exception: %s", e)
                             self.recreate_req_socket = True
+                            self.metrics.record("failure", endpoint)
                         else:
-                            return self.handle_response(response_message_json)
+                            self.metrics.record("response", endpoint, time.time() - start_time, frames_size(frames))
+                            response_message = frames_to_message(frames)
+                            if learns_compressors:
+                                self.req_monitor.set_peer_compressors(parse_advertised_compressors(response_message))
+                            return self.handle_response(response_message)
                 # Some unexpected socket related error occurred. Recreate the REQ socket.
                 self.recreate_req_socket = True
+                self.metrics.record("timeout", endpoint, time.time() - start_time)
                 raise Exception("No response received on ZMQ Request to end point {0} in {1} seconds. Discarding message. Marking REQ socket to be recreated on next try.".format(self.zmq_req_endpoints, time_out_waiting_for_response_in_sec))
 
-    def send(self, message, time_out_waiting_for_response_in_sec=60):
+    # Picks the endpoint for the next request and counts the request as in flight on it
+    def select_req_endpoint(self):
+        with self.balancing_lock:
+            now = time.time()
+            candidates = []
+            for req_endpoint in self.req_endpoints:
+                if req_endpoint.ejected_until is None:
+                    candidates.append(req_endpoint)
+                elif req_endpoint.ejected_until <= now and not req_endpoint.probing:
+                    # Probe an ejected endpoint with this request
+                    req_endpoint.probing = True
+                    req_endpoint.in_flight += 1
+                    return req_endpoint
+            if not candidates:
+                raise Exception("All REQ endpoints {0} are ejected after repeated failures. Discarding message.".format(self.zmq_req_endpoints))
+            # Failures are left to ejection: an endpoint that failed once gets requests again, which reset its failures
+            least_in_flight = min(candidate.in_flight for candidate in candidates)
+            req_endpoint = choose_weighted_round_robin([candidate for candidate in candidates if candidate.in_flight == least_in_flight])
+            req_endpoint.in_flight += 1
+            return req_endpoint
+
+    # Updates the statistics of the endpoint with the latency of a response, or a failure when latency_in_sec is None
+    def complete_req_request(self, req_endpoint, latency_in_sec):
+        with self.balancing_lock:
+            req_endpoint.in_flight -= 1
+            if latency_in_sec is not None:
+                if req_endpoint.latency_in_sec is None:
+                    req_endpoint.latency_in_sec = latency_in_sec
+                else:
+                    req_endpoint.latency_in_sec = 0.7 * req_endpoint.latency_in_sec + 0.3 * latency_in_sec
+                if req_endpoint.ejected_until is not None:
+                    logger.info("REQ endpoint %s responds again. Using it again.", req_endpoint.endpoint)
+                req_endpoint.failures = 0
+                req_endpoint.ejected_until = None
+                req_endpoint.probing = False
+                return
+            req_endpoint.failures += 1
+            if req_endpoint.probing or req_endpoint.failures >= self.failures_before_ejection:
+                logger.warning("REQ endpoint %s failed %s times in a row. Ejecting it for %s seconds.", req_endpoint.endpoint, req_endpoint.failures, self.ejection_time_in_sec)
+                req_endpoint.ejected_until = time.time() + self.ejection_time_in_sec
+                req_endpoint.ejections += 1
+                req_endpoint.probing = False
+
+    def _send_over_req_endpoints(self, message, time_out_waiting_for_response_in_sec=10):
+        req_endpoint = self.select_req_endpoint()
+        start_time = time.time()
+        try:
+            response_message = req_endpoint.send(message, time_out_waiting_for_response_in_sec, self.prepare_message)
+        except TimeoutError:
+            # The endpoint was busy with other requests, which says nothing about its health
+            with self.balancing_lock:
+                req_endpoint.in_flight -= 1
+                req_endpoint.probing = False
+            raise
+        except Exception:
+            self.complete_req_request(req_endpoint, None)
+            raise
+        self.complete_req_request(req_endpoint, time.time() - start_time)
+        return self.handle_response(response_message)
+
+    # Returns the statistics of every REQ endpoint when several REQ endpoints are used
+    def req_endpoint_stats(self):
+        with self.balancing_lock:
+            return [req_endpoint.stats() for req_endpoint in self.req_endpoints]
+
+    def _send_over_dealer_socket(self, message, time_out_waiting_for_response_in_sec=10):
+        with self.dealer_lock:
+            correlation_id = struct.pack("!Q", next(self.correlation_ids))
+            response_future = ZmqResponseFuture(self, correlation_id, time_out_waiting_for_response_in_sec)
+            # Responses over a DEALER socket with several endpoints do not tell which peer sent them
+            message, response_future.learns_compressors = self.prepare_message(message, self.dealer_monitor if len(self.zmq_dealer_endpoints) == 1 else None)
+            try:
+                # The correlation id travels as envelope frame, which any REP or ROUTER socket returns untouched
+                size_in_bytes = send_message(self.dealer_socket, message, [correlation_id, b""])
+            except Exception as e:
+                self.recreate_dealer_socket = True
+                self.metrics.record("failure", ",".join(self.zmq_dealer_endpoints))
+                raise Exception("Cannot send message on DEALER socket. Marking DEALER socket to be recreated on next try. Message can be considered lost. Exception: {0}".format(e))
+            self.metrics.record("request", ",".join(self.zmq_dealer_endpoints), size_in_bytes=size_in_bytes)
+            self.pending_responses[correlation_id] = response_future
+            # Sending may take the readiness of the socket that the receiving thread waits for
+            self.wake_dealer_receiver()
+            return response_future
+
+    # Resolves the futures of all responses that are available within the given time out and returns how many arrived.
+    # The DEALER socket is locked meanwhile, so threads that share the sender only call it without a time out.
+    def receive_dealer_responses(self, time_out_in_sec=0):
+        received = 0
+        with self.dealer_lock:
+            if self.dealer_socket is None or not self.dealer_socket.poll(int(time_out_in_sec * 1000), zmq.POLLIN):
+                return received
+            while True:
+                try:
+                    frames = recv_frames(self.dealer_socket, zmq.NOBLOCK)
+                except zmq.Again:
+                    return received
+                except Exception as e:
+                    logger.error("Could not receive message from DEALER socket. Marking DEALER socket to be recreated on next try. Exception: %s", e)
+                    self.recreate_dealer_socket = True
+                    self.metrics.record("failure", ",".join(self.zmq_dealer_endpoints))
+                    return received
+                received += 1
+                if len(frames) < 3 or frames[1] != b"":
+                    logger.warning("Discarding incorrectly enveloped response on DEALER socket")
+                    continue
+                response_future = self.pending_responses.pop(frames[0], None)
+                if response_future is None:
+                    logger.debug("Discarding response for unknown or timed out request")
+                    continue
+                self.metrics.record("response", ",".join(self.zmq_dealer_endpoints), time.time() - response_future.start_time, frames_size(frames[2:]))
+                response_message = frames_to_message(frames[2:])
+                if response_future.learns_compressors and self.dealer_monitor is not None:
+                    self.dealer_monitor.set_peer_compressors(parse_advertised_compressors(response_message))
+                try:
+                    response_future.set_result(self.handle_response(response_message))
+                except Exception as e:
+                    response_future.set_exception(e)
+                self.dealer_condition.notify_all()
+
+    def expire_pending_responses(self):
+        with self.dealer_lock:
+            now = time.time()
+            for correlation_id, response_future in list(self.pending_responses.items()):
+                if response_future.deadline <= now:
+                    del self.pending_responses[correlation_id]
+                    self.metrics.record("timeout", ",".join(self.zmq_dealer_endpoints), now - response_future.start_time)
+                    response_future.set_exception(Exception("No response received on ZMQ Request to end point {0} in {1} seconds. Discarding message.".format(self.zmq_dealer_endpoints, response_future.time_out_waiting_for_response_in_sec)))
+
+    def fail_pending_responses(self, error_message):
+        with self.dealer_lock:
+            pending_responses = self.pending_responses
+            self.pending_responses = {}
+        for response_future in pending_responses.values():
+            self.metrics.record("failure", ",".join(self.zmq_dealer_endpoints))
+            response_future.set_exception(Exception(error_message))
+
+    # Drives the DEALER socket until the given future is resolved or the (optional) timeout passed.
+    # Responses to other outstanding requests that come in meanwhile resolve their own futures.
+    # One waiting thread receives and the others wait until it resolved their future or stopped receiving. The socket
+    # is not locked while the receiving thread waits for it, so other threads can send meanwhile.
+    def wait_for_response(self, response_future, timeout=None):
+        wait_until = None if timeout is None else time.time() + timeout
+        while not response_future.done():
+            self.expire_pending_responses()
+            if response_future.done():
+                return
+            poll_until = response_future.deadline if wait_until is None else min(response_future.deadline, wait_until)
+            remaining = poll_until - time.time()
+            if remaining <= 0:
+                if wait_until is not None and wait_until <= response_future.deadline:
+                    raise TimeoutError()
+                continue
+            with self.dealer_condition:
+                if self.dealer_receiving:
+                    self.dealer_condition.wait(remaining)
+                    continue
+                self.dealer_receiving = True
+            try:
+                if not self.receive_dealer_responses():
+                    self.wait_for_dealer_socket(remaining)
+                    self.receive_dealer_responses()
+            finally:
+                with self.dealer_condition:
+                    self.dealer_receiving = False
+                    self.dealer_condition.notify_all()
+
+    # Waits at most the given time out until the DEALER socket may have a response or a sender woke the receiving
+    # thread. The file descriptor of the socket only signals changes, so the events of the socket are checked first.
+    def wait_for_dealer_socket(self, time_out_in_sec):
+        with self.dealer_lock:
+            if self.dealer_socket is None or self.dealer_socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                return
+            self.dealer_polling = True
+            dealer_poller = self.dealer_poller
+            dealer_wakeup_receiver = self.dealer_wakeup_receiver
+        try:
+            if dict(dealer_poller.poll(int(time_out_in_sec * 1000))).get(dealer_wakeup_receiver):
+                while dealer_wakeup_receiver.poll(0):
+                    dealer_wakeup_receiver.recv()
+        finally:
+            with self.dealer_condition:
+                self.dealer_polling = False
+                self.dealer_condition.notify_all()
+
+    # Wakes the thread that waits for the DEALER socket, if any. Called with the DEALER socket locked.
+    def wake_dealer_receiver(self):
+        if self.dealer_polling and self.dealer_wakeup_sender is not None:
+            try:
+                self.dealer_wakeup_sender.send(b'', zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+
+    # Sends a message over the DEALER socket without waiting for the response. Returns a ZmqResponseFuture.
+    def send_async(self, message, time_out_waiting_for_response_in_sec=60):
+        if self.recreate_dealer_socket:
+            self.destroy_dealer_socket()
+            self.create_dealer_socket()
+            self.recreate_dealer_socket = False
+            self.metrics.record("recreate", ",".join(self.zmq_dealer_endpoints))
+
+        if self.dealer_socket is None:
+            raise Exception("Cannot send asynchronously. No DEALER endpoints provided.")
+        return self._send_over_dealer_socket(message, time_out_waiting_for_response_in_sec)
+
+    # A topic is only used on the PUB socket. Subscribers that subscribe to topics only get the messages of their topics.
+    # A flow controlled PUB socket waits at most time_out_waiting_for_response_in_sec for credit.
+    def send(self, message, time_out_waiting_for_response_in_sec=60, topic=None):
         # Create sockets if needed. Raise an exception if any problems are encountered
         if self.recreate_pub_socket:
             self.destroy_pub_socket()
             self.create_pub_socket()
             self.recreate_pub_socket = False
+            self.metrics.record("recreate", self.zmq_pub_endpoint)
 
         if self.recreate_req_socket:
             self.destroy_req_socket()
             self.create_req_socket()
             self.recreate_req_socket = False
+            self.metrics.record("recreate", ",".join(self.zmq_req_endpoints))
 
         # Sockets must exist otherwise we would not be here...
         # Any errors in the following lines will throw an error that must be catched
-        self._send_over_pub_socket(message)
+        self._send_over_pub_socket(message, topic, time_out_waiting_for_response_in_sec)
+        if self.dealer_socket is not None or self.recreate_dealer_socket:
+            return self.send_async(message, time_out_waiting_for_response_in_sec).result()
+        if self.req_endpoints:
+            return self._send_over_req_endpoints(message, time_out_waiting_for_response_in_sec)
         return self._send_over_req_socket(message, time_out_waiting_for_response_in_sec)
 
+    # Returns the counters, bytes and round trip times per endpoint and in total, see ZmqClientMetrics
+    def client_stats(self):
+        return self.metrics.snapshot()
+
     def send_heartbeat(self):
         self.send("zmq_sub_heartbeat")
 
     def destroy(self):
+        self.destroy_dealer_socket()
         self.destroy_req_socket()
         self.destroy_pub_socket()
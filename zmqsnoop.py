@@ -15,11 +15,13 @@ import argparse
 import sys
 import signal
 import zmq
+from zmqrpc.ZmqCodec import create_subscriptions, frames_to_message, split_topic
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Reads and prints messages from a remote pub socket.')
     parser.add_argument('--sub', nargs='+', required=True, help='The PUB endpoint')
+    parser.add_argument('--topic', nargs='+', required=False, help='Only print messages published on these topics (and heartbeats)')
 
     args = parser.parse_args()
     print("Starting zmqsnoop...")
@@ -36,14 +38,20 @@ if __name__ == '__main__':
 
         # Subscribe to all provided end-points
         sub_socket = context.socket(zmq.SUB)
-        sub_socket.setsockopt(zmq.SUBSCRIBE, b'')
+        for subscription in create_subscriptions(args.topic):
+            sub_socket.setsockopt(zmq.SUBSCRIBE, subscription)
         for sub in args.sub:
             sub_socket.connect(sub)
             print("Connected to {0}".format(sub))
         while True:
             # Process all parts of the message
+            message_lines = []
             try:
-                message_lines = sub_socket.recv_string().splitlines()
+                topic, frames = split_topic(sub_socket.recv_multipart())
+                message = frames_to_message(frames)
+                message_lines = message.splitlines() if not isinstance(message, bytes) else [repr(message)]
+                if topic is not None:
+                    print("[{0}]".format(topic))
             except Exception as e:
                 print("Error occured with exception {0}".format(e))
             for line in message_lines: